@@ -0,0 +1,9 @@
+"""
+Offline micro-benchmarks for the lib package.
+
+Run a benchmark as a module from the repository root, e.g.:
+    uv run python -m benchmarks.bench_config_parser
+
+`benchmarks.suite` runs the startup and hot-path benchmarks together and can
+save the results as JSON, or compare them with an earlier run (`make bench`).
+"""
@@ -0,0 +1,122 @@
+"""Benchmark AccessLogFormatter.formatMessage against the previous implementation"""
+
+import argparse
+import http
+import logging
+import timeit
+
+from lib.logger_extras import AccessLogFieldsFilter, AccessLogFormatter
+
+FMT = (
+    "[{asctime}] [{log_color}{levelname:<7}{reset}] {name}: "
+    "{method} {path} HTTP/{http_version} "
+    "{status_color}{status_code} {reason_phrase}{reset}"
+)
+LOG_COLORS = {
+    "DEBUG": "cyan",
+    "INFO": "green",
+    "WARNING": "yellow",
+    "ERROR": "red",
+    "CRITICAL": "bold_red",
+}
+
+
+class BaselineAccessLogFormatter(AccessLogFormatter):
+    """The formatMessage implementation before the fast path, for comparison."""
+
+    def formatMessage(self, record: logging.LogRecord) -> str:  # noqa: N802
+        if record.args is None and isinstance(record.msg, str):
+            match = self.LOG_PATTERN.match(record.msg)
+            if match:
+                record.client_addr = match.group("client_addr")
+                record.method = match.group("method")
+                record.path = match.group("path")
+                record.http_version = match.group("http_version")
+                record.status_code = int(match.group("status_code"))
+        status_code = getattr(record, "status_code", None)
+        if isinstance(status_code, int):
+            record.reason_phrase = http.HTTPStatus(status_code).phrase
+            record.status_color = self.baseline_status_color(status_code)
+        return self.colored_formatter.format(record)
+
+    def baseline_status_color(self, status_code: int) -> str:
+        if self.HTTP_STATUS_OK_MIN <= status_code <= self.HTTP_STATUS_OK_MAX:
+            return self.ANSI_COLOR_CODES.get(self.STATUS_COLORS["2xx"], "")
+        if (
+            self.HTTP_STATUS_REDIRECT_MIN
+            <= status_code
+            <= self.HTTP_STATUS_REDIRECT_MAX
+        ):
+            return self.ANSI_COLOR_CODES.get(self.STATUS_COLORS["3xx"], "")
+        if (
+            self.HTTP_STATUS_CLIENT_ERROR_MIN
+            <= status_code
+            <= self.HTTP_STATUS_CLIENT_ERROR_MAX
+        ):
+            return self.ANSI_COLOR_CODES.get(self.STATUS_COLORS["4xx"], "")
+        if status_code >= self.HTTP_STATUS_SERVER_ERROR_MIN:
+            return self.ANSI_COLOR_CODES.get(self.STATUS_COLORS["5xx"], "")
+        return ""
+
+
+def make_record(*, queued: bool) -> logging.LogRecord:
+    """
+    Build a uvicorn-style access record.  `queued` mimics a record that went
+    through `QueueHandler.prepare` (message pre-formatted, args dropped).
+    """
+    args = ("10.42.0.1:51234", "GET", "/healthcheck", "1.1", 200)
+    record = logging.LogRecord(
+        "uvicorn.access",
+        logging.INFO,
+        __file__,
+        1,
+        '%s - "%s %s HTTP/%s" %d',
+        args,
+        None,
+    )
+    if queued:
+        AccessLogFieldsFilter().filter(record)
+        record.msg = record.getMessage()
+        record.args = None
+    return record
+
+
+def run(number: int) -> dict[str, float]:
+    """Return the mean time per formatted record (in µs) for each variant."""
+    baseline = BaselineAccessLogFormatter(fmt=FMT, log_colors=LOG_COLORS)
+    fast = AccessLogFormatter(fmt=FMT, log_colors=LOG_COLORS)
+
+    def queued_baseline() -> None:
+        record = make_record(queued=True)
+        record.status_code = None  # the baseline re-parses the message
+        baseline.format(record)
+
+    def regex_fallback() -> None:
+        record = make_record(queued=True)
+        record.status_code = None
+        fast.format(record)
+
+    timings = {
+        "record construction only": timeit.timeit(
+            lambda: make_record(queued=True), number=number
+        ),
+        "baseline (regex)": timeit.timeit(queued_baseline, number=number),
+        "fast path (regex fallback)": timeit.timeit(regex_fallback, number=number),
+        "fast path (structured args)": timeit.timeit(
+            lambda: fast.format(make_record(queued=True)), number=number
+        ),
+    }
+    return {name: total / number * 1_000_000 for name, total in timings.items()}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--number", type=int, default=50_000)
+    args = parser.parse_args()
+
+    for name, us in run(args.number).items():
+        print(f"{name:<30} {us:8.3f} µs/record")  # noqa: T201
+
+
+if __name__ == "__main__":
+    main()
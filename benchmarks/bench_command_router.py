@@ -0,0 +1,86 @@
+"""Benchmark CommandRouter dispatch against a linear startswith chain"""
+
+import argparse
+import asyncio
+import random
+import string
+import time
+from typing import Any
+
+from lib.commands import CommandContext, CommandRouter
+
+
+class FakeMessage:
+    """Just enough of `discord.Message` for dispatch."""
+
+    def __init__(self, content: str) -> None:
+        self.content: str = content
+
+
+async def noop(ctx: CommandContext) -> None:  # noqa: ARG001
+    await asyncio.sleep(0)
+
+
+def make_command_names(count: int) -> list[str]:
+    rng = random.Random(0)  # noqa: S311
+    names: set[str] = set()
+    while len(names) < count:
+        names.add("".join(rng.choices(string.ascii_lowercase, k=rng.randint(3, 10))))
+    return sorted(names)
+
+
+def make_messages(names: list[str], count: int) -> list[Any]:
+    """Mostly chatter (which is never a command), with some commands mixed in."""
+    rng = random.Random(1)  # noqa: S311
+    messages = []
+    for _ in range(count):
+        if rng.random() < 0.1:  # noqa: PLR2004
+            messages.append(FakeMessage(f"{rng.choice(names)} some args here"))
+        else:
+            messages.append(FakeMessage("Did anyone try the new garage build? " * 3))
+    return messages
+
+
+async def linear_dispatch(names: list[str], message: Any) -> bool:  # noqa: ANN401
+    """The previous approach: lowercase the body, then check each command."""
+    content = message.content.lower()
+    for name in names:
+        if content.startswith(name):
+            await asyncio.sleep(0)  # stand-in for the handler call
+            return True
+    return False
+
+
+async def run(commands: int, messages: int) -> dict[str, float]:
+    """Return messages dispatched per second for each strategy."""
+    names = make_command_names(commands)
+    batch = make_messages(names, messages)
+    router = CommandRouter()
+    for name in names:
+        router.add(name, noop)
+
+    start = time.perf_counter()
+    for message in batch:
+        await linear_dispatch(names, message)
+    linear = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for message in batch:
+        await router.dispatch(message)
+    routed = time.perf_counter() - start
+    return {"linear startswith": messages / linear, "CommandRouter": messages / routed}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--commands", type=int, default=500)
+    parser.add_argument("--messages", type=int, default=100_000)
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args.commands, args.messages))
+    for name, rate in results.items():
+        print(f"{name:<20} {rate:14,.0f} messages/s")  # noqa: T201
+
+
+if __name__ == "__main__":
+    main()
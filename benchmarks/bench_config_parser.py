@@ -0,0 +1,84 @@
+"""Benchmark compiled vs. naive config resolution on synthetic configs"""
+
+import argparse
+import os
+import timeit
+from typing import Any
+
+from lib import config_parser
+
+
+def build_synthetic_config(handlers: int) -> dict[str, Any]:
+    """
+    Build a logger-style config with `handlers` handlers, mixing token-free
+    subtrees with @env, @format and @math values.
+    """
+    config: dict[str, Any] = {
+        "version": 1,
+        "formatters": {
+            f"formatter_{i}": {
+                "format": "[{asctime}] [{levelname:<7}] {name}: {message}",
+                "style": "{",
+            }
+            for i in range(handlers)
+        },
+        "handlers": {},
+        "loggers": {},
+    }
+    for i in range(handlers):
+        config["handlers"][f"handler_{i}"] = {
+            "class": "logging.handlers.RotatingFileHandler",
+            "backupCount": 5,
+            "filename": f"@format {{@env BENCH_LOG_DIR,log}}/{{@env BENCH_FILE_{i % 10},app}}.log",  # noqa: E501
+            "formatter": f"formatter_{i}",
+            "level": f"@env BENCH_LEVEL_{i % 10},INFO",
+            "maxBytes": f"@math 1024 * 1024 * {i % 20 + 1}",
+        }
+        config["loggers"][f"logger_{i}"] = {
+            "handlers": [f"handler_{i}"],
+            "level": "INFO",
+            "propagate": False,
+        }
+    return config
+
+
+def run(handlers: int, number: int) -> dict[str, float]:
+    """Return the mean time per resolution (in ms) for each strategy."""
+    config = build_synthetic_config(handlers)
+    compiled = config_parser.compile_config(config)
+    compiled.resolve()
+
+    def env_change() -> None:
+        # Flip one variable so only the nodes that depend on it are re-resolved
+        os.environ["BENCH_LEVEL_0"] = (
+            "DEBUG" if os.environ.get("BENCH_LEVEL_0") != "DEBUG" else "INFO"
+        )
+        compiled.resolve()
+
+    timings = {
+        "naive": timeit.timeit(
+            lambda: config_parser.resolve_nested_dict(config), number=number
+        ),
+        "compile+resolve": timeit.timeit(
+            lambda: config_parser.compile_config(config).resolve(), number=number
+        ),
+        "compiled (no change)": timeit.timeit(compiled.resolve, number=number),
+        "compiled (1 env change)": timeit.timeit(env_change, number=number),
+    }
+    return {name: total / number * 1000 for name, total in timings.items()}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--number", type=int, default=200)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000])
+    args = parser.parse_args()
+
+    for size in args.sizes:
+        print(f"{size} handlers:")  # noqa: T201
+        for name, ms in run(size, args.number).items():
+            print(f"  {name:<26} {ms:9.4f} ms")  # noqa: T201
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Benchmark BatchingFileHandler and CompressingFileHandler throughput against
+RotatingFileHandler
+"""
+
+import argparse
+import logging
+import logging.handlers
+import tempfile
+import time
+from pathlib import Path
+
+from lib.logger_extras import BatchingFileHandler, CompressingFileHandler
+
+FORMAT = "[{asctime}] [{levelname:<7}] {name}: {message}"
+
+
+def make_records(count: int) -> list[logging.LogRecord]:
+    return [
+        logging.LogRecord(
+            "discord.gateway",
+            logging.INFO,
+            __file__,
+            1,
+            "Shard ID %s has successfully RESUMED session %s.",
+            (None, f"{i:032x}"),
+            None,
+        )
+        for i in range(count)
+    ]
+
+
+def measure(handler: logging.Handler, records: list[logging.LogRecord]) -> float:
+    """Return records per second, including the final flush to disk."""
+    handler.setFormatter(logging.Formatter(FORMAT, style="{"))
+    start = time.perf_counter()
+    for record in records:
+        handler.handle(record)
+    handler.flush()
+    elapsed = time.perf_counter() - start
+    handler.close()
+    return len(records) / elapsed
+
+
+def run(count: int, max_bytes: int) -> dict[str, float]:
+    records = make_records(count)
+    with tempfile.TemporaryDirectory() as tmp:
+        return {
+            "RotatingFileHandler": measure(
+                logging.handlers.RotatingFileHandler(
+                    Path(tmp, "rotating.log"),
+                    maxBytes=max_bytes,
+                    backupCount=5,
+                    encoding="utf-8",
+                ),
+                records,
+            ),
+            "BatchingFileHandler": measure(
+                BatchingFileHandler(
+                    str(Path(tmp, "batching.log")), maxBytes=max_bytes, backupCount=5
+                ),
+                records,
+            ),
+            # Rotated segments are compressed on a background thread
+            "CompressingFileHandler": measure(
+                CompressingFileHandler(
+                    str(Path(tmp, "compressing.log")), maxBytes=max_bytes, backupCount=5
+                ),
+                records,
+            ),
+        }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--count", type=int, default=200_000)
+    parser.add_argument("--max-bytes", type=int, default=1024 * 1024 * 10)
+    args = parser.parse_args()
+
+    for name, rate in run(args.count, args.max_bytes).items():
+        print(f"{name:<22} {rate:12,.0f} records/s")  # noqa: T201
+
+
+if __name__ == "__main__":
+    main()
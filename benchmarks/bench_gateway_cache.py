@@ -0,0 +1,127 @@
+"""
+Measure the memory discord.py's caches use for one large guild, with
+`Intents.all()` versus the intents derived from DiscordBot's handlers.
+
+The guild is a synthetic GUILD_CREATE payload (members plus presences, as
+Discord sends for a guild when the members and presences intents are on), fed
+straight into the client's connection state, so no network is needed.  For
+the live bot, compare `process_resident_memory_bytes` on /metrics or the RSS
+logged at startup before and after changing BOT_INTENTS.
+"""
+
+import argparse
+import asyncio
+import gc
+import tracemalloc
+from typing import Any
+
+import discord
+
+from lib.bot import DiscordBot
+from lib.intents import (
+    cache_options,
+    handled_events,
+    intents_for_events,
+    resolve_max_messages,
+)
+
+GUILD_ID = "1000"
+USER_ID_BASE = 10**17
+
+
+def make_guild(members: int) -> dict[str, Any]:
+    """A GUILD_CREATE payload for a guild with `members` online members."""
+    return {
+        "id": GUILD_ID,
+        "name": "garage",
+        "member_count": members,
+        "large": True,
+        "members": [
+            {
+                "user": {
+                    "id": str(USER_ID_BASE + i),
+                    "username": f"user{i}",
+                    "global_name": f"User {i}",
+                    "discriminator": "0",
+                    "avatar": None,
+                },
+                "roles": [],
+                "joined_at": "2024-01-01T00:00:00+00:00",
+                "nick": None,
+                "deaf": False,
+                "mute": False,
+                "flags": 0,
+            }
+            for i in range(members)
+        ],
+        "presences": [
+            {
+                "user": {"id": str(USER_ID_BASE + i)},
+                "status": "online",
+                "activities": [{"name": "Factorio", "type": 0}],
+                "client_status": {"desktop": "online"},
+            }
+            for i in range(members)
+        ],
+        "roles": [
+            {
+                "id": GUILD_ID,
+                "name": "@everyone",
+                "permissions": "0",
+                "position": 0,
+                "color": 0,
+                "hoist": False,
+                "managed": False,
+                "mentionable": False,
+            }
+        ],
+        "channels": [],
+        "emojis": [],
+        "stickers": [],
+        "features": [],
+    }
+
+
+async def measure(intents: discord.Intents, members: int) -> tuple[int, int]:
+    """Return (cached members, bytes allocated) for loading the guild."""
+    client = DiscordBot(
+        intents=intents, **cache_options(intents, resolve_max_messages(DiscordBot))
+    )
+    payload = make_guild(members)
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        # What the gateway's GUILD_CREATE handler does with the payload
+        guild = client._connection._add_guild_from_data(payload)  # noqa: SLF001
+        after = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    return len(guild.members), after - before
+
+
+async def run(members: int) -> dict[str, tuple[int, int]]:
+    """Return (cached members, bytes) for each intent configuration."""
+    return {
+        "Intents.all()": await measure(discord.Intents.all(), members),
+        "handler-derived": await measure(
+            intents_for_events(handled_events(DiscordBot)), members
+        ),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--members", type=int, default=20_000)
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args.members))
+    for name, (cached, allocated) in results.items():
+        print(  # noqa: T201
+            f"{name:>16}: {cached:>7,} members cached, "
+            f"{allocated / 2**20:8.2f} MiB allocated"
+        )
+
+
+if __name__ == "__main__":
+    main()
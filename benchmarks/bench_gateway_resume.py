@@ -0,0 +1,363 @@
+"""
+Measure the bot's time to ready when it identifies (READY, then a GUILD_CREATE
+per guild) versus when it resumes the session saved by the previous run, against
+a local fake Discord gateway and API.
+
+Each round runs three bots in turn on a new state store: one that
+identifies and saves its session on close, one that resumes it (and gets the
+messages sent while no bot was connected replayed), and one whose saved
+session the gateway has forgotten, which falls back to identifying.
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import statistics
+import tempfile
+import time
+from pathlib import Path
+from typing import Any
+
+import discord
+import yarl
+from aiohttp import WSMsgType, web
+from discord.gateway import DiscordWebSocket
+
+from lib.bot import DiscordBot
+from lib.intents import cache_options, handled_events, intents_for_events
+from lib.store import StateStore
+
+USER_ID = "4000"
+GUILD_ID_BASE = 10**17
+CHANNEL_ID_BASE = 2 * 10**17
+HEARTBEAT_INTERVAL_MS = 41_250
+
+# Gateway opcodes
+DISPATCH = 0
+HEARTBEAT = 1
+IDENTIFY = 2
+RESUME = 6
+INVALID_SESSION = 9
+HELLO = 10
+HEARTBEAT_ACK = 11
+# A client closing with this code ends its session
+NORMAL_CLOSURE = 1000
+
+
+def make_user() -> dict[str, Any]:
+    return {
+        "id": USER_ID,
+        "username": "garagebot",
+        "global_name": None,
+        "discriminator": "0",
+        "avatar": None,
+        "bot": True,
+    }
+
+
+def make_guild(index: int) -> dict[str, Any]:
+    """A GUILD_CREATE payload for a small guild with one text channel."""
+    guild_id = str(GUILD_ID_BASE + index)
+    return {
+        "id": guild_id,
+        "name": f"guild{index}",
+        "unavailable": False,
+        "member_count": 1,
+        "large": False,
+        "members": [],
+        "presences": [],
+        "roles": [
+            {
+                "id": guild_id,
+                "name": "@everyone",
+                "permissions": "0",
+                "position": 0,
+                "color": 0,
+                "hoist": False,
+                "managed": False,
+                "mentionable": False,
+            }
+        ],
+        "channels": [
+            {
+                "id": str(CHANNEL_ID_BASE + index),
+                "type": 0,
+                "name": "general",
+                "position": 0,
+                "permission_overwrites": [],
+            }
+        ],
+        "emojis": [],
+        "stickers": [],
+        "features": [],
+    }
+
+
+def json_response(data: dict[str, Any]) -> web.Response:
+    """discord.py only decodes a body whose type is exactly application/json."""
+    return web.Response(body=json.dumps(data).encode(), content_type="application/json")
+
+
+class Session:
+    """A gateway session: its dispatched events, kept for replay on RESUME."""
+
+    def __init__(self, session_id: str) -> None:
+        self.session_id: str = session_id
+        self.events: list[dict[str, Any]] = []
+
+    def dispatch(self, event: str, data: dict[str, Any]) -> dict[str, Any]:
+        payload = {"op": DISPATCH, "t": event, "s": len(self.events) + 1, "d": data}
+        self.events.append(payload)
+        return payload
+
+
+class FakeDiscord:
+    """
+    Stand-in for Discord's gateway and the two API routes `login` calls.
+    IDENTIFY gets READY and then, `guild_interval` seconds apart, a
+    GUILD_CREATE per guild; RESUME gets the events after the client's sequence
+    number and RESUMED, or INVALID_SESSION if the session is unknown.  A client
+    closing with code 1000 ends its session, as on Discord.
+    """
+
+    def __init__(self, guilds: int, guild_interval: float) -> None:
+        self.guilds: int = guilds
+        self.guild_interval: float = guild_interval
+        self.sessions: dict[str, Session] = {}
+        self.identifies: int = 0
+        self.resumes: int = 0
+        self.url: str = ""
+        self._ids = itertools.count(1)
+        self._runner: web.AppRunner | None = None
+
+    async def start(self) -> None:
+        app = web.Application()
+        app.router.add_get("/gateway", self.gateway)
+        app.router.add_get("/api/v10/users/@me", self.current_user)
+        app.router.add_get("/api/v10/oauth2/applications/@me", self.application)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, "127.0.0.1", 0).start()
+        port = self._runner.addresses[0][1]
+        self.url = f"http://127.0.0.1:{port}"
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    async def current_user(self, _request: web.Request) -> web.Response:
+        return json_response(make_user())
+
+    async def application(self, _request: web.Request) -> web.Response:
+        return json_response(
+            {
+                "id": USER_ID,
+                "name": "garagebot",
+                "description": "",
+                "icon": None,
+                "bot_public": False,
+                "bot_require_code_grant": False,
+                "owner": make_user(),
+                "verify_key": "0" * 64,
+                "flags": 0,
+            }
+        )
+
+    def send_messages(self, session_id: str, count: int) -> None:
+        """Messages sent to the bot's guilds while it is disconnected."""
+        session = self.sessions[session_id]
+        for _ in range(count):
+            index = len(session.events) % self.guilds
+            session.dispatch(
+                "MESSAGE_CREATE",
+                {
+                    "id": str(3 * 10**17 + len(session.events)),
+                    "channel_id": str(CHANNEL_ID_BASE + index),
+                    "guild_id": str(GUILD_ID_BASE + index),
+                    "author": {**make_user(), "id": "5000", "bot": False},
+                    "content": "while you were away",
+                    "timestamp": "2025-01-01T00:00:00+00:00",
+                    "edited_timestamp": None,
+                    "tts": False,
+                    "mention_everyone": False,
+                    "mentions": [],
+                    "mention_roles": [],
+                    "attachments": [],
+                    "embeds": [],
+                    "pinned": False,
+                    "type": 0,
+                },
+            )
+
+    async def gateway(self, request: web.Request) -> web.WebSocketResponse:
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        await ws.send_json(
+            {"op": HELLO, "d": {"heartbeat_interval": HEARTBEAT_INTERVAL_MS}}
+        )
+        session: Session | None = None
+        async for msg in ws:
+            if msg.type != WSMsgType.TEXT:
+                continue
+            payload = json.loads(msg.data)
+            if payload["op"] == HEARTBEAT:
+                await ws.send_json({"op": HEARTBEAT_ACK})
+            elif payload["op"] == IDENTIFY:
+                session = await self.identify(ws)
+            elif payload["op"] == RESUME:
+                session = await self.resume(ws, payload["d"])
+        if session is not None and ws.close_code == NORMAL_CLOSURE:
+            del self.sessions[session.session_id]
+        return ws
+
+    async def identify(self, ws: web.WebSocketResponse) -> Session:
+        self.identifies += 1
+        session = Session(f"session-{next(self._ids)}")
+        self.sessions[session.session_id] = session
+        await ws.send_json(
+            session.dispatch(
+                "READY",
+                {
+                    "v": 10,
+                    "user": make_user(),
+                    "guilds": [
+                        {"id": str(GUILD_ID_BASE + i), "unavailable": True}
+                        for i in range(self.guilds)
+                    ],
+                    "session_id": session.session_id,
+                    "resume_gateway_url": self.url.replace("http", "ws") + "/gateway",
+                    "application": {"id": USER_ID, "flags": 0},
+                },
+            )
+        )
+        for index in range(self.guilds):
+            await asyncio.sleep(self.guild_interval)
+            await ws.send_json(session.dispatch("GUILD_CREATE", make_guild(index)))
+        return session
+
+    async def resume(
+        self, ws: web.WebSocketResponse, data: dict[str, Any]
+    ) -> Session | None:
+        session = self.sessions.get(data["session_id"])
+        if session is None:
+            await ws.send_json({"op": INVALID_SESSION, "d": False})
+            return None
+        self.resumes += 1
+        for payload in session.events[data["seq"] :]:
+            await ws.send_json(payload)
+        await ws.send_json(session.dispatch("RESUMED", {}))
+        return session
+
+
+class BenchBot(DiscordBot):
+    """DiscordBot that also signals an event once it is ready."""
+
+    def __init__(self, **kwargs: Any) -> None:  # noqa: ANN401
+        super().__init__(**kwargs)
+        self.ready_event: asyncio.Event = asyncio.Event()
+
+    def mark_ready(self, *, resumed: bool) -> None:
+        super().mark_ready(resumed=resumed)
+        self.ready_event.set()
+
+
+async def run_bot(path: str, resume_max_age: float) -> DiscordBot:
+    """Start a bot on the store at `path`, wait until it is ready, close it."""
+    store = StateStore(path, flush_interval=0.05)
+    intents = intents_for_events(handled_events(BenchBot))
+    bot = BenchBot(
+        intents=intents,
+        store=store,
+        resume_max_age=resume_max_age,
+        **cache_options(intents, 0),
+    )
+    task = asyncio.create_task(bot.start("fake-token"))
+    ready = asyncio.create_task(bot.ready_event.wait())
+    # Stop waiting if the bot fails before it is ready
+    await asyncio.wait({ready, task}, return_when=asyncio.FIRST_COMPLETED)
+    ready.cancel()
+    await bot.pipeline.join()
+    await bot.close()
+    await task
+    store.close()
+    return bot
+
+
+def time_to_ready(bot: DiscordBot, *, resumed: bool) -> float:
+    """The bot's time to ready, checking it got there the expected way."""
+    if bot.time_to_ready is None or bot.resumed != resumed:
+        how = "resuming" if resumed else "identifying"
+        msg = f"The bot didn't become ready by {how}"
+        raise RuntimeError(msg)
+    return bot.time_to_ready
+
+
+async def run(guilds: int, guild_interval: float, rounds: int, messages: int) -> None:
+    fake = FakeDiscord(guilds, guild_interval)
+    await fake.start()
+    # Point discord.py at the fake gateway and API
+    DiscordWebSocket.DEFAULT_GATEWAY = yarl.URL(
+        fake.url.replace("http", "ws") + "/gateway"
+    )
+    discord.http.Route.BASE = fake.url + "/api/v10"
+
+    times: dict[str, list[float]] = {"identify": [], "resume": [], "fallback": []}
+    replayed: list[int] = []
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            for index in range(rounds):
+                # A new store each round, so its first bot has no saved session
+                path = str(Path(tmp, f"state-{index}.db"))
+                bot = await run_bot(path, resume_max_age=60)
+                times["identify"].append(time_to_ready(bot, resumed=False))
+                # Closing kept the session open
+                fake.send_messages(bot.ws.session_id, messages)
+
+                bot = await run_bot(path, resume_max_age=60)
+                times["resume"].append(time_to_ready(bot, resumed=True))
+                replayed.append(bot.pipeline.processed)
+
+                # The gateway forgets the session: RESUME fails, then IDENTIFY
+                fake.sessions.clear()
+                bot = await run_bot(path, resume_max_age=60)
+                times["fallback"].append(time_to_ready(bot, resumed=False))
+    finally:
+        await fake.stop()
+
+    for name, samples in times.items():
+        median = statistics.median(samples)
+        print(  # noqa: T201
+            f"{name:>9}: time to ready median {median * 1000:8.1f} ms"
+            f"  min {min(samples) * 1000:8.1f} ms"
+        )
+    print(  # noqa: T201
+        f"replayed messages handled after resuming: {min(replayed)}-{max(replayed)}"
+        f" of {messages}; {fake.identifies} identifies, {fake.resumes} resumes"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--guilds", type=int, default=50)
+    parser.add_argument(
+        "--guild-interval",
+        type=float,
+        default=0.01,
+        help="seconds between GUILD_CREATEs after READY",
+    )
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument(
+        "--messages",
+        type=int,
+        default=100,
+        help="messages sent while the bot is down, replayed on resume",
+    )
+    args = parser.parse_args()
+    start = time.perf_counter()
+    asyncio.run(run(args.guilds, args.guild_interval, args.rounds, args.messages))
+    print(f"took {time.perf_counter() - start:.1f}s")  # noqa: T201
+
+
+if __name__ == "__main__":
+    main()
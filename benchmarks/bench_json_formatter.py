@@ -0,0 +1,95 @@
+"""Benchmark JSONFormatter against the previous implementation and serializers"""
+
+import argparse
+import datetime as dt
+import json
+import logging
+import timeit
+
+from lib.logger_extras import LOG_RECORD_BUILTIN_ATTRS, JSONFormatter
+
+FMT_KEYS = {
+    "level": "levelname",
+    "message": "message",
+    "timestamp": "timestamp",
+    "logger": "name",
+    "module": "module",
+    "function": "funcName",
+    "line": "lineno",
+    "thread_name": "threadName",
+}
+
+
+class BaselineJSONFormatter(JSONFormatter):
+    """The format implementation before the key plan/serializer work."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        always_fields = {
+            "message": record.getMessage(),
+            "timestamp": dt.datetime.fromtimestamp(
+                record.created, tz=dt.UTC
+            ).isoformat(),
+        }
+        message = {
+            key: msg_val
+            if (msg_val := always_fields.pop(val, None)) is not None
+            else getattr(record, val)
+            for key, val in self.fmt_keys.items()
+        }
+        message.update(always_fields)
+        message.update(
+            {
+                k: v
+                for k, v in record.__dict__.items()
+                if k not in LOG_RECORD_BUILTIN_ATTRS
+            }
+        )
+        return json.dumps(message, default=str)
+
+
+def make_record() -> logging.LogRecord:
+    return logging.LogRecord(
+        "discord.gateway",
+        logging.INFO,
+        __file__,
+        42,
+        "Shard ID %s has sent the RESUME payload.",
+        (None,),
+        None,
+    )
+
+
+def run(number: int, serializers: list[str]) -> dict[str, float]:
+    """Return the mean time per record (in µs) for each variant."""
+    record = make_record()
+    baseline = BaselineJSONFormatter(fmt_keys=FMT_KEYS)
+    timings = {
+        "baseline format()": timeit.timeit(
+            lambda: baseline.format(record), number=number
+        ),
+    }
+    for serializer in serializers:
+        try:
+            formatter = JSONFormatter(fmt_keys=FMT_KEYS, serializer=serializer)
+        except ImportError:
+            continue  # optional serializer not installed
+        timings[f"{serializer} format_bytes()"] = timeit.timeit(
+            lambda formatter=formatter: formatter.format_bytes(record), number=number
+        )
+    return {name: total / number * 1_000_000 for name, total in timings.items()}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--number", type=int, default=100_000)
+    parser.add_argument(
+        "--serializers", nargs="+", default=["json", "msgspec", "orjson"]
+    )
+    args = parser.parse_args()
+
+    for name, us in run(args.number, args.serializers).items():
+        print(f"{name:<26} {us:8.3f} µs/record")  # noqa: T201
+
+
+if __name__ == "__main__":
+    main()
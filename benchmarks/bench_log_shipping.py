@@ -0,0 +1,156 @@
+"""
+Benchmark LogShippingHandler against local stand-in collectors (HTTP and
+syslog over TCP), including a collector outage that is covered by the spool
+"""
+
+import argparse
+import gzip
+import logging
+import socket
+import socketserver
+import tempfile
+import threading
+import time
+from collections.abc import Callable
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+from benchmarks.bench_file_handler import make_records
+from lib.logger_extras import JSONFormatter, LogShippingHandler
+
+
+class CollectorHandler(BaseHTTPRequestHandler):
+    """Stand-in HTTP collector: counts the newline-delimited records it gets."""
+
+    protocol_version = "HTTP/1.1"  # keep-alive, so the handler reuses connections
+    records = 0
+    lock = threading.Lock()
+
+    def do_POST(self) -> None:
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        if self.headers.get("Content-Encoding") == "gzip":
+            body = gzip.decompress(body)
+        with CollectorHandler.lock:
+            CollectorHandler.records += body.count(b"\n")
+        self.send_response(204)
+        self.end_headers()
+
+    def log_message(self, *args: object) -> None:
+        pass
+
+
+class SyslogCollectorHandler(socketserver.StreamRequestHandler):
+    """Stand-in syslog collector: counts octet-counted frames."""
+
+    records = 0
+
+    def handle(self) -> None:
+        while length := self._read_length():
+            self.rfile.read(length)
+            SyslogCollectorHandler.records += 1
+
+    def _read_length(self) -> int:
+        digits = b""
+        while (char := self.rfile.read(1)) not in {b" ", b""}:
+            digits += char
+        return int(digits or 0)
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for(count: Callable[[], int], target: int, timeout: float = 30) -> None:
+    deadline = time.monotonic() + timeout
+    while count() < target and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+def make_handler(url: str, spool_path: str | None = None) -> LogShippingHandler:
+    handler = LogShippingHandler(
+        url,
+        flush_interval=0.05,
+        retry_initial=0.1,
+        retry_max=0.5,
+        spool_path=spool_path,
+    )
+    handler.setFormatter(JSONFormatter())
+    return handler
+
+
+def run_http(records: list[logging.LogRecord]) -> float:
+    """Records per second shipped over HTTP, until the collector has them all."""
+    CollectorHandler.records = 0
+    server = ThreadingHTTPServer(("127.0.0.1", free_port()), CollectorHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    handler = make_handler(f"http://127.0.0.1:{server.server_port}/logs")
+    start = time.perf_counter()
+    for record in records:
+        handler.handle(record)
+    wait_for(lambda: CollectorHandler.records, len(records))
+    elapsed = time.perf_counter() - start
+    handler.close()
+    server.shutdown()
+    return len(records) / elapsed
+
+
+def run_syslog(records: list[logging.LogRecord]) -> float:
+    """Records per second shipped as syslog over TCP."""
+    SyslogCollectorHandler.records = 0
+    server = socketserver.ThreadingTCPServer(
+        ("127.0.0.1", free_port()), SyslogCollectorHandler
+    )
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    handler = make_handler(f"tcp://127.0.0.1:{server.server_address[1]}")
+    start = time.perf_counter()
+    for record in records:
+        handler.handle(record)
+    wait_for(lambda: SyslogCollectorHandler.records, len(records))
+    elapsed = time.perf_counter() - start
+    handler.close()
+    server.shutdown()
+    return len(records) / elapsed
+
+
+def run_outage(records: list[logging.LogRecord]) -> tuple[int, int]:
+    """
+    Log half the records while the collector is down, then start it: returns
+    the records logged and the records the collector received.
+    """
+    CollectorHandler.records = 0
+    port = free_port()
+    with tempfile.TemporaryDirectory() as tmp:
+        handler = make_handler(
+            f"http://127.0.0.1:{port}/logs", spool_path=str(Path(tmp, "ship.spool"))
+        )
+        half = len(records) // 2
+        for record in records[:half]:
+            handler.handle(record)
+        handler.flush()  # everything so far is spooled
+        server = ThreadingHTTPServer(("127.0.0.1", port), CollectorHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        for record in records[half:]:
+            handler.handle(record)
+        wait_for(lambda: CollectorHandler.records, len(records))
+        handler.close()
+        server.shutdown()
+    return len(records), CollectorHandler.records
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--count", type=int, default=50_000)
+    args = parser.parse_args()
+    logging.raiseExceptions = False  # the outage run fails on purpose
+
+    records = make_records(args.count)
+    print(f"{'http':<8} {run_http(records):12,.0f} records/s")  # noqa: T201
+    print(f"{'syslog':<8} {run_syslog(records):12,.0f} records/s")  # noqa: T201
+    logged, received = run_outage(records)
+    print(f"outage   {received:,} of {logged:,} records delivered")  # noqa: T201
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+"""
+Synthetic load generator for MessagePipeline: bursts of messages over many
+channels, handled by a stand-in handler that waits on I/O and sometimes does
+CPU-heavy work.  Compares the pipeline with discord.py's task per message,
+and checks that each channel's messages were handled in order.
+"""
+
+import argparse
+import asyncio
+import hashlib
+import random
+import time
+from collections import defaultdict
+from typing import Any
+
+from lib.pipeline import MessagePipeline, percentiles
+
+
+class FakeChannel:
+    def __init__(self, channel_id: int) -> None:
+        self.id: int = channel_id
+
+
+class FakeMessage:
+    """Just enough of `discord.Message` for the pipeline."""
+
+    def __init__(self, message_id: int, channel: FakeChannel, *, heavy: bool) -> None:
+        self.id: int = message_id
+        self.channel: FakeChannel = channel
+        self.heavy: bool = heavy
+        self.sent_at: float = 0.0
+
+
+def make_messages(count: int, channels: int, heavy_ratio: float) -> list[Any]:
+    """Messages spread over channels with snowflake-like IDs, a few of them heavy."""
+    rng = random.Random(0)  # noqa: S311
+    channel_list = [FakeChannel((1 << 40) + i * 4_194_304 + i) for i in range(channels)]
+    return [
+        FakeMessage(i, rng.choice(channel_list), heavy=rng.random() < heavy_ratio)
+        for i in range(count)
+    ]
+
+
+def crunch(rounds: int) -> bytes:
+    """Stand-in for CPU-heavy work (e.g. parsing or rendering)."""
+    digest = b""
+    for _ in range(rounds):
+        digest = hashlib.sha256(digest).digest()
+    return digest
+
+
+class LoadResult:
+    def __init__(self) -> None:
+        self.latencies: list[float] = []
+        self.order: dict[int, list[int]] = defaultdict(list)
+        self.peak_tasks: int = 0
+
+    def in_order(self) -> bool:
+        return all(ids == sorted(ids) for ids in self.order.values())
+
+
+def make_handler(
+    result: LoadResult, io_delay: float, rounds: int, pipeline: MessagePipeline | None
+) -> Any:  # noqa: ANN401
+    async def handle(message: Any) -> None:  # noqa: ANN401
+        # Stand-in for an API call, whose latency varies
+        await asyncio.sleep(io_delay * (1 + message.id % 7 / 7))
+        if message.heavy:
+            if pipeline is not None:
+                await pipeline.offload(crunch, rounds)
+            else:
+                crunch(rounds)
+        # The order replies would be sent in
+        result.order[message.channel.id].append(message.id)
+        result.latencies.append(time.perf_counter() - message.sent_at)
+
+    return handle
+
+
+async def generate(
+    messages: list[Any],
+    args: argparse.Namespace,
+    submit: Any,  # noqa: ANN401
+    result: LoadResult,
+) -> None:
+    """Send the messages in bursts of `args.burst`, every `args.interval` seconds."""
+    burst = args.burst
+    for start in range(0, len(messages), burst):
+        now = time.perf_counter()
+        for message in messages[start : start + burst]:
+            message.sent_at = now
+            submit(message)
+        result.peak_tasks = max(result.peak_tasks, len(asyncio.all_tasks()))
+        await asyncio.sleep(args.interval)
+
+
+async def run_tasks(messages: list[Any], args: argparse.Namespace) -> LoadResult:
+    """discord.py's behaviour: one task per message, no limit."""
+    result = LoadResult()
+    handler = make_handler(result, args.io_delay, args.rounds, None)
+    tasks: set[asyncio.Task[None]] = set()
+
+    def submit(message: Any) -> None:  # noqa: ANN401
+        task = asyncio.create_task(handler(message))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+
+    await generate(messages, args, submit, result)
+    await asyncio.gather(*tasks)
+    return result
+
+
+async def run_pipeline(
+    messages: list[Any], args: argparse.Namespace
+) -> tuple[LoadResult, MessagePipeline]:
+    result = LoadResult()
+
+    async def handle(message: Any) -> None:  # noqa: ANN401
+        # The handler offloads to the pipeline, so it is made once that exists
+        await handler(message)
+
+    pipeline = MessagePipeline(
+        handle,
+        workers=args.workers,
+        queue_size=args.queue_size,
+        executor=args.executor,
+    )
+    handler = make_handler(result, args.io_delay, args.rounds, pipeline)
+    pipeline.start()
+    await generate(messages, args, pipeline.submit, result)
+    await pipeline.join()
+    await pipeline.stop()
+    return result, pipeline
+
+
+def report(name: str, result: LoadResult, elapsed: float) -> None:
+    latency = percentiles(result.latencies)
+    print(  # noqa: T201
+        f"{name:<10} {len(result.latencies) / elapsed:10,.0f} msgs/s  "
+        f"peak tasks {result.peak_tasks:6,}  "
+        f"p50 {latency['p50'] * 1000:8.1f}ms  p99 {latency['p99'] * 1000:8.1f}ms  "
+        f"in order: {result.in_order()}"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--count", type=int, default=20_000)
+    parser.add_argument("--channels", type=int, default=200)
+    parser.add_argument("--burst", type=int, default=2_000)
+    parser.add_argument("--interval", type=float, default=0.1)
+    parser.add_argument("--workers", type=int, default=32)
+    parser.add_argument("--queue-size", type=int, default=10_000)
+    parser.add_argument("--io-delay", type=float, default=0.001)
+    parser.add_argument("--heavy-ratio", type=float, default=0.01)
+    parser.add_argument("--rounds", type=int, default=2_000)
+    parser.add_argument("--executor", choices=("thread", "process"), default="thread")
+    args = parser.parse_args()
+
+    messages = make_messages(args.count, args.channels, args.heavy_ratio)
+    start = time.perf_counter()
+    report("tasks", asyncio.run(run_tasks(messages, args)), time.perf_counter() - start)
+    start = time.perf_counter()
+    result, pipeline = asyncio.run(run_pipeline(messages, args))
+    report("pipeline", result, time.perf_counter() - start)
+    stats = pipeline.stats()
+    print(  # noqa: T201
+        f"pipeline high-water mark {stats['high_water_mark']:,}, "
+        f"dropped {stats['dropped']:,}, errors {stats['errors']:,}"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""
+Benchmark StateStore writes under concurrent event load: many tasks updating
+per-guild counters and settings, against a commit per write on the event loop
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import sqlite3
+import tempfile
+import time
+from collections.abc import Callable
+from pathlib import Path
+
+from lib.store import StateStore, connect
+
+
+def make_keys(guilds: int) -> list[tuple[str, str]]:
+    """A few hot keys per guild, like the counters and settings a bot keeps."""
+    return [
+        (namespace, str(guild))
+        for guild in range(guilds)
+        for namespace in ("message_count", "last_active", "settings")
+    ]
+
+
+async def run_events(
+    tasks: int,
+    writes: int,
+    keys: list[tuple[str, str]],
+    write: Callable[[str, str, object], None],
+) -> tuple[float, float]:
+    """
+    Run `tasks` concurrent event handlers sharing `writes` writes; returns the
+    elapsed time and the longest the event loop was held between two yields.
+    """
+    per_task = writes // tasks
+    longest = 0.0
+
+    async def handler(seed: int) -> None:
+        nonlocal longest
+        rng = random.Random(seed)  # noqa: S311
+        for i in range(per_task):
+            start = time.perf_counter()
+            namespace, key = rng.choice(keys)
+            write(namespace, key, {"value": i, "by": seed})
+            longest = max(longest, time.perf_counter() - start)
+            await asyncio.sleep(0)  # other events run between writes
+
+    start = time.perf_counter()
+    await asyncio.gather(*(handler(seed) for seed in range(tasks)))
+    return time.perf_counter() - start, longest
+
+
+def run_store(
+    path: str, tasks: int, writes: int, keys: list[tuple[str, str]]
+) -> dict[str, float]:
+    store = StateStore(path, flush_interval=0.05)
+    elapsed, longest = asyncio.run(run_events(tasks, writes, keys, store.set))
+    flush_start = time.perf_counter()
+    store.close()
+    total = elapsed + time.perf_counter() - flush_start
+    stats = store.stats()
+    return {
+        "writes/s": writes / elapsed,
+        "writes/s incl. flush": writes / total,
+        "longest write (ms)": longest * 1000,
+        "rows written": stats["written"],
+        "batches": stats["batches"],
+    }
+
+
+def run_direct(
+    path: str, tasks: int, writes: int, keys: list[tuple[str, str]]
+) -> dict[str, float]:
+    """The naive approach: an upsert and commit per write, on the event loop."""
+    connection = connect(path)
+    connection.execute(
+        "CREATE TABLE IF NOT EXISTS state (namespace TEXT, key TEXT, value TEXT, "
+        "PRIMARY KEY (namespace, key)) WITHOUT ROWID"
+    )
+
+    def write(namespace: str, key: str, value: object) -> None:
+        connection.execute(
+            "INSERT OR REPLACE INTO state VALUES (?, ?, ?)",
+            (namespace, key, json.dumps(value)),
+        )
+
+    elapsed, longest = asyncio.run(run_events(tasks, writes, keys, write))
+    connection.close()
+    return {
+        "writes/s": writes / elapsed,
+        "writes/s incl. flush": writes / elapsed,
+        "longest write (ms)": longest * 1000,
+        "rows written": writes,
+        "batches": writes,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--tasks", type=int, default=200)
+    parser.add_argument("--writes", type=int, default=100_000)
+    parser.add_argument("--guilds", type=int, default=1_000)
+    args = parser.parse_args()
+    keys = make_keys(args.guilds)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        results = {
+            "direct": run_direct(
+                str(Path(tmp, "direct.db")), args.tasks, args.writes, keys
+            ),
+            "store": run_store(
+                str(Path(tmp, "store.db")), args.tasks, args.writes, keys
+            ),
+        }
+        # The store's last values must be on disk
+        with sqlite3.connect(Path(tmp, "store.db")) as connection:
+            rows = connection.execute("SELECT COUNT(*) FROM state").fetchone()[0]
+
+    for name, result in results.items():
+        print(  # noqa: T201
+            f"{name:<8} "
+            + "  ".join(f"{label} {value:,.1f}" for label, value in result.items())
+        )
+    print(f"store rows on disk: {rows:,} of {len(keys):,} keys")  # noqa: T201
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,513 @@
+"""
+Offline benchmark suite for the lib package's startup and hot paths.
+
+Every benchmark runs in-process (or in a local subprocess, for startup) with
+no Discord connection or network access.  Results can be saved as JSON and
+compared against an earlier run to catch regressions across commits:
+
+    uv run python -m benchmarks.suite --output bench-main.json
+    uv run python -m benchmarks.suite --compare bench-main.json --threshold 0.15
+
+`--compare` exits with status 1 when any benchmark got worse by more than the
+threshold (a fraction of the earlier value).
+"""
+
+import argparse
+import asyncio
+import datetime as dt
+import json
+import logging
+import logging.handlers
+import os
+import platform
+import re
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+from collections.abc import Callable
+from pathlib import Path
+from typing import Any, NamedTuple
+
+import discord
+
+from benchmarks.bench_access_formatter import FMT, LOG_COLORS
+from benchmarks.bench_access_formatter import make_record as make_access_record
+from benchmarks.bench_config_parser import build_synthetic_config
+from benchmarks.bench_file_handler import make_records
+from benchmarks.bench_json_formatter import FMT_KEYS
+from benchmarks.bench_json_formatter import make_record as make_json_record
+from lib import config_parser
+from lib.api import app
+from lib.bot import DiscordBot
+from lib.logger_extras import (
+    AccessLogFormatter,
+    BatchingFileHandler,
+    BoundedLogQueue,
+    JSONFormatter,
+)
+from lib.outbound import OutboundDispatcher
+from lib.status import StatusSnapshot
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+RESULTS_VERSION = 1
+DEFAULT_THRESHOLD = 0.1
+
+MATH_EXPRESSIONS = (
+    "1024 * 1024 * 10",
+    "2 ** 10 - 3 * (4 + 5)",
+    "-(7 % 3) / 2 + 0.5",
+)
+
+
+class Result(NamedTuple):
+    """One measurement.  `higher_is_better` decides what counts as a regression."""
+
+    name: str
+    value: float
+    unit: str
+    higher_is_better: bool
+
+
+def per_call(func: Callable[[], object], number: int, scale: float = 1e6) -> float:
+    """Mean time per call, in µs by default (best of 3 runs)."""
+    return min(timeit.repeat(func, number=number, repeat=3)) / number * scale
+
+
+def bench_config_parser(iterations: float) -> list[Result]:
+    results = []
+    for handlers, number in ((10, 2000), (1000, 20)):
+        config = build_synthetic_config(handlers)
+        runs = max(1, int(number * iterations))
+        results.append(
+            Result(
+                f"config_parser.resolve_values[{handlers} handlers]",
+                per_call(lambda c=config: config_parser.resolve_values(c), runs, 1e3),
+                "ms",
+                higher_is_better=False,
+            )
+        )
+        compiled = config_parser.compile_config(config)
+        compiled.resolve()
+        results.append(
+            Result(
+                f"config_parser.CompiledConfig.resolve[{handlers} handlers]",
+                per_call(compiled.resolve, runs, 1e3),
+                "ms",
+                higher_is_better=False,
+            )
+        )
+
+    number = max(1, int(20_000 * iterations))
+
+    def evaluate_all() -> None:
+        for expression in MATH_EXPRESSIONS:
+            config_parser.eval_ast(expression)
+
+    per_batch = min(timeit.repeat(evaluate_all, number=number, repeat=3))
+    results.append(
+        Result(
+            "config_parser.eval_ast",
+            number * len(MATH_EXPRESSIONS) / per_batch,
+            "evals/s",
+            higher_is_better=True,
+        )
+    )
+    return results
+
+
+def bench_formatters(iterations: float) -> list[Result]:
+    number = max(1, int(50_000 * iterations))
+    access_formatter = AccessLogFormatter(fmt=FMT, log_colors=LOG_COLORS)
+    access_record = make_access_record(queued=True)
+    access_record.message = access_record.getMessage()
+    access_record.asctime = access_formatter.formatTime(access_record)
+
+    json_formatter = JSONFormatter(fmt_keys=FMT_KEYS, serializer="auto")
+    json_record = make_json_record()
+    return [
+        Result(
+            "AccessLogFormatter.formatMessage",
+            per_call(lambda: access_formatter.formatMessage(access_record), number),
+            "µs/record",
+            higher_is_better=False,
+        ),
+        Result(
+            "JSONFormatter.format",
+            per_call(lambda: json_formatter.format(json_record), number),
+            "µs/record",
+            higher_is_better=False,
+        ),
+    ]
+
+
+def bench_log_pipeline(iterations: float) -> list[Result]:
+    """Records/s from a queue handler through a bounded queue to a file on disk."""
+    count = max(1, int(100_000 * iterations))
+    records = make_records(count)
+    with tempfile.TemporaryDirectory() as tmp:
+        file_handler = BatchingFileHandler(str(Path(tmp, "bench.log")))
+        file_handler.setFormatter(
+            logging.Formatter(
+                "[{asctime}] [{levelname:<7}] {name}: {message}", style="{"
+            )
+        )
+        # Blocking policy so the measurement never silently drops records
+        log_queue = BoundedLogQueue(maxsize=10_000, policy="block", block_timeout=60)
+        queue_handler = logging.handlers.QueueHandler(log_queue)
+        listener = logging.handlers.QueueListener(log_queue, file_handler)
+        listener.start()
+        start = time.perf_counter()
+        for record in records:
+            queue_handler.handle(record)
+        listener.stop()  # drains the queue
+        file_handler.flush()
+        elapsed = time.perf_counter() - start
+        file_handler.close()
+    return [
+        Result(
+            "logging.queue_to_file",
+            count / elapsed,
+            "records/s",
+            higher_is_better=True,
+        )
+    ]
+
+
+async def asgi_get(asgi_app: Any, path: str) -> int:  # noqa: ANN401
+    """Send a GET request straight to an ASGI app; return the status code."""
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "root_path": "",
+        "query_string": b"",
+        "headers": [(b"host", b"bench")],
+        "client": ("127.0.0.1", 50000),
+        "server": ("127.0.0.1", 8080),
+    }
+    status = 0
+
+    async def receive() -> dict[str, Any]:
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message: dict[str, Any]) -> None:
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+
+    await asgi_app(scope, receive, send)
+    return status
+
+
+def bench_healthcheck(iterations: float) -> list[Result]:
+    """/healthcheck requests per second through the full middleware stack."""
+    snapshot = StatusSnapshot()
+    snapshot.update(is_ready=True, user="Bench#0000", latency=0.05)
+    app.state.status_snapshot = snapshot
+    count = max(1, int(20_000 * iterations))
+
+    async def run() -> float:
+        if (status := await asgi_get(app, "/healthcheck")) != 200:  # noqa: PLR2004
+            msg = f"/healthcheck returned {status}"
+            raise RuntimeError(msg)
+        start = time.perf_counter()
+        for _ in range(count):
+            await asgi_get(app, "/healthcheck")
+        return time.perf_counter() - start
+
+    return [
+        Result(
+            "api.healthcheck",
+            count / asyncio.run(run()),
+            "requests/s",
+            higher_is_better=True,
+        )
+    ]
+
+
+class FakeChannel:
+    """Just enough of a Discord channel for the outbound dispatcher."""
+
+    def __init__(self, channel_id: int) -> None:
+        self.id: int = channel_id
+
+    async def send(self, content: str) -> None:  # noqa: ARG002
+        await asyncio.sleep(0)
+
+
+class FakeUser:
+    """Just enough of a Discord user for the bot's user cache."""
+
+    def __init__(self, user_id: int) -> None:
+        self.id: int = user_id
+        self.name: str = f"user{user_id}"
+        self.display_name: str = self.name
+        self.bot: bool = False
+
+
+class FakeMessage:
+    """Just enough of `discord.Message` for `DiscordBot.on_message`."""
+
+    def __init__(
+        self, message_id: int, content: str, channel: FakeChannel, author: FakeUser
+    ) -> None:
+        self.id: int = message_id
+        self.content: str = content
+        self.author: FakeUser = author
+        self.channel: FakeChannel = channel
+        self.guild: None = None
+
+
+def bench_on_message(iterations: float) -> list[Result]:
+    """Messages/s through `DiscordBot.on_message`, including sending replies."""
+    count = max(1, int(50_000 * iterations))
+    channels = [FakeChannel(i) for i in range(100)]
+    users = [FakeUser(i) for i in range(500)]
+    # One in ten messages is a command that gets a reply
+    messages = [
+        FakeMessage(
+            i,
+            "hello there" if i % 10 == 0 else "Did anyone try the new garage build?",
+            channels[i % len(channels)],
+            users[i % len(users)],
+        )
+        for i in range(count)
+    ]
+
+    async def run() -> float:
+        bot = DiscordBot(intents=discord.Intents.none())
+        # No pacing: measure the bot, not Discord's rate limits
+        bot.outbound = OutboundDispatcher(
+            rate_limit=count, rate_limit_per=1.0, max_queue_per_channel=count
+        )
+        start = time.perf_counter()
+        for message in messages:
+            await bot.on_message(message)  # type: ignore[arg-type]
+        await bot.outbound.drain()
+        return time.perf_counter() - start
+
+    logging.getLogger("lib.bot").setLevel(logging.WARNING)
+    return [
+        Result(
+            "bot.on_message",
+            count / asyncio.run(run()),
+            "messages/s",
+            higher_is_better=True,
+        )
+    ]
+
+
+STARTUP_SCRIPTS: dict[str, str] = {
+    "startup.import_bot_and_api": "import lib.bot, lib.api",
+    "startup.configure_logger": (
+        "import lib.logger_setup as s; s.configure_logger(); s.stop_queue_listeners()"
+    ),
+}
+
+
+# A full logging reload after an edit under `filters:`, which must leave each
+# logger with exactly its configured filters (dictConfig adds them to the
+# filters a logger already has)
+RELOAD_SETUP = """
+import logging, os, shutil, sys, tempfile
+import lib.logger_setup as s
+path = os.path.join(tempfile.mkdtemp(), "logger.yaml")
+shutil.copy("conf/logger.yaml", path)
+s.configure_logger(path)
+with open(path, encoding="utf-8") as f:
+    text = f.read()
+with open(path, "w", encoding="utf-8") as f:
+    f.write(text.replace("rate: 20", "rate: 5"))
+os.utime(path, ns=(0, 0))
+"""
+RELOAD_CHECK = """
+config = s.load_logger_config(path)
+for name, logger_config in config["loggers"].items():
+    filters = logging.getLogger(name).filters
+    if len(filters) != len(logger_config.get("filters", [])):
+        sys.exit(f"{name} has {len(filters)} filters after reloading: {filters}")
+s.stop_queue_listeners()
+"""
+
+
+def time_subprocess(
+    code: str, env: dict[str, str], setup: str = "", check: str = ""
+) -> float:
+    """
+    Wall time (ms) of `code` measured inside a fresh interpreter, after
+    `setup` and before `check` (which exits non-zero on a failure).
+    """
+    script = (
+        f"{setup}\n"
+        "import time; _t = time.perf_counter()\n"
+        f"{code}\n"
+        "_elapsed = (time.perf_counter() - _t) * 1000\n"
+        f"{check}\n"
+        "print('BENCH_RESULT', _elapsed)\n"
+    )
+    process = subprocess.run(  # noqa: S603
+        [sys.executable, "-c", script],
+        cwd=REPO_DIR,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=False,
+    )
+    match = re.search(r"^BENCH_RESULT (\S+)$", process.stdout, re.MULTILINE)
+    if process.returncode or match is None:
+        error = process.stderr.strip().splitlines()[-1:] or ["no result"]
+        msg = f"Startup benchmark {code!r} failed: {error[0]}"
+        raise RuntimeError(msg)
+    return float(match.group(1))
+
+
+def bench_startup(iterations: float) -> list[Result]:
+    """Cold import and logging configuration time, in fresh interpreters."""
+    runs = max(3, int(5 * iterations))
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        env = {
+            **os.environ,
+            "LOG_DIR": tmp,
+            "LOG_LEVEL_STDOUT": "CRITICAL",
+        }
+        env.pop("LOG_CONFIG_CACHE", None)
+        cached_env = {**env, "LOG_CONFIG_CACHE": str(Path(tmp, "config-cache.json"))}
+        cases = [(name, code, env) for name, code in STARTUP_SCRIPTS.items()]
+        cases.append(
+            (
+                "startup.configure_logger[cached]",
+                STARTUP_SCRIPTS["startup.configure_logger"],
+                cached_env,
+            )
+        )
+        for name, code, case_env in cases:
+            time_subprocess(code, case_env)  # warm the OS cache (and config cache)
+            results.append(
+                Result(
+                    name,
+                    min(time_subprocess(code, case_env) for _ in range(runs)),
+                    "ms",
+                    higher_is_better=False,
+                )
+            )
+        reload_ms = min(
+            time_subprocess("s.reload_logger(path)", env, RELOAD_SETUP, RELOAD_CHECK)
+            for _ in range(runs)
+        )
+        results.append(
+            Result(
+                "startup.reload_logger[full]", reload_ms, "ms", higher_is_better=False
+            )
+        )
+    return results
+
+
+BENCHMARKS: dict[str, Callable[[float], list[Result]]] = {
+    "config_parser": bench_config_parser,
+    "formatters": bench_formatters,
+    "log_pipeline": bench_log_pipeline,
+    "healthcheck": bench_healthcheck,
+    "on_message": bench_on_message,
+    "startup": bench_startup,
+}
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],  # noqa: S607
+            cwd=REPO_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_suite(names: list[str], iterations: float) -> dict[str, Any]:
+    results: dict[str, dict[str, Any]] = {}
+    for name in names:
+        print(f"Running {name}...", file=sys.stderr)  # noqa: T201
+        for result in BENCHMARKS[name](iterations):
+            results[result.name] = {
+                "value": result.value,
+                "unit": result.unit,
+                "higher_is_better": result.higher_is_better,
+            }
+    return {
+        "version": RESULTS_VERSION,
+        "meta": {
+            "timestamp": dt.datetime.now(tz=dt.UTC).isoformat(),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "iterations": iterations,
+        },
+        "results": results,
+    }
+
+
+def compare(
+    current: dict[str, Any], baseline: dict[str, Any], threshold: float
+) -> list[str]:
+    """Print each benchmark's change; return the names of regressions."""
+    regressions = []
+    print(  # noqa: T201
+        f"\nCompared with {baseline['meta'].get('commit') or 'baseline'} "
+        f"(regression threshold {threshold:.0%}):"
+    )
+    for name, result in current["results"].items():
+        previous = baseline["results"].get(name)
+        if previous is None or not previous["value"]:
+            print(f"  {name:<58} (new)")  # noqa: T201
+            continue
+        change = (result["value"] - previous["value"]) / previous["value"]
+        worse = -change if result["higher_is_better"] else change
+        flag = ""
+        if worse > threshold:
+            flag = "  REGRESSION"
+            regressions.append(name)
+        print(f"  {name:<58} {change:+8.1%}{flag}")  # noqa: T201
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "--only", nargs="+", choices=list(BENCHMARKS), default=list(BENCHMARKS)
+    )
+    parser.add_argument(
+        "--iterations",
+        type=float,
+        default=1.0,
+        help="scale the number of iterations (e.g. 0.1 for a quick run)",
+    )
+    parser.add_argument("--output", type=Path, help="write the results as JSON")
+    parser.add_argument("--compare", type=Path, help="earlier results to compare")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+    args = parser.parse_args()
+
+    current = run_suite(args.only, args.iterations)
+    for name, result in current["results"].items():
+        print(f"{name:<60} {result['value']:14,.3f} {result['unit']}")  # noqa: T201
+
+    if args.output:
+        args.output.write_text(json.dumps(current, indent=2) + "\n", encoding="utf-8")
+    if args.compare:
+        baseline = json.loads(args.compare.read_text(encoding="utf-8"))
+        if compare(current, baseline, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
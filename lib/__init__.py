@@ -5,4 +5,46 @@ This package contains helper modules for logging, bot creation, and other utilit
 Modules:
 - bot.py: Contains the DiscordBot class for running the bot.
 - logger_setup.py: Contains logging configuration helpers.
+
+Submodules are imported on first attribute access (e.g. `lib.bot`), so an
+entry point that does `import lib` only pays for the heavy dependencies
+(discord, fastapi, uvicorn, pydantic) of the code paths it actually runs.
 """
+
+import importlib
+from types import ModuleType
+
+SUBMODULES: frozenset[str] = frozenset(
+    {
+        "api",
+        "bot",
+        "cache",
+        "commands",
+        "config_parser",
+        "intents",
+        "lifecycle",
+        "logger_extras",
+        "logger_setup",
+        "loops",
+        "metrics",
+        "outbound",
+        "pipeline",
+        "resume",
+        "shards",
+        "startup",
+        "status",
+        "store",
+        "utils",
+    }
+)
+
+
+def __getattr__(name: str) -> ModuleType:
+    if name in SUBMODULES:
+        return importlib.import_module(f"{__name__}.{name}")
+    msg = f"module {__name__!r} has no attribute {name!r}"
+    raise AttributeError(msg)
+
+
+def __dir__() -> list[str]:
+    return sorted(SUBMODULES | globals().keys())
@@ -1,28 +1,227 @@
+import asyncio
+import contextlib
 import logging
+import os
+import threading
+import time
+from collections.abc import Iterator
 
 import uvicorn
-from discord import ClientUser
 from fastapi import FastAPI, Request
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response
 from pydantic import BaseModel
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 
+from lib import logger_setup, metrics
 from lib.bot import DiscordBot
+from lib.logger_extras import bind_log_context
+from lib.loops import get_lag_stats, start_lag_monitor, tune_loop
+from lib.shards import ShardSupervisor
+from lib.status import JSON_MEDIA_TYPE
+from lib.utils import lazy_import, resident_memory_bytes
+
+yaml = lazy_import("yaml")
 
 logger: logging.Logger = logging.getLogger(__name__)
-app = FastAPI()  # Create the FastAPI app
 
+# Seconds to wait for a threaded API server to finish its requests on shutdown
+API_STOP_TIMEOUT = 5.0
+# Header carrying the request's correlation ID, in requests and responses
+REQUEST_ID_HEADER = b"x-request-id"
+# Longest client-supplied request ID that is accepted as is
+REQUEST_ID_MAX_LENGTH = 128
 
-async def start_fastapi_server(bot: DiscordBot, port: int = 8080) -> None:
+
+class MetricsMiddleware:
+    """
+    ASGI middleware that records request latency per route template
+    (e.g. `/status`), so path parameters don't create new label values.
     """
-    Start the FastAPI server using asyncio and provide the bot instance
-    to the API
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app: ASGIApp = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            # The router stores the matched route in the (shared) scope
+            route = getattr(scope.get("route"), "path", "unmatched")
+            metrics.REQUEST_SECONDS.observe(
+                time.perf_counter() - start, (scope["method"], route)
+            )
+
+
+class RequestContextMiddleware:
     """
+    ASGI middleware that binds a request ID to everything logged while handling
+    a request, including uvicorn's access log line.  The client's X-Request-ID
+    header is reused when present; the ID is returned in the response headers.
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app: ASGIApp = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        supplied = next(
+            (
+                value
+                for name, value in scope["headers"]
+                if name == REQUEST_ID_HEADER and len(value) <= REQUEST_ID_MAX_LENGTH
+            ),
+            None,
+        )
+        request_id = supplied or os.urandom(8).hex().encode()
+
+        async def send_with_id(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                message["headers"] = [
+                    *message.get("headers", ()),
+                    (REQUEST_ID_HEADER, request_id),
+                ]
+            await send(message)
+
+        with bind_log_context(request_id=request_id.decode("latin-1")):
+            await self.app(scope, receive, send_with_id)
+
+
+app = FastAPI()  # Create the FastAPI app
+app.add_middleware(MetricsMiddleware)
+app.add_middleware(RequestContextMiddleware)
+metrics.LOG_QUEUE_DEPTH.set_callback(
+    lambda: {
+        (name,): stats["size"] for name, stats in logger_setup.get_queue_stats().items()
+    }
+)
+metrics.RESIDENT_MEMORY.set_callback(lambda: {(): resident_memory_bytes()})
+
+
+def attach_bot(bot: DiscordBot) -> None:
+    """Provide the bot instance to the API"""
     # Store the bot instance in FastAPI's state object
     app.state.bot = bot
+    app.state.status_snapshot = bot.status_snapshot
+    metrics.GATEWAY_LATENCY.set_callback(lambda: {(): bot.latency})
+    metrics.PIPELINE_QUEUE_DEPTH.set_callback(lambda: {(): bot.pipeline.depth})
+    metrics.CACHE_ENTRIES.set_callback(
+        lambda: {(cache.name,): len(cache) for cache in bot.cache.caches}
+    )
+    metrics.CACHE_BYTES.set_callback(
+        lambda: {(cache.name,): cache.nbytes for cache in bot.cache.caches}
+    )
+
+
+def attach_supervisor(supervisor: ShardSupervisor) -> None:
+    """Report the shards' state, as aggregated by the supervisor, in the API"""
+    app.state.supervisor = supervisor
+    app.state.status_snapshot = supervisor.status_snapshot
+    metrics.SHARD_LATENCY.set_callback(
+        lambda: {
+            (str(shard["shard_id"]),): shard["latency"]
+            for shard in supervisor.shard_snapshot
+            if shard["latency"] is not None
+        }
+    )
+
+
+class ApiServer(uvicorn.Server):
+    """
+    uvicorn server that leaves SIGTERM and SIGINT to the shutdown coordinator
+    (`lib.lifecycle`), which stops it once the bot is marked not ready.
+    """
+
+    @contextlib.contextmanager
+    def capture_signals(self) -> Iterator[None]:
+        yield
 
-    config = uvicorn.Config(app, host="0.0.0.0", port=port, log_config=None)  # noqa: S104
-    server = uvicorn.Server(config)
-    await server.serve()
+
+def build_server(port: int) -> ApiServer:
+    config = uvicorn.Config(
+        app,
+        host="0.0.0.0",  # noqa: S104
+        port=port,
+        log_config=None,
+        # In-flight requests get this long to finish on shutdown
+        timeout_graceful_shutdown=int(API_STOP_TIMEOUT),
+    )
+    return ApiServer(config)
+
+
+class ApiServerTask:
+    """
+    Runs the API server as a task on the bot's event loop.
+
+    Call `attach_bot` or `attach_supervisor` before starting it.
+    """
+
+    def __init__(self, port: int) -> None:
+        self.server: ApiServer = build_server(port)
+        self.task: asyncio.Task[None] | None = None
+
+    def start(self) -> None:
+        self.task = asyncio.create_task(self.server.serve(), name="api-server")
+
+    async def stop(self) -> None:
+        """
+        Stop accepting connections, let in-flight requests finish, and wait for
+        the server to exit (cancelling it if it outlasts its graceful shutdown).
+        """
+        self.server.should_exit = True
+        if self.task is None:
+            return
+        timeout = API_STOP_TIMEOUT + 1
+        try:
+            async with asyncio.timeout(timeout):
+                await asyncio.shield(self.task)
+        except TimeoutError:
+            logger.warning("FastAPI server did not stop within %.1fs", timeout)
+            self.task.cancel()
+
+
+class ApiServerThread(threading.Thread):
+    """
+    Runs the API server on its own thread and event loop, so probes are
+    answered even while a slow handler or a blocking call holds up the bot's
+    loop.  The endpoints only read state the bot publishes for other threads:
+    the status snapshot, metrics and loop lag.
+
+    Call `attach_bot` or `attach_supervisor` before starting the thread.
+    """
+
+    def __init__(self, port: int) -> None:
+        super().__init__(name="api-server", daemon=True)
+        self.server: uvicorn.Server = build_server(port)
+
+    def run(self) -> None:
+        try:
+            asyncio.run(self.serve())
+        except SystemExit:
+            # uvicorn exits when it can't bind the port
+            logger.error("FastAPI server exited")  # noqa: TRY400
+
+    async def serve(self) -> None:
+        watchdog = tune_loop("api")
+        lag_task = start_lag_monitor("api")
+        try:
+            await self.server.serve()
+        finally:
+            lag_task.cancel()
+            if watchdog:
+                watchdog.stop()
+
+    def stop(self, timeout: float = API_STOP_TIMEOUT + 1) -> None:
+        """Ask uvicorn to shut down and wait for the thread to finish."""
+        self.server.should_exit = True
+        self.join(timeout)
+        if self.is_alive():
+            logger.warning("FastAPI server did not stop within %.1fs", timeout)
 
 
 class HealthCheckResponse(BaseModel):
@@ -30,41 +229,212 @@ class HealthCheckResponse(BaseModel):
     message: str
 
 
-@app.get("/healthcheck")
-async def healthcheck(request: Request) -> JSONResponse:
+@app.get("/healthcheck", response_model=HealthCheckResponse)
+async def healthcheck(request: Request) -> Response:
+    """
+    Liveness: whether the Discord bot has been ready, even if the gateway is
+    reconnecting.  Serves the body the bot pre-encoded on its last state change.
+    """
+    status_code, body = request.app.state.status_snapshot.healthcheck()
+    return Response(content=body, status_code=status_code, media_type=JSON_MEDIA_TYPE)
+
+
+@app.get("/ready", response_model=HealthCheckResponse)
+async def ready(request: Request) -> Response:
+    """
+    Readiness: whether the Discord bot is connected to the gateway and not
+    shutting down.
+    """
+    status_code, body = request.app.state.status_snapshot.readiness()
+    return Response(content=body, status_code=status_code, media_type=JSON_MEDIA_TYPE)
+
+
+class StatusResponse(BaseModel):
+    latency: float | None
+    is_ready: bool
+    user: str
+    time_to_ready: float | None
+    resumed: bool
+
+
+@app.get("/status", response_model=StatusResponse)
+async def status(request: Request) -> Response:
     """
-    Healthcheck endpoint that uses the Discord bot instance to check readiness.
+    Bot readiness, user and gateway latency (null before the first heartbeat),
+    plus the seconds the bot took to first become ready and whether it got
+    there by resuming a saved gateway session.
     """
-    bot = request.app.state.bot
-    if bot.is_ready():
+    return Response(
+        content=request.app.state.status_snapshot.status(),
+        media_type=JSON_MEDIA_TYPE,
+    )
+
+
+class LoggingReloadResponse(BaseModel):
+    full: bool
+    formatters: list[str] = []
+    handlers_rebuilt: list[str] = []
+    handlers_updated: list[str] = []
+    handlers_removed: list[str] = []
+    loggers: list[str] = []
+
+
+@app.post("/logging/reload", response_model=None)
+async def logging_reload() -> LoggingReloadResponse | JSONResponse:
+    """
+    Reload the logging configuration from disk, rebuilding only the
+    formatters, handlers and loggers that changed.
+    """
+    try:
+        changes = await asyncio.to_thread(logger_setup.reload_logger)
+    except (yaml.YAMLError, ValueError, TypeError, KeyError, AttributeError, OSError):
+        logger.exception("Error reloading logging configuration.")
         return JSONResponse(
-            status_code=200,
+            status_code=500,
             content=HealthCheckResponse(
-                status="ok", message="Bot is running and ready"
+                status="error", message="Failed to reload logging configuration"
             ).model_dump(),
         )
-    return JSONResponse(
-        status_code=503,
-        content=HealthCheckResponse(
-            status="not_ready", message="Bot is not ready"
-        ).model_dump(),
-    )
+    return LoggingReloadResponse(**changes)
 
 
-class StatusResponse(BaseModel):
-    latency: float
+class LogQueueStats(BaseModel):
+    size: int
+    maxsize: int | None = None
+    policy: str | None = None
+    enqueued: int | None = None
+    dropped: int | None = None
+    dropped_by_level: dict[str, int] = {}
+    high_water_mark: int | None = None
+
+
+@app.get("/logging/queues")
+async def logging_queues() -> dict[str, LogQueueStats]:
+    """
+    Depth of each logging queue, with enqueue/drop counters and high-water
+    marks for bounded queues.
+    """
+    return {
+        name: LogQueueStats(**stats)
+        for name, stats in logger_setup.get_queue_stats().items()
+    }
+
+
+@app.get("/metrics")
+async def metrics_endpoint() -> Response:
+    """
+    Metrics in the Prometheus text exposition format.
+    """
+    return Response(content=metrics.REGISTRY.render(), media_type=metrics.CONTENT_TYPE)
+
+
+class ShardStatus(BaseModel):
+    shard_id: int
+    worker: int
+    pid: int | None
+    alive: bool
+    restarts: int
     is_ready: bool
-    user: str
+    latency: float | None
+    last_report_age: float | None
 
 
-@app.get("/status")
-async def status(request: Request) -> StatusResponse:
-    bot = request.app.state.bot
-    latency: float = bot.latency
-    is_ready: bool = bot.is_ready()
-    user: str = str(bot.user) if isinstance(bot.user, ClientUser) else "Unknown"
-    return StatusResponse(
-        latency=latency,
-        is_ready=is_ready,
-        user=user,
-    )
+@app.get("/shards", response_model=None)
+async def shards(request: Request) -> list[ShardStatus] | JSONResponse:
+    """
+    Health and gateway latency of each shard, when running sharded.
+    """
+    supervisor: ShardSupervisor | None = getattr(request.app.state, "supervisor", None)
+    if supervisor is None:
+        return JSONResponse(
+            status_code=404,
+            content=HealthCheckResponse(
+                status="not_sharded", message="The bot is not running sharded"
+            ).model_dump(),
+        )
+    return [ShardStatus(**shard) for shard in supervisor.shard_snapshot]
+
+
+class CacheStats(BaseModel):
+    entries: int
+    bytes: int
+    max_bytes: int
+    ttl: float
+    hits: int
+    misses: int
+    hit_ratio: float
+    evictions: int
+    expirations: int
+
+
+@app.get("/cache", response_model=None)
+async def cache(request: Request) -> dict[str, CacheStats] | JSONResponse:
+    """
+    Size, hit ratio and evictions of the bot's message, user and guild caches.
+    """
+    bot: DiscordBot | None = getattr(request.app.state, "bot", None)
+    if bot is None:
+        return JSONResponse(
+            status_code=404,
+            content=HealthCheckResponse(
+                status="no_cache",
+                message="The caches live in the shard worker processes",
+            ).model_dump(),
+        )
+    return {name: CacheStats(**stats) for name, stats in bot.cache.stats().items()}
+
+
+class LatencyPercentiles(BaseModel):
+    p50: float
+    p95: float
+    p99: float
+
+
+class PipelineStats(BaseModel):
+    workers: int
+    queue_size: int
+    depth: int
+    lanes: list[int]
+    high_water_mark: int
+    processed: int
+    dropped: int
+    errors: int
+    wait: LatencyPercentiles
+    handle: LatencyPercentiles
+
+
+@app.get("/pipeline", response_model=None)
+async def pipeline(request: Request) -> PipelineStats | JSONResponse:
+    """
+    Depth of the message pipeline's lanes, its counters, and percentiles of
+    the time messages waited to be handled and took to handle, in seconds.
+    """
+    bot: DiscordBot | None = getattr(request.app.state, "bot", None)
+    if bot is None:
+        return JSONResponse(
+            status_code=404,
+            content=HealthCheckResponse(
+                status="no_pipeline",
+                message="The message pipelines run in the shard worker processes",
+            ).model_dump(),
+        )
+    return PipelineStats(**bot.pipeline.stats())
+
+
+class LoopLag(BaseModel):
+    lag: float
+    recent_max_lag: float
+    max_lag: float
+    samples: int
+    interval: float
+    slow_callbacks: dict[str, int] = {}
+
+
+@app.get("/loops")
+async def loops() -> dict[str, LoopLag]:
+    """
+    Event-loop lag, in seconds, of the bot's loop ("main") and, when the API
+    runs on its own thread, of the API server's loop ("api"), with the number
+    of slow callbacks per coroutine seen by the loop's watchdog.
+    """
+    return {name: LoopLag(**stats) for name, stats in get_lag_stats().items()}
@@ -1,27 +1,339 @@
 """DiscordBot class"""
 
+import asyncio
 import logging
+import time
+from collections.abc import Callable, Coroutine
+from typing import Any
 
+import aiohttp
 import discord
+import yarl
+from discord.gateway import DiscordWebSocket, ReconnectWebSocket
+
+from lib import metrics
+from lib.cache import BotCache, CachedGuild, CachedUser
+from lib.commands import CommandContext, CommandRouter
+from lib.logger_extras import bind_log_context
+from lib.outbound import OutboundDispatcher
+from lib.pipeline import MessagePipeline
+from lib.resume import GatewaySession, load_session, save_session
+from lib.startup import STARTUP
+from lib.status import StatusSnapshot
+from lib.store import StateStore
+from lib.utils import resident_memory_bytes
 
 logger: logging.Logger = logging.getLogger(__name__)
 
+# Seconds to wait for queued messages to be handled when the bot closes
+PIPELINE_DRAIN_TIMEOUT = 5.0
+# Seconds to wait for queued replies to be sent when the bot closes
+OUTBOUND_DRAIN_TIMEOUT = 5.0
+# Seconds between pushes of the heartbeat latency into the status snapshot
+LATENCY_REFRESH_INTERVAL = 5.0
+# Seconds to wait for the gateway to accept a connection (as discord.py does)
+GATEWAY_CONNECT_TIMEOUT = 60.0
+
 
 class DiscordBot(discord.Client):
     """Discord bot class"""
 
+    def __init__(
+        self,
+        *args: Any,  # noqa: ANN401
+        store: StateStore | None = None,
+        resume_max_age: float = 0.0,
+        **kwargs: Any,  # noqa: ANN401
+    ) -> None:
+        super().__init__(*args, **kwargs)
+        # Persistent state (settings, counters), if the bot was given a store
+        self.store: StateStore | None = store
+        # Save the gateway session in the store on close, and resume it on the
+        # next start if it is at most this many seconds old (0 disables)
+        self.resume_max_age: float = resume_max_age if store is not None else 0.0
+        # Seconds from `start` until first ready, and whether by resuming
+        self.time_to_ready: float | None = None
+        self.resumed: bool = False
+        self._start_time: float | None = None
+        self._suspended: bool = False
+        self.router: CommandRouter = CommandRouter()
+        self.outbound: OutboundDispatcher = OutboundDispatcher()
+        self.status_snapshot: StatusSnapshot = StatusSnapshot()
+        self.cache: BotCache = BotCache.from_env()
+        self.pipeline: MessagePipeline = MessagePipeline.from_env(self.on_message)
+        self._latency_task: asyncio.Task[None] | None = None
+        self.register_commands()
+
+    def register_commands(self) -> None:
+        """Register the bot's built-in commands"""
+        # Respond to messages starting with "hello"
+        self.router.add("hello", self.hello, match_prefix=True)
+
+    def dispatch(self, event: str, /, *args: Any, **kwargs: Any) -> None:  # noqa: ANN401
+        """Count every dispatched event by type"""
+        metrics.EVENTS_RECEIVED.inc(labels=(event,))
+        super().dispatch(event, *args, **kwargs)
+
+    async def setup_hook(self) -> None:
+        """Start background tasks once the client has an event loop"""
+        self._latency_task = asyncio.create_task(self.refresh_latency())
+        self.pipeline.start()
+
+    def _schedule_event(  # pyright: ignore[reportIncompatibleMethodOverride]
+        self,
+        coro: Callable[..., Coroutine[Any, Any, Any]],
+        event_name: str,
+        *args: Any,  # noqa: ANN401
+        **kwargs: Any,  # noqa: ANN401
+    ) -> asyncio.Task[Any] | None:
+        """
+        Queue messages into the pipeline, rather than starting a task for each
+        """
+        if event_name == "on_message" and self.pipeline.running:
+            self.pipeline.submit(args[0])
+            return None
+        return super()._schedule_event(coro, event_name, *args, **kwargs)
+
+    async def start(self, token: str, *, reconnect: bool = True) -> None:
+        """Log in and connect, timing how long until the bot is ready"""
+        self._start_time = time.perf_counter()
+        await super().start(token, reconnect=reconnect)
+
+    async def connect(self, *, reconnect: bool = True) -> None:
+        """Resume the session saved by the last run, if any, else identify"""
+        if self.resume_max_age > 0 and self.store is not None:
+            session = await load_session(self.store, self.resume_max_age)
+            if session is not None and await self.resume_session(session):
+                return
+        await super().connect(reconnect=reconnect)
+
+    async def resume_session(self, session: GatewaySession) -> bool:
+        """
+        Connect by resuming a saved session, and stay connected.  Returns True
+        once the bot is closed, or False if the session couldn't be resumed or
+        the connection failed, for `connect` to identify instead.
+        """
+        logger.info(
+            "Resuming gateway session %s (saved %.1fs ago)",
+            session.session_id,
+            session.age,
+        )
+        params: dict[str, Any] = {
+            "gateway": yarl.URL(session.resume_url),
+            "session": session.session_id,
+            "sequence": session.sequence,
+        }
+        while not self.is_closed():
+            try:
+                self.ws = await asyncio.wait_for(
+                    DiscordWebSocket.from_client(
+                        self, shard_id=self.shard_id, resume=True, **params
+                    ),
+                    timeout=GATEWAY_CONNECT_TIMEOUT,
+                )
+                while True:
+                    await self.ws.poll_event()
+            except ReconnectWebSocket as exc:
+                self.dispatch("disconnect")
+                if not exc.resume:
+                    logger.info("The gateway refused the saved session, identifying")
+                    return False
+                params.update(
+                    gateway=self.ws.gateway,
+                    session=self.ws.session_id,
+                    sequence=self.ws.sequence,
+                )
+            except (
+                OSError,
+                discord.HTTPException,
+                discord.ConnectionClosed,
+                aiohttp.ClientError,
+                TimeoutError,
+            ):
+                self.dispatch("disconnect")
+                if self.is_closed():
+                    break
+                logger.warning(
+                    "Lost the resumed gateway connection, identifying", exc_info=True
+                )
+                return False
+        return True
+
+    async def suspend_session(self) -> None:
+        """
+        Save the gateway session for the next start to resume, and disconnect
+        without ending it: discord.py closes with code 1000, which does.
+        """
+        ws = self.ws
+        if (
+            self.store is None
+            or ws is None
+            or not ws.open
+            or ws.session_id is None
+            or ws.sequence is None
+        ):
+            return
+        # Stops discord.py's connect loop from reconnecting once the socket closes
+        self._suspended = True
+        await ws.close(code=4000)
+        # No events are received after the close, so this is the last sequence
+        save_session(self.store, ws.session_id, ws.sequence, str(ws.gateway))
+        logger.info(
+            "Saved gateway session %s at sequence %d", ws.session_id, ws.sequence
+        )
+
+    def is_closed(self) -> bool:
+        """Whether the bot is closing (or has suspended its session to close)"""
+        return self._suspended or super().is_closed()
+
+    def mark_ready(self, *, resumed: bool) -> None:
+        """Record the time to the first ready, and report the bot as ready"""
+        if self.time_to_ready is None and self._start_time is not None:
+            self.time_to_ready = time.perf_counter() - self._start_time
+            self.resumed = resumed
+            logger.info(
+                "Ready %.0f ms after starting (%s)",
+                self.time_to_ready * 1000,
+                "resumed" if resumed else "identified",
+            )
+        self.status_snapshot.update(
+            is_ready=True,
+            user=str(self.user),
+            latency=self.latency,
+            time_to_ready=self.time_to_ready,
+            resumed=self.resumed,
+        )
+        STARTUP.finish("connect")
+
+    async def refresh_latency(self) -> None:
+        """Push the heartbeat latency into the status snapshot"""
+        while True:
+            self.status_snapshot.update(latency=self.latency)
+            await asyncio.sleep(LATENCY_REFRESH_INTERVAL)
+
+    async def drain(self) -> None:
+        """
+        Handle the queued messages and send their replies.  With session
+        resume enabled, the gateway session is suspended first, so events
+        from then on are replayed to the next run instead.
+        """
+        if self.resume_max_age > 0:
+            await self.suspend_session()
+        try:
+            async with asyncio.timeout(PIPELINE_DRAIN_TIMEOUT):
+                await self.pipeline.join()
+        except TimeoutError:
+            logger.warning("Timed out handling %d queued messages", self.pipeline.depth)
+        await self.pipeline.stop()
+        try:
+            async with asyncio.timeout(OUTBOUND_DRAIN_TIMEOUT):
+                await self.outbound.drain()
+        except TimeoutError:
+            logger.warning(
+                "Timed out sending %d queued messages", self.outbound.pending
+            )
+
+    async def close(self, *, drain: bool = True) -> None:
+        """
+        Close the connection, after draining the queued messages and replies
+        unless `drain` is false (when the caller drained them already, or
+        gave up on them).
+        """
+        if self._latency_task is not None:
+            self._latency_task.cancel()
+        if drain:
+            await self.drain()
+        else:
+            if self.resume_max_age > 0:
+                await self.suspend_session()
+            await self.pipeline.stop()
+        await super().close()
+
     async def on_ready(self) -> None:
         """Called when the bot is ready"""
         logger.info("We have logged in as %s", self.user)
+        logger.info(
+            "Connected to %d guilds, caching %d users (RSS %.1f MiB)",
+            len(self.guilds),
+            len(self.users),
+            resident_memory_bytes() / 2**20,
+        )
+        self.mark_ready(resumed=False)
+
+    async def on_disconnect(self) -> None:
+        """Called when the gateway connection drops"""
+        self.status_snapshot.update(is_ready=False)
+
+    async def on_resumed(self) -> None:
+        """Called when the gateway session is resumed"""
+        if not self.is_ready():
+            # Resumed the last run's session: there was no READY to set this,
+            # and wait_until_ready() would never return
+            self._ready.set()
+        self.mark_ready(resumed=True)
 
     async def on_message(self, message: discord.Message) -> None:
         """Called when a message is received"""
+        start = time.perf_counter()
+        # Tag everything logged while handling the message with where it came from
+        context = {"channel_id": message.channel.id, "message_id": message.id}
+        if message.guild is not None:
+            context["guild_id"] = message.guild.id
+        self.cache.add_message(message)
+        try:
+            with bind_log_context(**context):
+                await self.handle_message(message)
+        finally:
+            metrics.ON_MESSAGE_SECONDS.observe(time.perf_counter() - start)
+
+    async def handle_message(self, message: discord.Message) -> None:
+        """Respond to a message"""
         # Ignore messages from the bot itself
         if message.author == self.user:
             return
 
-        # Respond to messages starting with "hello"
-        if message.content.lower().startswith("hello"):
-            logger.info("Received 'hello' from %s", message.author)
-            await message.channel.send("Hello")
-            return
+        await self.router.dispatch(message)
+
+    async def on_guild_update(
+        self, _before: discord.Guild, after: discord.Guild
+    ) -> None:
+        """Drop a guild's cached settings when they change"""
+        self.cache.guilds.pop(after.id)
+
+    async def on_guild_remove(self, guild: discord.Guild) -> None:
+        """Drop a guild's cached settings when the bot leaves it"""
+        self.cache.guilds.pop(guild.id)
+
+    async def lookup_user(self, user_id: int) -> CachedUser | None:
+        """
+        Resolve a user from the bot's cache, then discord.py's cache, and only
+        then the API.  None if the user doesn't exist.
+        """
+        if (cached := self.cache.users.get(user_id)) is not None:
+            return cached
+        user = self.get_user(user_id)
+        if user is None:
+            try:
+                user = await self.fetch_user(user_id)
+            except discord.NotFound:
+                return None
+        cached = CachedUser.from_user(user)
+        self.cache.users.put(user_id, cached)
+        return cached
+
+    def guild_settings(self, guild_id: int) -> CachedGuild | None:
+        """A guild's cached settings, or None if the bot isn't in the guild"""
+        if (cached := self.cache.guilds.get(guild_id)) is not None:
+            return cached
+        guild = self.get_guild(guild_id)
+        if guild is None:
+            return None
+        cached = CachedGuild.from_guild(guild)
+        self.cache.guilds.put(guild_id, cached)
+        return cached
+
+    async def hello(self, ctx: CommandContext) -> None:
+        """Reply to 'hello'"""
+        message = ctx.message
+        logger.info("Received 'hello' from %s", message.author)
+        self.outbound.send(message.channel, "Hello")
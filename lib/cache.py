@@ -0,0 +1,371 @@
+"""
+Bounded caches for DiscordBot: recent messages per channel, resolved users
+and guild metadata.
+
+Each `LRUCache` evicts the least recently used entries beyond its entry or
+byte limit, and treats entries older than its TTL as misses.  A channel's
+entry is re-stored with every new message, so each cached message also keeps
+the time it was cached, and its own TTL applies to it.  Entries are
+compact `__slots__` objects holding only the fields the bot uses, rather than
+discord.py's models (which keep references to their state, channel, guild,
+author and so on).  Their size is estimated once, when they are created.
+
+Environment variables:
+- CACHE_MAX_BYTES: memory cap for all the caches together (split between them
+  by `CACHE_SHARES`)
+- CACHE_TTL: seconds before an entry is considered stale
+- CACHE_MESSAGES_PER_CHANNEL: recent messages kept for each channel
+"""
+
+import datetime as dt
+import os
+import sys
+import time
+from collections import OrderedDict, deque
+from collections.abc import Callable, Iterator
+from typing import Any, Protocol
+
+import discord
+
+# Default memory cap for all caches, in bytes
+DEFAULT_CACHE_MAX_BYTES = 32 * 1024 * 1024
+# Default seconds before an entry is stale
+DEFAULT_CACHE_TTL = 600.0
+# Default number of recent messages kept per channel
+DEFAULT_MESSAGES_PER_CHANNEL = 50
+# Share of CACHE_MAX_BYTES given to each cache
+CACHE_SHARES: dict[str, float] = {"messages": 0.7, "users": 0.2, "guilds": 0.1}
+
+
+class HasSize(Protocol):
+    @property
+    def nbytes(self) -> int: ...
+
+
+# Estimated bytes of an entry, besides its strings: the object and its ints
+ENTRY_OVERHEAD = 200
+
+
+def str_size(*values: str) -> int:
+    """Estimated bytes of some strings (exact for ASCII)."""
+    return sum(map(sys.getsizeof, values))
+
+
+class CachedMessage:
+    """The fields of a message the bot needs once the event has been handled."""
+
+    __slots__ = (
+        "author_id",
+        "cached_at",
+        "channel_id",
+        "content",
+        "guild_id",
+        "id",
+        "nbytes",
+    )
+
+    def __init__(  # noqa: PLR0913
+        self,
+        message_id: int,
+        channel_id: int,
+        guild_id: int | None,
+        author_id: int,
+        content: str,
+        cached_at: float,
+    ) -> None:
+        self.id: int = message_id
+        self.channel_id: int = channel_id
+        self.guild_id: int | None = guild_id
+        self.author_id: int = author_id
+        self.content: str = content
+        # The cache clock's time when the message was cached
+        self.cached_at: float = cached_at
+        self.nbytes: int = ENTRY_OVERHEAD + str_size(content)
+
+    @property
+    def created_at(self) -> dt.datetime:
+        """When the message was sent (from its snowflake ID)."""
+        return discord.utils.snowflake_time(self.id)
+
+    @classmethod
+    def from_message(
+        cls, message: discord.Message, cached_at: float
+    ) -> "CachedMessage":
+        guild = message.guild
+        return cls(
+            message.id,
+            message.channel.id,
+            guild.id if guild is not None else None,
+            message.author.id,
+            message.content,
+            cached_at,
+        )
+
+
+class CachedUser:
+    """A resolved user."""
+
+    __slots__ = ("bot", "display_name", "id", "name", "nbytes")
+
+    def __init__(
+        self, user_id: int, name: str, display_name: str, *, bot: bool
+    ) -> None:
+        self.id: int = user_id
+        self.name: str = name
+        self.display_name: str = display_name
+        self.bot: bool = bot
+        self.nbytes: int = ENTRY_OVERHEAD + str_size(name, display_name)
+
+    @classmethod
+    def from_user(cls, user: discord.abc.User) -> "CachedUser":
+        return cls(user.id, user.name, user.display_name, bot=user.bot)
+
+
+class CachedGuild:
+    """A guild's settings and metadata."""
+
+    __slots__ = (
+        "id",
+        "member_count",
+        "name",
+        "nbytes",
+        "owner_id",
+        "preferred_locale",
+    )
+
+    def __init__(
+        self,
+        guild_id: int,
+        name: str,
+        owner_id: int | None,
+        member_count: int | None,
+        preferred_locale: str,
+    ) -> None:
+        self.id: int = guild_id
+        self.name: str = name
+        self.owner_id: int | None = owner_id
+        self.member_count: int | None = member_count
+        self.preferred_locale: str = preferred_locale
+        self.nbytes: int = ENTRY_OVERHEAD + str_size(name, preferred_locale)
+
+    @classmethod
+    def from_guild(cls, guild: discord.Guild) -> "CachedGuild":
+        return cls(
+            guild.id,
+            guild.name,
+            guild.owner_id,
+            guild.member_count,
+            str(guild.preferred_locale),
+        )
+
+
+class ChannelMessages:
+    """The most recent messages of one channel, oldest first."""
+
+    __slots__ = ("messages", "nbytes")
+
+    def __init__(self, maxlen: int) -> None:
+        self.messages: deque[CachedMessage] = deque(maxlen=maxlen)
+        self.nbytes: int = sys.getsizeof(self.messages)
+
+    def append(self, message: CachedMessage) -> None:
+        if len(self.messages) == self.messages.maxlen:
+            self.nbytes -= self.messages[0].nbytes
+        self.messages.append(message)
+        self.nbytes += message.nbytes
+
+    def expire(self, cutoff: float) -> int:
+        """Drop the messages cached before `cutoff`; return how many."""
+        messages = self.messages
+        expired = 0
+        while messages and messages[0].cached_at < cutoff:
+            self.nbytes -= messages.popleft().nbytes
+            expired += 1
+        return expired
+
+
+class LRUCache[K, V: HasSize]:
+    """
+    A mapping that keeps its most recently used entries within `max_entries`
+    and `max_bytes` (0 for no limit), counting hits, misses and evictions.
+    Entries older than `ttl` seconds are dropped when they are next read.
+
+    Not thread-safe: use it from the bot's event loop.  `stats` only reads
+    plain counters, so other threads (the API) may call it.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        max_bytes: int = 0,
+        max_entries: int = 0,
+        ttl: float = DEFAULT_CACHE_TTL,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.name: str = name
+        self.max_bytes: int = max_bytes
+        self.max_entries: int = max_entries
+        self.ttl: float = ttl
+        self.clock: Callable[[], float] = clock
+        self.nbytes: int = 0
+        self.hits: int = 0
+        self.misses: int = 0
+        self.evictions: int = 0
+        self.expirations: int = 0
+        # key -> (value, time stored, bytes charged), least recently used first
+        self._entries: OrderedDict[K, tuple[V, float, int]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: object) -> bool:
+        return key in self._entries
+
+    def __iter__(self) -> Iterator[K]:
+        return iter(self._entries)
+
+    def get(self, key: K) -> V | None:
+        """The value for `key`, or None if it is missing or stale."""
+        value = self.peek(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def peek(self, key: K) -> V | None:
+        """Like `get`, without counting a hit or miss or refreshing the entry."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, stored, _ = entry
+        if self.ttl > 0 and self.clock() - stored > self.ttl:
+            self._remove(key)
+            self.expirations += 1
+            return None
+        return value
+
+    def put(self, key: K, value: V) -> None:
+        """
+        Store a value (or re-store it after it grew), then evict the least
+        recently used entries until the cache is within its limits.
+        """
+        if key in self._entries:
+            self._remove(key)
+        size = value.nbytes
+        self._entries[key] = (value, self.clock(), size)
+        self.nbytes += size
+        while self._entries and (
+            (self.max_bytes and self.nbytes > self.max_bytes)
+            or (self.max_entries and len(self._entries) > self.max_entries)
+        ):
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+
+    def pop(self, key: K) -> V | None:
+        """Remove and return the value for `key` (None if missing)."""
+        if key not in self._entries:
+            return None
+        return self._remove(key)
+
+    def _remove(self, key: K) -> V:
+        value, _, size = self._entries.pop(key)
+        self.nbytes -= size
+        return value
+
+    def stats(self) -> dict[str, Any]:
+        """A snapshot of the cache's size and counters."""
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self.nbytes,
+            "max_bytes": self.max_bytes,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+
+class BotCache:
+    """
+    The bot's caches, sharing one memory cap:
+    - messages: `ChannelMessages` by channel ID (their messages expire one by
+      one)
+    - users:    `CachedUser` by user ID
+    - guilds:   `CachedGuild` by guild ID
+    """
+
+    def __init__(
+        self,
+        max_bytes: int = DEFAULT_CACHE_MAX_BYTES,
+        ttl: float = DEFAULT_CACHE_TTL,
+        messages_per_channel: int = DEFAULT_MESSAGES_PER_CHANNEL,
+    ) -> None:
+        self.max_bytes: int = max_bytes
+        self.messages_per_channel: int = messages_per_channel
+        self.messages: LRUCache[int, ChannelMessages] = LRUCache(
+            "messages", int(max_bytes * CACHE_SHARES["messages"]), ttl=ttl
+        )
+        self.users: LRUCache[int, CachedUser] = LRUCache(
+            "users", int(max_bytes * CACHE_SHARES["users"]), ttl=ttl
+        )
+        self.guilds: LRUCache[int, CachedGuild] = LRUCache(
+            "guilds", int(max_bytes * CACHE_SHARES["guilds"]), ttl=ttl
+        )
+
+    @classmethod
+    def from_env(cls) -> "BotCache":
+        max_bytes = os.getenv("CACHE_MAX_BYTES", str(DEFAULT_CACHE_MAX_BYTES))
+        ttl = os.getenv("CACHE_TTL", str(DEFAULT_CACHE_TTL))
+        per_channel = os.getenv(
+            "CACHE_MESSAGES_PER_CHANNEL", str(DEFAULT_MESSAGES_PER_CHANNEL)
+        )
+        return cls(
+            max_bytes=int(max_bytes),
+            ttl=float(ttl),
+            messages_per_channel=int(per_channel),
+        )
+
+    @property
+    def caches(self) -> tuple[LRUCache[int, Any], ...]:
+        return (self.messages, self.users, self.guilds)
+
+    def add_message(self, message: discord.Message) -> None:
+        """Remember a received message, and its author."""
+        cached = CachedMessage.from_message(message, self.messages.clock())
+        channel = self.messages.peek(cached.channel_id)
+        if channel is None:
+            channel = ChannelMessages(self.messages_per_channel)
+        else:
+            self._expire_messages(channel, cached.cached_at)
+        channel.append(cached)
+        # Re-store, so the channel's new size is charged
+        self.messages.put(cached.channel_id, channel)
+        if self.users.peek(message.author.id) is None:
+            self.users.put(message.author.id, CachedUser.from_user(message.author))
+
+    def recent_messages(self, channel_id: int, limit: int = 0) -> list[CachedMessage]:
+        """The channel's cached messages, newest last (the last `limit` only)."""
+        channel = self.messages.get(channel_id)
+        if channel is None:
+            return []
+        if self._expire_messages(channel, self.messages.clock()):
+            # Re-store, so the channel's smaller size is charged
+            self.messages.put(channel_id, channel)
+        messages = list(channel.messages)
+        return messages[-limit:] if limit > 0 else messages
+
+    def _expire_messages(self, channel: ChannelMessages, now: float) -> int:
+        """Drop a channel's messages older than the TTL, counting them."""
+        if self.messages.ttl <= 0:
+            return 0
+        expired = channel.expire(now - self.messages.ttl)
+        self.messages.expirations += expired
+        return expired
+
+    def stats(self) -> dict[str, dict[str, Any]]:
+        return {cache.name: cache.stats() for cache in self.caches}
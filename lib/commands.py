@@ -0,0 +1,156 @@
+"""
+Command routing for DiscordBot.
+
+Commands are registered by name (and optional aliases) and stored in a
+case-insensitive character trie.  Dispatch walks the start of the message
+through the trie, so a message whose first character can't start any command
+is rejected after a single dict lookup, no matter how many commands exist.
+"""
+
+import logging
+from collections.abc import Awaitable, Callable
+
+import discord
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+
+class CommandContext:
+    """A matched command with its arguments, parsed once at dispatch."""
+
+    __slots__ = ("_args", "command", "invoked_with", "message", "rest")
+
+    def __init__(
+        self, message: discord.Message, command: "Command", invoked_with: str, rest: str
+    ) -> None:
+        self.message: discord.Message = message
+        self.command: Command = command
+        self.invoked_with: str = invoked_with
+        self.rest: str = rest
+        self._args: list[str] | None = None
+
+    @property
+    def args(self) -> list[str]:
+        """Whitespace-separated arguments after the command (split on first use)."""
+        if self._args is None:
+            self._args = self.rest.split()
+        return self._args
+
+
+CommandHandler = Callable[[CommandContext], Awaitable[None]]
+
+
+class Command:
+    """
+    A registered command.
+
+    `match_prefix` makes the command match any message that starts with its
+    name (e.g. "hello" also matches "hellooo"); otherwise the name must be
+    followed by whitespace or the end of the message.
+    """
+
+    __slots__ = ("aliases", "handler", "match_prefix", "name")
+
+    def __init__(
+        self,
+        name: str,
+        handler: CommandHandler,
+        aliases: tuple[str, ...] = (),
+        *,
+        match_prefix: bool = False,
+    ) -> None:
+        self.name: str = name
+        self.handler: CommandHandler = handler
+        self.aliases: tuple[str, ...] = aliases
+        self.match_prefix: bool = match_prefix
+
+
+class TrieNode:
+    __slots__ = ("children", "command")
+
+    def __init__(self) -> None:
+        self.children: dict[str, TrieNode] = {}
+        self.command: Command | None = None
+
+
+class CommandRouter:
+    """Registers commands and dispatches messages to them."""
+
+    def __init__(self) -> None:
+        self.root: TrieNode = TrieNode()
+        self.commands: dict[str, Command] = {}
+
+    def add(
+        self,
+        name: str,
+        handler: CommandHandler,
+        *aliases: str,
+        match_prefix: bool = False,
+    ) -> Command:
+        """Register a handler under `name` and any aliases."""
+        command = Command(name, handler, aliases, match_prefix=match_prefix)
+        for key in (alias.lower() for alias in (name, *aliases)):
+            if not key or key != key.strip() or len(key.split()) != 1:
+                msg = f"Invalid command name: {key!r}"
+                raise ValueError(msg)
+            if key in self.commands:
+                msg = f"Command already registered: {key!r}"
+                raise ValueError(msg)
+            node = self.root
+            for char in key:
+                node = node.children.setdefault(char, TrieNode())
+            node.command = command
+            self.commands[key] = command
+        return command
+
+    def command(
+        self, name: str, *aliases: str, match_prefix: bool = False
+    ) -> Callable[[CommandHandler], CommandHandler]:
+        """
+        Decorator to register a command handler, e.g.:
+
+            @router.command("ping", "p")
+            async def ping(ctx: CommandContext) -> None: ...
+        """
+
+        def decorator(handler: CommandHandler) -> CommandHandler:
+            self.add(name, handler, *aliases, match_prefix=match_prefix)
+            return handler
+
+        return decorator
+
+    def match(self, message: discord.Message) -> CommandContext | None:
+        """
+        Find the longest registered command at the start of the message.
+        Returns None as soon as the message can't match any command.
+        """
+        content = message.content
+        node = self.root
+        best: tuple[Command, int] | None = None
+        for index, char in enumerate(content):
+            next_node = node.children.get(char.lower())
+            if next_node is None:
+                break
+            node = next_node
+            command = node.command
+            if command is not None:
+                end = index + 1
+                if (
+                    command.match_prefix
+                    or end == len(content)
+                    or content[end].isspace()
+                ):
+                    best = (command, end)
+        if best is None:
+            return None
+        command, end = best
+        return CommandContext(message, command, content[:end], content[end:].strip())
+
+    async def dispatch(self, message: discord.Message) -> bool:
+        """Run the handler for the message's command.  Returns True if matched."""
+        ctx = self.match(message)
+        if ctx is None:
+            return False
+        logger.debug("Dispatching command %s", ctx.command.name)
+        await ctx.command.handler(ctx)
+        return True
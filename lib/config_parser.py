@@ -2,7 +2,9 @@
 Parse a yaml config file and resolve special tokens to allow for dynamic configuration.
 """
 
+import abc
 import ast
+import functools
 import operator as op
 import os
 import re
@@ -54,6 +56,13 @@ ALLOWED_UNARY_OPERATORS: dict[
 }
 
 
+ENV_PREFIX = "@env"
+FORMAT_PREFIX = "@format"
+MATH_PREFIX = "@math"
+FORMAT_FIELD_PATTERN: re.Pattern[str] = re.compile(r"{(.*?)}")
+MATH_CACHE_SIZE = 256
+
+
 def eval_ast(expr: str) -> int | float:
     """
     Safely evaluate an AST generated from a mathematical expression.
@@ -94,26 +103,34 @@ def eval_ast(expr: str) -> int | float:
         raise ValueError(msg) from e
 
 
-def resolve_env_token(token: str) -> str | None:
+def parse_env_token(token: str) -> tuple[str, str | None]:
+    """
+    Split an @env token into the environment variable name and its default value.
+    """
     try:
         # Extract environment variable name and default value
-        parts = token.replace("@env", "").strip().split(",")
+        parts = token.removeprefix(ENV_PREFIX).strip().split(",")
         env_var_name = parts[0].strip()
         default_value = parts[1].strip() if len(parts) > 1 else None
     except IndexError as e:
         msg = f"Invalid @env token format: {token}"
         raise ValueError(msg) from e
     else:
-        return os.getenv(env_var_name, default_value)
+        return env_var_name, default_value
+
+
+def resolve_env_token(token: str) -> str | None:
+    env_var_name, default_value = parse_env_token(token)
+    return os.getenv(env_var_name, default_value)
 
 
 def resolve_format_token(token: str) -> str | None:
     try:
         # Extract the inner string for @format
-        formatted_string = token.replace("@format", "").strip()
+        formatted_string = token.removeprefix(FORMAT_PREFIX).strip()
 
         # Find and resolve all nested tokens using a regex
-        tokens = re.findall(r"{(.*?)}", formatted_string)
+        tokens = FORMAT_FIELD_PATTERN.findall(formatted_string)
         resolved_tokens = {token: resolve_value(token) for token in tokens}
 
         # Replace each nested token with its resolved value
@@ -133,7 +150,7 @@ def resolve_format_token(token: str) -> str | None:
 def resolve_math_token(token: str) -> int | float | None:
     try:
         # Remove the @math prefix and evaluate the expression
-        math_expression = token.replace("@math", "").strip()
+        math_expression = token.removeprefix(MATH_PREFIX).strip()
         result = eval_ast(math_expression)
     except Exception as e:
         msg = f"Invalid @math expression: {token}. Error: {e}"
@@ -148,13 +165,13 @@ def resolve_value(value: str) -> str | int | float | None:
     If the value contains a special token, it gets evaluated.
     """
     # Handle @env tokens
-    if isinstance(value, str) and value.startswith("@env"):
+    if isinstance(value, str) and value.startswith(ENV_PREFIX):
         return resolve_env_token(value)
     # Handle @format tokens
-    if isinstance(value, str) and value.startswith("@format"):
+    if isinstance(value, str) and value.startswith(FORMAT_PREFIX):
         return resolve_format_token(value)
     # Handle @math tokens
-    if isinstance(value, str) and value.startswith("@math"):
+    if isinstance(value, str) and value.startswith(MATH_PREFIX):
         return resolve_math_token(value)
     return value
 
@@ -192,6 +209,237 @@ def resolve_values(
         - "@env ENV_VAR,default_value"
         - "@format {@env ENV_VAR1,default_value1}/{@env ENV_VAR2,default_value2}"
         - "@math 1 + 2 * 3"
+
+    This compiles the dictionary and resolves it once.  Callers that resolve the
+    same document repeatedly should hold on to the result of `compile_config`.
+    """
+    return compile_config(env_dict).resolve()
+
+
+# Memoized @math evaluation - expressions are pure, so results can be shared
+# between every compiled document in the process.
+_eval_math_cached: Callable[[str], int | float] = functools.lru_cache(
+    maxsize=MATH_CACHE_SIZE
+)(eval_ast)
+
+
+class ConfigNode(abc.ABC):
+    """
+    A node in a compiled configuration plan.
+
+    `env_vars` holds every environment variable the node (or any of its
+    children) depends on, so unchanged subtrees can be skipped on re-resolution.
+    """
+
+    __slots__ = ("env_vars",)
+
+    def __init__(self, env_vars: frozenset[str] = frozenset()) -> None:
+        self.env_vars: frozenset[str] = env_vars
+
+    @abc.abstractmethod
+    def resolve(self, changed: frozenset[str] | None = None) -> object:
+        """
+        Resolve the node.  `changed` limits re-evaluation to nodes that depend
+        on the given environment variables; `None` resolves everything.
+        """
+
+
+class ConstantNode(ConfigNode):
+    """A value with no tokens (or a folded @math result)."""
+
+    __slots__ = ("value",)
+
+    def __init__(self, value: object) -> None:
+        super().__init__()
+        self.value: object = value
+
+    def resolve(self, changed: frozenset[str] | None = None) -> object:  # noqa: ARG002
+        return self.value
+
+
+class EnvNode(ConfigNode):
+    """An @env token: `@env ENV_VAR,default_value`"""
+
+    __slots__ = ("default", "name")
+
+    def __init__(self, name: str, default: str | None) -> None:
+        super().__init__(frozenset((name,)))
+        self.name: str = name
+        self.default: str | None = default
+
+    def resolve(self, changed: frozenset[str] | None = None) -> str | None:  # noqa: ARG002
+        return os.getenv(self.name, self.default)
+
+
+class FormatNode(ConfigNode):
+    """An @format token, pre-split into its `{...}` fields."""
+
+    __slots__ = ("fields", "template")
+
+    def __init__(
+        self, template: str, fields: tuple[tuple[str, ConfigNode], ...]
+    ) -> None:
+        super().__init__(frozenset().union(*(node.env_vars for _, node in fields)))
+        self.template: str = template
+        self.fields: tuple[tuple[str, ConfigNode], ...] = fields
+
+    def resolve(self, changed: frozenset[str] | None = None) -> str:
+        formatted_string = self.template
+        for placeholder, node in self.fields:
+            resolved_value = node.resolve(changed)
+            if resolved_value is None:
+                continue  # Skip tokens wth `None` values
+            formatted_string = formatted_string.replace(
+                placeholder, str(resolved_value)
+            )
+        return formatted_string
+
+
+class DictNode(ConfigNode):
+    """
+    A dictionary with at least one token somewhere below it.
+    The last resolved dictionary is kept and reused until a dependency changes.
+    """
+
+    __slots__ = ("_resolved", "children")
+
+    def __init__(self, children: dict[str, ConfigNode]) -> None:
+        super().__init__(
+            frozenset().union(*(node.env_vars for node in children.values()))
+        )
+        self.children: dict[str, ConfigNode] = children
+        self._resolved: dict[str, object] | None = None
+
+    def resolve(self, changed: frozenset[str] | None = None) -> dict[str, object]:
+        previous = self._resolved
+        if previous is not None and changed is not None:
+            if not self.env_vars & changed:
+                return previous
+            resolved = {
+                key: node.resolve(changed) if node.env_vars & changed else previous[key]
+                for key, node in self.children.items()
+            }
+        else:
+            resolved = {key: node.resolve() for key, node in self.children.items()}
+        self._resolved = resolved
+        return resolved
+
+
+def compile_format_token(token: str) -> ConfigNode:
+    """
+    Compile an @format token.  Fields are compiled once; a token with no @env
+    fields is folded into a `ConstantNode`.
+    """
+    try:
+        template = token.removeprefix(FORMAT_PREFIX).strip()
+        fields = tuple(
+            (f"{{{field}}}", compile_value(field))
+            for field in dict.fromkeys(FORMAT_FIELD_PATTERN.findall(template))
+        )
+    except Exception as e:
+        msg = f"Invalid @format token format: {token}. Error: {e}"
+        raise ValueError(msg) from e
+    node = FormatNode(template, fields)
+    return node if node.env_vars else ConstantNode(node.resolve())
+
+
+def compile_math_token(token: str) -> ConstantNode:
+    """Evaluate an @math token once and fold it into a `ConstantNode`."""
+    try:
+        result = _eval_math_cached(token.removeprefix(MATH_PREFIX).strip())
+    except Exception as e:
+        msg = f"Invalid @math expression: {token}. Error: {e}"
+        raise ValueError(msg) from e
+    return ConstantNode(result)
+
+
+def compile_value(value: object) -> ConfigNode:
+    """
+    Compile a single config value into a `ConfigNode`.
+    Dictionaries without any tokens are folded into a single `ConstantNode`.
+    """
+    if isinstance(value, dict):
+        children = {key: compile_value(child) for key, child in value.items()}
+        if all(isinstance(node, ConstantNode) for node in children.values()):
+            return ConstantNode(
+                {
+                    key: node.value
+                    for key, node in children.items()
+                    if isinstance(node, ConstantNode)
+                }
+            )
+        return DictNode(children)
+    if isinstance(value, str):
+        if value.startswith(ENV_PREFIX):
+            return EnvNode(*parse_env_token(value))
+        if value.startswith(FORMAT_PREFIX):
+            return compile_format_token(value)
+        if value.startswith(MATH_PREFIX):
+            return compile_math_token(value)
+    return ConstantNode(value)
+
+
+def _copy_tree(value: object) -> object:
+    """Copy the dict/list structure of a resolved value, sharing the leaves."""
+    if isinstance(value, dict):
+        return {key: _copy_tree(child) for key, child in value.items()}
+    if isinstance(value, list):
+        return [_copy_tree(child) for child in value]
+    return value
+
+
+class CompiledConfig:
+    """
+    A reusable resolution plan for a loaded YAML document.
+
+    Every call to `resolve` returns a fresh dictionary (consumers such as
+    `logging.config.dictConfig` mutate what they are given), but only the nodes
+    that depend on environment variables that changed since the last call are
+    re-evaluated.
+    """
+
+    def __init__(self, root: ConfigNode) -> None:
+        self.root: ConfigNode = root
+        self._env_snapshot: dict[str, str | None] | None = None
+        self._resolved: object = None
+
+    @property
+    def env_vars(self) -> frozenset[str]:
+        """All environment variables referenced by the document."""
+        return self.root.env_vars
+
+    def changed_env_vars(self) -> frozenset[str]:
+        """Environment variables whose value differs from the last resolution."""
+        if self._env_snapshot is None:
+            return self.env_vars
+        return frozenset(
+            name
+            for name, value in self._env_snapshot.items()
+            if os.environ.get(name) != value
+        )
+
+    def resolve(self) -> dict[str, Any | dict[str, Any]]:
+        """Resolve the document against the current environment."""
+        if self._env_snapshot is None:
+            self._resolved = self.root.resolve()
+        elif changed := self.changed_env_vars():
+            self._resolved = self.root.resolve(changed)
+        self._env_snapshot = {name: os.environ.get(name) for name in self.env_vars}
+
+        resolved = _copy_tree(self._resolved)
+        if not isinstance(resolved, dict):
+            msg = (
+                f"Expected a dictionary at the top level, got {type(resolved).__name__}"
+            )
+            raise TypeError(msg)
+        return resolved
+
+
+def compile_config(
+    env_dict: dict[str, Any | dict[str, Any]],
+) -> CompiledConfig:
+    """
+    Compile a loaded YAML document into a `CompiledConfig`.
+    Token syntax errors are raised here rather than on every resolution.
     """
-    # Start recursive resolution on the top-level dictionary
-    return resolve_nested_dict(env_dict)
+    return CompiledConfig(compile_value(env_dict))
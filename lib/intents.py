@@ -0,0 +1,156 @@
+"""
+Gateway intent selection for DiscordBot.
+
+Rather than subscribing to every gateway event (`Intents.all()`), the bot's
+intents are derived from the `on_<event>` handlers it actually defines.  Every
+intent the bot doesn't request is an event stream Discord doesn't send and a
+cache discord.py doesn't fill (presences and the member list, in particular).
+"""
+
+import logging
+import os
+from typing import Any
+
+import discord
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+# Events whose handlers need the message cache (their non-raw variants only
+# fire for cached messages)
+MESSAGE_CACHE_EVENTS: frozenset[str] = frozenset(
+    {
+        "message_edit",
+        "message_delete",
+        "bulk_message_delete",
+        "reaction_add",
+        "reaction_remove",
+        "reaction_clear",
+        "reaction_clear_emoji",
+    }
+)
+# Default message cache size when a handler needs it (discord.py's default)
+DEFAULT_MAX_MESSAGES = 1000
+
+# Intents needed to receive each event; `guilds` is always enabled
+EVENT_INTENTS: dict[str, tuple[str, ...]] = {
+    "message": ("guild_messages", "dm_messages", "message_content"),
+    "message_edit": ("guild_messages", "dm_messages", "message_content"),
+    "message_delete": ("guild_messages", "dm_messages"),
+    "bulk_message_delete": ("guild_messages",),
+    "raw_message_edit": ("guild_messages", "dm_messages", "message_content"),
+    "raw_message_delete": ("guild_messages", "dm_messages"),
+    "raw_bulk_message_delete": ("guild_messages",),
+    "reaction_add": ("guild_reactions", "dm_reactions"),
+    "reaction_remove": ("guild_reactions", "dm_reactions"),
+    "reaction_clear": ("guild_reactions", "dm_reactions"),
+    "reaction_clear_emoji": ("guild_reactions", "dm_reactions"),
+    "raw_reaction_add": ("guild_reactions", "dm_reactions"),
+    "raw_reaction_remove": ("guild_reactions", "dm_reactions"),
+    "raw_reaction_clear": ("guild_reactions", "dm_reactions"),
+    "raw_reaction_clear_emoji": ("guild_reactions", "dm_reactions"),
+    "typing": ("guild_typing", "dm_typing"),
+    "raw_typing": ("guild_typing", "dm_typing"),
+    "presence_update": ("presences", "members"),
+    "member_join": ("members",),
+    "member_remove": ("members",),
+    "member_update": ("members",),
+    "raw_member_remove": ("members",),
+    "user_update": ("members",),
+    "member_ban": ("moderation",),
+    "member_unban": ("moderation",),
+    "audit_log_entry_create": ("moderation",),
+    "voice_state_update": ("voice_states",),
+    "guild_emojis_update": ("emojis_and_stickers",),
+    "guild_stickers_update": ("emojis_and_stickers",),
+    "integration_create": ("integrations",),
+    "integration_update": ("integrations",),
+    "raw_integration_delete": ("integrations",),
+    "webhooks_update": ("webhooks",),
+    "invite_create": ("invites",),
+    "invite_delete": ("invites",),
+    "scheduled_event_create": ("guild_scheduled_events",),
+    "scheduled_event_delete": ("guild_scheduled_events",),
+    "scheduled_event_update": ("guild_scheduled_events",),
+    "scheduled_event_user_add": ("guild_scheduled_events",),
+    "scheduled_event_user_remove": ("guild_scheduled_events",),
+    "automod_rule_create": ("auto_moderation_configuration",),
+    "automod_rule_update": ("auto_moderation_configuration",),
+    "automod_rule_delete": ("auto_moderation_configuration",),
+    "automod_action": ("auto_moderation_execution",),
+    "poll_vote_add": ("polls",),
+    "poll_vote_remove": ("polls",),
+}
+
+
+def handled_events(client_class: type[discord.Client]) -> set[str]:
+    """Names of the events a client class defines `on_<event>` handlers for."""
+    return {
+        name.removeprefix("on_")
+        for name in dir(client_class)
+        if name.startswith("on_") and callable(getattr(client_class, name))
+    }
+
+
+def intents_for_events(events: set[str]) -> discord.Intents:
+    """The smallest set of intents that delivers `events`."""
+    intents = discord.Intents.none()
+    intents.guilds = True
+    for event in sorted(events):
+        for flag in EVENT_INTENTS.get(event, ()):
+            setattr(intents, flag, True)
+    return intents
+
+
+def parse_intents(spec: str) -> discord.Intents:
+    """
+    Parse an intents override: "all", "default", "none", or a comma-separated
+    list of intent flag names (e.g. "guilds,guild_messages,message_content").
+    """
+    spec = spec.strip().lower()
+    if spec in {"all", "default", "none"}:
+        return getattr(discord.Intents, spec)()
+    intents = discord.Intents.none()
+    for flag in filter(None, (part.strip() for part in spec.split(","))):
+        if flag not in discord.Intents.VALID_FLAGS:
+            msg = f"Unknown gateway intent: {flag!r}"
+            raise ValueError(msg)
+        setattr(intents, flag, True)
+    return intents
+
+
+def resolve_intents(client_class: type[discord.Client]) -> discord.Intents:
+    """
+    The intents to start the bot with: the `BOT_INTENTS` override if set,
+    otherwise the intents needed by the client's event handlers.
+    """
+    if override := os.getenv("BOT_INTENTS"):
+        intents = parse_intents(override)
+        logger.info("Using gateway intents from BOT_INTENTS")
+    else:
+        intents = intents_for_events(handled_events(client_class))
+    enabled = sorted(flag for flag, value in intents if value)
+    logger.info("Gateway intents: %s", ", ".join(enabled) or "none")
+    return intents
+
+
+def resolve_max_messages(client_class: type[discord.Client]) -> int | None:
+    """
+    Size of the client's message cache: `BOT_MAX_MESSAGES` if set (0 disables
+    the cache), otherwise disabled unless a handler needs cached messages.
+    """
+    if (override := os.getenv("BOT_MAX_MESSAGES")) is not None:
+        return int(override) or None
+    if handled_events(client_class) & MESSAGE_CACHE_EVENTS:
+        return DEFAULT_MAX_MESSAGES
+    return None
+
+
+def cache_options(intents: discord.Intents, max_messages: int | None) -> dict[str, Any]:
+    """Client cache settings sized to match the enabled intents."""
+    return {
+        "max_messages": max_messages,
+        # Only keep members the enabled intents can keep up to date
+        "member_cache_flags": discord.MemberCacheFlags.from_intents(intents),
+        # Requesting every guild's member list only makes sense with `members`
+        "chunk_guilds_at_startup": intents.members,
+    }
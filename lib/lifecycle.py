@@ -0,0 +1,151 @@
+"""
+Graceful shutdown.
+
+`main.py` registers the shutdown phases with a `ShutdownCoordinator` and waits
+for SIGTERM (sent by Kubernetes and `docker stop`) or SIGINT.  The phases then
+run in order, each bounded by its own timeout, so one stuck phase can't use up
+the whole termination grace period and the later phases (closing the gateway,
+flushing logs) still run.  A second signal skips the phase in progress.
+
+Like startup (`lib.startup`), the time each phase took is reported in a
+single log line, also as `shutdown_<phase>_ms` fields in the JSON logs.
+"""
+
+import asyncio
+import logging
+import signal
+import time
+from collections.abc import Awaitable, Callable
+from typing import Any
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+SHUTDOWN_SIGNALS = (signal.SIGTERM, signal.SIGINT)
+
+
+class ShutdownPhase:
+    __slots__ = ("action", "name", "outcome", "seconds", "timeout")
+
+    def __init__(
+        self, name: str, action: Callable[[], Awaitable[object]], timeout: float
+    ) -> None:
+        self.name: str = name
+        self.action: Callable[[], Awaitable[object]] = action
+        self.timeout: float = timeout
+        self.seconds: float | None = None
+        # "ok", "timeout", "skipped" or "error", once the phase has run
+        self.outcome: str | None = None
+
+
+class ShutdownCoordinator:
+    """
+    Runs the registered shutdown phases, in order, once shutdown is requested.
+    """
+
+    def __init__(self) -> None:
+        self.phases: list[ShutdownPhase] = []
+        self.reason: str | None = None
+        self._requested: asyncio.Event = asyncio.Event()
+        self._current: asyncio.Task[object] | None = None
+
+    @property
+    def requested(self) -> bool:
+        return self._requested.is_set()
+
+    def add_phase(
+        self, name: str, action: Callable[[], Awaitable[object]], timeout: float
+    ) -> None:
+        """Run `action` (given `timeout` seconds) after the phases added before."""
+        self.phases.append(ShutdownPhase(name, action, timeout))
+
+    def install_signal_handlers(self) -> None:
+        """Request shutdown on SIGTERM and SIGINT (on the running loop)."""
+        loop = asyncio.get_running_loop()
+        for sig in SHUTDOWN_SIGNALS:
+            loop.add_signal_handler(sig, self.request, sig.name)
+
+    def remove_signal_handlers(self) -> None:
+        loop = asyncio.get_running_loop()
+        for sig in SHUTDOWN_SIGNALS:
+            loop.remove_signal_handler(sig)
+
+    def request(self, reason: str) -> None:
+        """Start shutting down; if already shutting down, skip the current phase."""
+        if not self.requested:
+            logger.info("Shutting down (%s)...", reason)
+            self.reason = reason
+            self._requested.set()
+        elif self._current is not None and not self._current.done():
+            logger.warning(
+                "%s received while shutting down, skipping the current phase", reason
+            )
+            self._current.cancel()
+
+    async def wait(self, *tasks: "asyncio.Future[Any]") -> None:
+        """
+        Wait until shutdown is requested, or until one of `tasks` finishes
+        (e.g. the bot's connection failed), which also requests shutdown.
+        """
+        requested = asyncio.ensure_future(self._requested.wait())
+        done, _ = await asyncio.wait(
+            {requested, *tasks}, return_when=asyncio.FIRST_COMPLETED
+        )
+        if requested not in done:
+            requested.cancel()
+            self.request("stopped")
+
+    async def run(self) -> None:
+        """Run every phase, then report how long each took."""
+        start = time.perf_counter()
+        for phase in self.phases:
+            phase_start = time.perf_counter()
+            self._current = asyncio.ensure_future(phase.action())
+            try:
+                async with asyncio.timeout(phase.timeout):
+                    await asyncio.shield(self._current)
+                phase.outcome = "ok"
+            except TimeoutError:
+                self._current.cancel()
+                phase.outcome = "timeout"
+                logger.warning(
+                    "Shutdown phase %s timed out after %.1fs", phase.name, phase.timeout
+                )
+            except asyncio.CancelledError:
+                if not self._current.cancelled():
+                    raise
+                phase.outcome = "skipped"
+            except Exception:
+                phase.outcome = "error"
+                logger.exception("Shutdown phase %s failed", phase.name)
+            phase.seconds = time.perf_counter() - phase_start
+            logger.debug(
+                "Shutdown phase %s: %s in %.0f ms",
+                phase.name,
+                phase.outcome,
+                phase.seconds * 1000,
+            )
+        self._current = None
+        self.report(time.perf_counter() - start)
+
+    def fields(self, total: float) -> dict[str, float]:
+        """Phase durations in milliseconds, as structured log fields."""
+        fields = {
+            f"shutdown_{phase.name}_ms": round(phase.seconds * 1000, 1)
+            for phase in self.phases
+            if phase.seconds is not None
+        }
+        fields["shutdown_total_ms"] = round(total * 1000, 1)
+        return fields
+
+    def report(self, total: float) -> None:
+        logger.info(
+            "Shutdown took %.0f ms (%s)",
+            total * 1000,
+            ", ".join(
+                f"{phase.name} {phase.seconds * 1000:.0f} ms"
+                + ("" if phase.outcome == "ok" else f" [{phase.outcome}]")
+                for phase in self.phases
+                if phase.seconds is not None
+            ),
+            extra=self.fields(total),
+        )
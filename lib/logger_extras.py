@@ -1,14 +1,38 @@
 import datetime as dt
+import glob
+import gzip
 import http
+import http.client
+import importlib
+import itertools
 import json
 import logging
+import logging.handlers
+import mmap
+import os
+import queue
 import re
-from types import TracebackType
-from typing import Any, ClassVar, Literal, override
+import shutil
+import socket
+import string
+import struct
+import sys
+import threading
+import time
+import traceback
+import urllib.parse
+from collections.abc import Callable, Iterator, Mapping
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Any, BinaryIO, ClassVar, Literal, override
 
 import colorlog
+from colorlog.escape_codes import escape_codes, parse_colors
 from uvicorn.logging import AccessFormatter
 
+from lib import metrics
+
 LOG_RECORD_BUILTIN_ATTRS = {
     "args",
     "asctime",
@@ -35,58 +59,161 @@ LOG_RECORD_BUILTIN_ATTRS = {
     "taskName",
 }
 
+# Record attribute holding the rendered log context for text formatters (use
+# `defaults: {log_context: ""}` in their config); JSON output gets the
+# individual fields instead
+LOG_CONTEXT_ATTR = "log_context"
+# Record attributes JSONFormatter doesn't emit as extra keys
+JSON_EXCLUDED_ATTRS = frozenset(LOG_RECORD_BUILTIN_ATTRS | {LOG_CONTEXT_ATTR})
+
+# Reason phrase for every known status code (e.g. 200 -> "OK")
+HTTP_STATUS_PHRASES: dict[int, str] = {
+    status.value: status.phrase for status in http.HTTPStatus
+}
+
+# Serializers supported by JSONFormatter, fastest first ("auto" picks the first
+# one that is installed)
+JSON_SERIALIZERS: tuple[str, ...] = ("orjson", "msgspec", "json")
+# Fields computed by JSONFormatter rather than read from the record
+JSON_ALWAYS_FIELDS = frozenset({"message", "timestamp", "exc_info", "stack_info"})
+
+# What RateLimitFilter counts records by
+RATE_LIMIT_KEYS = frozenset({"logger", "template", "message"})
+
+# Overflow policies supported by BoundedLogQueue
+QUEUE_OVERFLOW_POLICIES = frozenset({"block", "drop_oldest", "drop_newest", "sample"})
+
+# Compressors supported by CompressingFileHandler, by file extension ("auto"
+# uses zstd when the `zstandard` package is installed, gzip otherwise)
+SEGMENT_COMPRESSORS: dict[str, str] = {"gzip": ".gz", "zstd": ".zst"}
+# Timestamp in the names of rotated segments; sorts chronologically
+SEGMENT_TIMESTAMP_FORMAT = "%Y%m%d-%H%M%S-%f"
+
+# URL schemes supported by LogShippingHandler, with their default ports
+SHIPPING_SCHEMES: dict[str, int] = {"http": 80, "https": 443, "tcp": 514}
+# Client errors worth retrying; the collector rejects a batch for good with
+# any other 4xx status
+SHIPPING_RETRY_STATUSES = frozenset(
+    {http.HTTPStatus.REQUEST_TIMEOUT, http.HTTPStatus.TOO_MANY_REQUESTS}
+)
+# Syslog severity of each log level, for LogShippingHandler's tcp:// transport
+SYSLOG_DEBUG = logging.handlers.SysLogHandler.LOG_DEBUG
+SYSLOG_SEVERITIES: dict[str, int] = {
+    "CRITICAL": logging.handlers.SysLogHandler.LOG_CRIT,
+    "ERROR": logging.handlers.SysLogHandler.LOG_ERR,
+    "WARNING": logging.handlers.SysLogHandler.LOG_WARNING,
+    "INFO": logging.handlers.SysLogHandler.LOG_INFO,
+    "DEBUG": SYSLOG_DEBUG,
+}
 
-class CustomLogRecord(logging.LogRecord):
+# Maximum number of buffers passed to a single os.writev call
+WRITEV_MAX_BUFFERS = 1024
+# Records a BatchingFileHandler buffers before dropping new ones
+DEFAULT_MAX_BUFFERED = 100_000
+
+# Number of positional args uvicorn passes to its access logger
+# (client address, method, full path, HTTP version and status code)
+UVICORN_ACCESS_ARGS_LEN = 5
+
+
+class LogContext:
     """
-    Custom LogRecord to add support for new attributes like client_addr.
+    Correlation fields bound with `bind_log_context`, and their rendering for
+    text formatters (e.g. " [guild_id=1 channel_id=2]").
     """
 
-    def __init__(  # noqa: PLR0913
-        self,
-        name: str,
-        level: int,
-        pathname: str,
-        lineno: int,
-        msg: object,
-        args: tuple[object, ...],
-        exc_info: tuple[None, None, None]
-        | tuple[type[BaseException], BaseException, TracebackType | None]
-        | None = None,
-        func: str | None = None,
-        sinfo: str | None = None,
-    ) -> None:
-        super().__init__(
-            name, level, pathname, lineno, msg, args, exc_info, func, sinfo
-        )
-        # Define any new attributes with default values
-        self.client_addr: str | None = None
-        self.http_version: str | None = None
-        self.method: str | None = None
-        self.path: str | None = None
-        self.reason_phrase: str | None = None
-        self.status_code: int | None = None
-        self.status_color: str | None = None
-
-    def __str__(self) -> str:
-        """
-        Provide a debug-friendly string representation of the log record
-        including the custom attributes.
-        """
-        return (
-            f"{super().__str__()} "
-            f"(client_addr={self.client_addr}, method={self.method}, path={self.path}, "
-            f"status_code={self.status_code}, http_version={self.http_version})"
+    __slots__ = ("fields", "rendered")
+
+    def __init__(self, fields: dict[str, object]) -> None:
+        self.fields: dict[str, object] = fields
+        self.rendered: str = (
+            " [" + " ".join(f"{key}={value}" for key, value in fields.items()) + "]"
         )
 
 
-def custom_log_record_factory(
-    *args: Any,  # noqa: ANN401
-    **kwargs: Any,  # noqa: ANN401
-) -> logging.LogRecord:
+# The fields bound to the current task or thread; None when nothing is bound
+LOG_CONTEXT: ContextVar[LogContext | None] = ContextVar("log_context", default=None)
+
+
+@contextmanager
+def bind_log_context(**fields: object) -> Iterator[None]:
     """
-    Factory function to create CustomLogRecord instances.
+    Add correlation fields (request_id, guild_id, ...) to every record logged
+    in this block, and in the tasks it creates.  Nested blocks add to the
+    fields of the enclosing one.
+
+    Example:
+        with bind_log_context(guild_id=message.guild.id):
+            logger.info("Handling message")
     """
-    return CustomLogRecord(*args, **kwargs)
+    current = LOG_CONTEXT.get()
+    if current is not None:
+        fields = {**current.fields, **fields}
+    token = LOG_CONTEXT.set(LogContext(fields))
+    try:
+        yield
+    finally:
+        LOG_CONTEXT.reset(token)
+
+
+# str.format's conversions (`{field!r}`)
+CONVERSIONS: dict[str, Callable[[object], str]] = {"r": repr, "s": str, "a": ascii}
+
+
+class CompiledTemplate:
+    """
+    A `{`-style template parsed once into literal text and field lookups.
+
+    Fields named in `escapes` are read from the escapes mapping passed to
+    `render`, the rest from the values (then the defaults), so the escape codes
+    never have to be added to the record itself.
+    """
+
+    __slots__ = ("fields", "pieces")
+
+    def __init__(self, fmt: str, escapes: set[str]) -> None:
+        parsed = list(string.Formatter().parse(fmt))
+        self.fields: set[str] = {field for _, field, _, _ in parsed if field}
+        # (literal text, field or None, format spec, conversion, is an escape)
+        self.pieces: list[tuple[str, str | None, str, str | None, bool]] = [
+            (literal, field or None, spec or "", conversion, field in escapes)
+            for literal, field, spec, conversion in parsed
+        ]
+
+    @classmethod
+    def compile(cls, fmt: str, escapes: set[str]) -> "CompiledTemplate | None":
+        """
+        The compiled template, or None if it uses what `render` doesn't
+        support: attribute or index lookups, or nested fields in a spec.
+        """
+        for _, field, spec, _ in string.Formatter().parse(fmt):
+            if field is not None and not field.isidentifier():
+                return None
+            if spec and "{" in spec:
+                return None
+        return cls(fmt, escapes)
+
+    def render(
+        self,
+        values: Mapping[str, object],
+        escapes: Mapping[str, str],
+        defaults: Mapping[str, object],
+    ) -> str:
+        out: list[str] = []
+        for literal, field, spec, conversion, is_escape in self.pieces:
+            out.append(literal)
+            if field is None:
+                continue
+            if is_escape:
+                out.append(escapes[field])
+                continue
+            value = values[field] if field in values else defaults[field]
+            if conversion:
+                value = CONVERSIONS[conversion](value)
+            out.append(
+                value if not spec and type(value) is str else format(value, spec)
+            )
+        return "".join(out)
 
 
 class AccessLogFormatter(AccessFormatter):
@@ -136,13 +263,14 @@ class AccessLogFormatter(AccessFormatter):
         "5xx": "bold_red",
     }
 
-    def __init__(
+    def __init__(  # noqa: PLR0913
         self,
         fmt: str | None = None,
         datefmt: str | None = None,
         style: Literal["%", "{", "$"] = "{",
         log_colors: dict[str, str] | None = None,
         reset: bool = True,  # noqa: FBT001, FBT002
+        defaults: dict[str, object] | None = None,
     ) -> None:
         # Initialize AccessFormatter
         fmt_clean = fmt.rstrip() if fmt else None
@@ -150,105 +278,1370 @@ class AccessLogFormatter(AccessFormatter):
         # Initialize colorlog.ColoredFormatter
         self.log_colors: dict[str, str] = log_colors or {}
         self.reset: bool = reset
+        # Values for template fields a record may not have (e.g. log_context)
+        self.defaults: dict[str, object] = defaults or {}
         self.colored_formatter: colorlog.ColoredFormatter = colorlog.ColoredFormatter(
             fmt=fmt_clean,
             datefmt=datefmt,
             style=style,
             log_colors=log_colors,
             reset=reset,
+            defaults=defaults,
+        )
+        # Precomputed lookups for the formatMessage fast path
+        self._status_color_table: tuple[str, ...] = self._build_status_color_table()
+        self._escape_fields: set[str] = set()
+        self._template: CompiledTemplate | None = self._compile_template(
+            fmt_clean, style
         )
+        self._level_escapes: dict[str, dict[str, str]] = {}
 
     def formatMessage(self, record: logging.LogRecord) -> str:  # noqa: N802
-        # Cast `record` to `CustomLogRecord` if required
-        if isinstance(record, CustomLogRecord):
-            if record.args is None and isinstance(record.msg, str):
-                match = self.LOG_PATTERN.match(record.msg)
-                if match:
-                    record.client_addr = match.group("client_addr")
-                    record.method = match.group("method")
-                    record.path = match.group("path")
-                    record.http_version = match.group("http_version")
-                    record.status_code = int(match.group("status_code"))
-                else:
-                    # Fallback defaults if the regex fails
-                    record.client_addr = "unknown"
-                    record.method = "unknown"
-                    record.path = "unknown"
-                    record.http_version = "1.1"
-                    record.status_code = 0
-
-            # Only assign additional attrs if we have a status_code
-            if isinstance(record.status_code, int):
-                # Get the reason phrase for the status code (e.g., "OK" for 200)
-                record.reason_phrase = http.HTTPStatus(record.status_code).phrase
-            if isinstance(record.status_code, int):
-                # Assign the correct color for the status code
-                record.status_color = self.get_status_color(record.status_code)
-
-        return self.colored_formatter.format(record)
+        status_code = getattr(record, "status_code", None)
+        if status_code is None:
+            # Not extracted at enqueue time by `AccessLogFieldsFilter`
+            set_access_fields(record, self.LOG_PATTERN)
+            status_code = getattr(record, "status_code", None)
+
+        # Only assign additional attrs if we have a status_code
+        if isinstance(status_code, int):
+            # Get the reason phrase for the status code (e.g., "OK" for 200)
+            record.reason_phrase = HTTP_STATUS_PHRASES.get(status_code, "")
+            # Assign the correct color for the status code
+            record.status_color = self.get_status_color(status_code)
+
+        if self._template is None:
+            return self.colored_formatter.formatMessage(record)
+
+        # Fast path: render the compiled template straight from the record's
+        # attributes, with the (precomputed) escape codes it uses.  Neither are
+        # set on the record, which other handlers format too.
+        levelname = record.levelname
+        escapes = self._level_escapes.get(levelname)
+        if escapes is None:
+            escapes = self._level_escapes[levelname] = self._build_escapes(levelname)
+        message = self._template.render(record.__dict__, escapes, self.defaults)
+        if self.reset and not message.endswith(escapes["reset"]):
+            message += escapes["reset"]
+        return message
 
     def get_status_color(self, status_code: int) -> str:
         """Determine the color for the status code."""
-        if self.HTTP_STATUS_OK_MIN <= status_code <= self.HTTP_STATUS_OK_MAX:
-            return self.ANSI_COLOR_CODES.get(self.STATUS_COLORS["2xx"], "")
-        if (
-            self.HTTP_STATUS_REDIRECT_MIN
-            <= status_code
-            <= self.HTTP_STATUS_REDIRECT_MAX
-        ):
-            return self.ANSI_COLOR_CODES.get(self.STATUS_COLORS["3xx"], "")
-        if (
-            self.HTTP_STATUS_CLIENT_ERROR_MIN
-            <= status_code
-            <= self.HTTP_STATUS_CLIENT_ERROR_MAX
-        ):
-            return self.ANSI_COLOR_CODES.get(self.STATUS_COLORS["4xx"], "")
-        if status_code >= self.HTTP_STATUS_SERVER_ERROR_MIN:
-            return self.ANSI_COLOR_CODES.get(self.STATUS_COLORS["5xx"], "")
-        return ""  # No color applied for unexpected codes
+        status_class = status_code // 100
+        if status_class < self.HTTP_STATUS_OK_MIN // 100:
+            return ""  # No color applied for unexpected codes
+        return self._status_color_table[
+            min(status_class, self.HTTP_STATUS_SERVER_ERROR_MIN // 100)
+        ]
+
+    def _build_status_color_table(self) -> tuple[str, ...]:
+        """Escape codes indexed by the status class (status_code // 100)."""
+        return (
+            "",
+            "",
+            self.ANSI_COLOR_CODES.get(self.STATUS_COLORS["2xx"], ""),
+            self.ANSI_COLOR_CODES.get(self.STATUS_COLORS["3xx"], ""),
+            self.ANSI_COLOR_CODES.get(self.STATUS_COLORS["4xx"], ""),
+            self.ANSI_COLOR_CODES.get(self.STATUS_COLORS["5xx"], ""),
+        )
+
+    def _compile_template(
+        self, fmt: str | None, style: Literal["%", "{", "$"]
+    ) -> CompiledTemplate | None:
+        """
+        Parse a `{`-style template once, recording which colorlog escape codes
+        it references.  Other styles fall back to `colorlog.ColoredFormatter`.
+        """
+        if fmt is None or style != "{":
+            return None
+        fields = {
+            field_name
+            for _, field_name, _, _ in string.Formatter().parse(fmt)
+            if field_name
+        }
+        self._escape_fields = (fields & escape_codes.keys()) | {"log_color"}
+        return CompiledTemplate.compile(fmt, self._escape_fields)
+
+    def _build_escapes(self, levelname: str) -> dict[str, str]:
+        """Escape codes the compiled template (and the reset) needs for one level."""
+        escapes = {
+            name: escape_codes[name]
+            for name in (self._escape_fields | {"reset"}) - {"log_color"}
+        }
+        escapes["log_color"] = parse_colors(self.log_colors.get(levelname, ""))
+        if "FORCE_COLOR" not in os.environ and "NO_COLOR" in os.environ:
+            escapes = dict.fromkeys(escapes, "")
+        return escapes
+
+
+def set_access_fields(
+    record: logging.LogRecord,
+    pattern: re.Pattern[str] = AccessLogFormatter.LOG_PATTERN,
+) -> None:
+    """
+    Populate the access-log attributes of a record.
+
+    Uvicorn logs `(client_addr, method, full_path, http_version, status_code)`
+    as positional args, which are read directly.  Records that lost their args
+    (e.g. after `QueueHandler.prepare`) fall back to parsing the message, and
+    anything else gets placeholder values, so every access field is set.
+    """
+    args = record.args
+    if isinstance(args, tuple) and len(args) == UVICORN_ACCESS_ARGS_LEN:
+        client_addr, method, path, http_version, status_code = args
+        record.client_addr = client_addr
+        record.method = method
+        record.path = path
+        record.http_version = http_version
+        record.status_code = int(status_code)
+        return
+    match = None
+    if args is None and isinstance(record.msg, str):
+        match = pattern.match(record.msg)
+    if match:
+        record.client_addr = match.group("client_addr")
+        record.method = match.group("method")
+        record.path = match.group("path")
+        record.http_version = match.group("http_version")
+        record.status_code = int(match.group("status_code"))
+    else:
+        # Fallback defaults if the regex fails
+        record.client_addr = "unknown"
+        record.method = "unknown"
+        record.path = "unknown"
+        record.http_version = "1.1"
+        record.status_code = 0
+
+
+class AccessLogFieldsFilter(logging.Filter):
+    """
+    Copy uvicorn's structured access-log args onto the record before it is
+    enqueued.  `QueueHandler.prepare` discards `record.args`, so attaching this
+    filter to the queue handler lets `AccessLogFormatter` skip regex parsing.
+    """
+
+    @override
+    def filter(self, record: logging.LogRecord) -> bool:
+        set_access_fields(record)
+        return True
+
+
+class LogContextFilter(logging.Filter):
+    """
+    Copy the fields bound with `bind_log_context` onto the record, and their
+    rendering onto `record.log_context` for text formatters.  Records logged
+    outside a context are left untouched.
+
+    Attach it to the queue handlers: handler filters run on the thread (and in
+    the task) that logged the record, before it is enqueued.
+    """
+
+    @override
+    def filter(self, record: logging.LogRecord) -> bool:
+        context = LOG_CONTEXT.get()
+        if context is not None:
+            record.__dict__.update(context.fields)
+            record.log_context = context.rendered
+        return True
+
+
+def level_number(level: str | int) -> int:
+    """A level given by name ("WARNING") or number (30) as a number."""
+    if isinstance(level, int):
+        return level
+    return logging.getLevelNamesMapping()[level.upper()]
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Let through at most `rate` records every `per` seconds for each key, in
+    bursts of up to `burst` records (a token bucket).  Records at or above
+    `keep_level` always pass.
+
+    Keys:
+        - logger:   the logger's name
+        - template: the logger's name and the unformatted message, so e.g. each
+                    "Shard ID %s ..." line of discord.gateway is limited separately
+        - message:  the logger's name and the formatted message, to collapse
+                    repeats of the same line (e.g. heartbeat messages)
+
+    The next record let through for a key carries how many were dropped since
+    the previous one as `record.suppressed`, and with `summary` it also reports
+    them in its message ("... [suppressed 41 similar records]").  When chaining
+    filters on a logger, turn `summary` off on all but the last: it then
+    reports the records every filter dropped, including the counts carried by
+    records it drops itself.
+
+    Attach it to a logger rather than a handler: logger filters run before the
+    record is handed to the (queue) handlers, so dropped records are never
+    enqueued.
+
+    Example config (YAML):
+        filters:
+          gateway_rate_limit:
+            (): lib.logger_extras.RateLimitFilter
+            rate: 10
+            per: 1.0
+            key: template
+        loggers:
+          discord.gateway:
+            filters:
+              - gateway_rate_limit
+    """
+
+    def __init__(  # noqa: PLR0913
+        self,
+        rate: float = 10.0,
+        per: float = 1.0,
+        burst: int | None = None,
+        key: str = "template",
+        keep_level: str | int = logging.WARNING,
+        summary: bool = True,  # noqa: FBT001, FBT002
+        max_keys: int = 1024,
+    ) -> None:
+        if key not in RATE_LIMIT_KEYS:
+            msg = f"Unsupported rate limit key: {key}"
+            raise ValueError(msg)
+        super().__init__()
+        self.rate: float = rate
+        self.per: float = per
+        self.burst: float = float(burst if burst is not None else max(1, int(rate)))
+        self.key: str = key
+        self.keep_level: int = level_number(keep_level)
+        self.summary: bool = summary
+        self.max_keys: int = max_keys
+        self._refill: float = rate / per  # tokens per second
+        # key -> [tokens, last refill time, records dropped since the last pass]
+        self._buckets: dict[object, list[float]] = {}
+        self._lock: threading.Lock = threading.Lock()
+
+    def record_key(self, record: logging.LogRecord) -> object:
+        if self.key == "logger":
+            return record.name
+        if self.key == "template":
+            return (record.name, record.msg)
+        return (record.name, record.getMessage())
+
+    @override
+    def filter(self, record: logging.LogRecord) -> bool:
+        # Dropped by the filters before this one, reported by this record
+        earlier = getattr(record, "suppressed", 0)
+        if record.levelno >= self.keep_level:
+            self.report_suppressed(record, earlier)
+            return True
+        key = self.record_key(record)
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                if len(self._buckets) >= self.max_keys:
+                    self._buckets.clear()  # Bound the keys (e.g. "message")
+                bucket = self._buckets[key] = [self.burst, now, 0]
+            else:
+                tokens = bucket[0] + (now - bucket[1]) * self._refill
+                bucket[0] = min(self.burst, tokens)
+                bucket[1] = now
+            allowed = bucket[0] >= 1
+            if allowed:
+                bucket[0] -= 1
+                suppressed, bucket[2] = int(bucket[2]), 0
+            else:
+                bucket[2] += 1 + earlier
+                suppressed = 0
+        if not allowed:
+            metrics.LOG_RECORDS_SUPPRESSED.inc(labels=(record.name,))
+            return False
+        self.report_suppressed(record, earlier + suppressed)
+        return True
+
+    def report_suppressed(self, record: logging.LogRecord, suppressed: int) -> None:
+        if not suppressed:
+            return
+        record.suppressed = suppressed
+        if self.summary:
+            record.msg = f"{record.msg} [suppressed {suppressed} similar records]"
+
+
+class LevelSampleFilter(logging.Filter):
+    """
+    Let through one in every `every[level]` records of the listed levels;
+    records of other levels always pass.  Like `RateLimitFilter`, attach it to
+    a logger so the dropped records are never enqueued.
+
+    Example config (YAML):
+        filters:
+          http_sample:
+            (): lib.logger_extras.LevelSampleFilter
+            every:
+              DEBUG: 100
+              INFO: 10
+    """
+
+    def __init__(self, every: Mapping[str | int, int] | None = None) -> None:
+        super().__init__()
+        self.every: dict[int, int] = {
+            level_number(level): count
+            for level, count in (every or {}).items()
+            if count > 1
+        }
+        # next() on an itertools.count is atomic, so no lock is needed
+        self._counters: dict[int, itertools.count[int]] = {
+            level: itertools.count() for level in self.every
+        }
+
+    @override
+    def filter(self, record: logging.LogRecord) -> bool:
+        counter = self._counters.get(record.levelno)
+        if counter is None or not next(counter) % self.every[record.levelno]:
+            return True
+        metrics.LOG_RECORDS_SUPPRESSED.inc(labels=(record.name,))
+        return False
+
+
+def json_line_encoder(serializer: str = "auto") -> Callable[[object], bytes]:
+    """
+    Return a function that encodes an object as a newline-terminated JSON line.
+    Values the serializer doesn't support are converted with `str`.
+
+    :param serializer: "orjson", "msgspec", "json", or "auto" to use the fastest
+                       one that is installed.
+    """
+    candidates = JSON_SERIALIZERS if serializer == "auto" else (serializer,)
+    for name in candidates:
+        if name == "json":
+            return lambda obj: (json.dumps(obj, default=str) + "\n").encode()
+        try:
+            module = importlib.import_module(name)
+        except ImportError:
+            if serializer != "auto":
+                raise
+            continue
+        if name == "orjson":
+            option = module.OPT_APPEND_NEWLINE
+            return lambda obj: module.dumps(obj, default=str, option=option)
+        if name == "msgspec":
+            encoder = module.json.Encoder(enc_hook=str)
+            return lambda obj: encoder.encode(obj) + b"\n"
+    msg = f"Unsupported JSON serializer: {serializer}"
+    raise ValueError(msg)
 
 
 class JSONFormatter(logging.Formatter):
-    def __init__(self, *, fmt_keys: dict[str, str] | None = None) -> None:
+    """
+    Format records as JSON objects.
+
+    `fmt_keys` maps output keys to record attributes, and is split once at
+    construction into computed fields (message, timestamp, ...) and plain
+    attribute lookups.  Timestamps are cached per second, and `serializer`
+    selects an optional faster JSON backend (see `json_line_encoder`).
+    """
+
+    def __init__(
+        self,
+        *,
+        fmt_keys: dict[str, str] | None = None,
+        serializer: str = "json",
+    ) -> None:
         super().__init__()
         self.fmt_keys: dict[str, str] = fmt_keys if fmt_keys is not None else {}
+        self.serializer: str = serializer
+        self._encode_line: Callable[[object], bytes] = json_line_encoder(serializer)
+        # (output key, record attribute, is a computed field) in output order
+        self._key_plan: tuple[tuple[str, str, bool], ...] = tuple(
+            (key, val, val in JSON_ALWAYS_FIELDS) for key, val in self.fmt_keys.items()
+        )
+        self._mapped_fields: frozenset[str] = frozenset(self.fmt_keys.values())
+        # (epoch second, ISO-8601 prefix for that second) - a single tuple so
+        # updates are atomic when the formatter is shared between threads
+        self._timestamp_cache: tuple[int, str] = (-1, "")
 
     @override
     def format(self, record: logging.LogRecord) -> str:
-        message = self._prepare_log_dict(record)
-        return json.dumps(message, default=str)
-
-    def _prepare_log_dict(
-        self, record: logging.LogRecord
-    ) -> dict[str, str | int | float]:
-        always_fields = {
-            "message": record.getMessage(),
-            "timestamp": dt.datetime.fromtimestamp(
-                record.created, tz=dt.UTC
-            ).isoformat(),
-        }
-        if record.exc_info is not None:
-            always_fields["exc_info"] = self.formatException(record.exc_info)
+        return self.format_bytes(record)[:-1].decode()
+
+    def format_bytes(self, record: logging.LogRecord) -> bytes:
+        """Format a record as a newline-terminated, UTF-8 encoded JSON line."""
+        return self._encode_line(self._prepare_log_dict(record))
+
+    def format_timestamp(self, created: float) -> str:
+        """
+        Equivalent to `datetime.fromtimestamp(created, tz=UTC).isoformat()`,
+        but only builds a datetime once per second.
+        """
+        second = int(created)
+        microsecond = round((created - second) * 1_000_000)
+        if microsecond >= 1_000_000:  # noqa: PLR2004
+            second += 1
+            microsecond -= 1_000_000
+        cached_second, prefix = self._timestamp_cache
+        if cached_second != second:
+            prefix = dt.datetime.fromtimestamp(second, tz=dt.UTC).strftime(
+                "%Y-%m-%dT%H:%M:%S"
+            )
+            self._timestamp_cache = (second, prefix)
+        if microsecond:
+            return f"{prefix}.{microsecond:06d}+00:00"
+        return f"{prefix}+00:00"
 
-        if record.stack_info is not None:
-            always_fields["stack_info"] = self.formatStack(record.stack_info)
+    def _always_field(self, record: logging.LogRecord, field: str) -> object:
+        if field == "message":
+            return record.getMessage()
+        if field == "timestamp":
+            return self.format_timestamp(record.created)
+        if field == "exc_info" and record.exc_info is not None:
+            return self.formatException(record.exc_info)
+        if field == "stack_info" and record.stack_info is not None:
+            return self.formatStack(record.stack_info)
+        return getattr(record, field)
 
-        message = {
-            key: msg_val
-            if (msg_val := always_fields.pop(val, None)) is not None
-            else getattr(record, val)
-            for key, val in self.fmt_keys.items()
+    def _prepare_log_dict(self, record: logging.LogRecord) -> dict[str, object]:
+        message: dict[str, object] = {
+            key: self._always_field(record, val) if computed else getattr(record, val)
+            for key, val, computed in self._key_plan
         }
-        message.update(always_fields)
+
+        # Computed fields that weren't mapped to a key in fmt_keys
+        mapped = self._mapped_fields
+        if "message" not in mapped:
+            message["message"] = record.getMessage()
+        if "timestamp" not in mapped:
+            message["timestamp"] = self.format_timestamp(record.created)
+        if record.exc_info is not None and "exc_info" not in mapped:
+            message["exc_info"] = self.formatException(record.exc_info)
+        if record.stack_info is not None and "stack_info" not in mapped:
+            message["stack_info"] = self.formatStack(record.stack_info)
 
         # Allow for extra keys to be passed to logging commands
         # Example usage: logger.info("log message", extra={"x": "hello"})
-        message.update(
-            {
-                k: v
-                for k, v in record.__dict__.items()
-                if k not in LOG_RECORD_BUILTIN_ATTRS
+        record_dict = record.__dict__
+        if extra_keys := record_dict.keys() - JSON_EXCLUDED_ATTRS:
+            message.update({k: v for k, v in record_dict.items() if k in extra_keys})
+
+        return message
+
+
+class HandlerMetricsFilter(logging.Filter):
+    """Count the records that reach a handler (see `lib.metrics.LOG_RECORDS`)."""
+
+    def __init__(self, handler_name: str) -> None:
+        super().__init__()
+        self.labels: tuple[str] = (handler_name,)
+
+    @override
+    def filter(self, record: logging.LogRecord) -> bool:
+        metrics.LOG_RECORDS.inc(labels=self.labels)
+        return True
+
+
+class BatchingFileHandler(logging.Handler):
+    """
+    A size-rotating file handler that buffers encoded records and writes them
+    in batches from a background thread.
+
+    `emit` only formats and appends to an in-memory buffer, so the thread that
+    logs (typically a `QueueListener`) never blocks on disk I/O or rotation.
+    The writer thread wakes up every `flush_interval` seconds, or as soon as
+    `max_batch_size` records are buffered, and writes the whole batch with a
+    single `os.writev` call.  Rotation (same naming as `RotatingFileHandler`)
+    also happens on the writer thread.  If the writer falls behind by
+    `max_buffered` records, new records are dropped (and counted in `dropped`).
+
+    Example config (YAML):
+        file:
+          (): lib.logger_extras.BatchingFileHandler
+          filename: log/app.log
+          maxBytes: 10485760
+          backupCount: 5
+          flush_interval: 1.0
+          max_batch_size: 512
+    """
+
+    def __init__(  # noqa: PLR0913
+        self,
+        filename: str,
+        mode: str = "a",
+        maxBytes: int = 0,  # noqa: N803
+        backupCount: int = 0,  # noqa: N803
+        encoding: str = "utf-8",
+        flush_interval: float = 1.0,
+        max_batch_size: int = 512,
+        max_buffered: int = DEFAULT_MAX_BUFFERED,
+    ) -> None:
+        self.baseFilename: str = str(Path(filename).absolute())
+        self.mode: str = mode
+        self.maxBytes: int = maxBytes
+        self.backupCount: int = backupCount
+        self.encoding: str = encoding
+        self.flush_interval: float = flush_interval
+        self.max_batch_size: int = max_batch_size
+        self.max_buffered: int = max_buffered
+        self.dropped: int = 0
+
+        self._buffer: list[bytes] = []
+        self._enqueued: int = 0
+        self._written: int = 0
+        self._closing: bool = False
+        self._flush_requested: bool = False
+        self._cond: threading.Condition = threading.Condition()
+        self._fd: int = self._open()
+        self._size: int = os.fstat(self._fd).st_size
+        # Only now, as this registers the handler for logging.shutdown() to close
+        super().__init__()
+        self._writer: threading.Thread = threading.Thread(
+            target=self._run, name=f"BatchingFileHandler({filename})", daemon=True
+        )
+        self._writer.start()
+
+    def _open(self) -> int:
+        flags = os.O_WRONLY | os.O_CREAT | getattr(os, "O_BINARY", 0)
+        flags |= os.O_TRUNC if self.mode.startswith("w") else os.O_APPEND
+        return os.open(self.baseFilename, flags, 0o644)
+
+    def encode_record(self, record: logging.LogRecord) -> bytes:
+        """Return the newline-terminated bytes to write for a record."""
+        formatter = self.formatter
+        if isinstance(formatter, JSONFormatter):
+            return formatter.format_bytes(record)
+        return (self.format(record) + "\n").encode(self.encoding)
+
+    @override
+    def emit(self, record: logging.LogRecord) -> None:
+        try:
+            if self._closing or not self._writer.is_alive():
+                # Nothing would ever write the record
+                msg = f"{self!r} is closed"
+                raise ValueError(msg)  # noqa: TRY301
+            line = self.encode_record(record)
+        except RecursionError:
+            raise
+        except Exception:  # noqa: BLE001
+            self.handleError(record)
+            return
+        with self._cond:
+            if len(self._buffer) >= self.max_buffered:
+                self.dropped += 1
+                return
+            self._buffer.append(line)
+            self._enqueued += 1
+            if len(self._buffer) >= self.max_batch_size:
+                self._cond.notify_all()
+
+    @override
+    def flush(self) -> None:
+        """Block until every record emitted so far has been written."""
+        with self._cond:
+            target = self._enqueued
+            self._flush_requested = True
+            self._cond.notify_all()
+            while self._written < target and self._writer.is_alive():
+                self._cond.wait(self.flush_interval)
+
+    @override
+    def close(self) -> None:
+        with self._cond:
+            self._closing = True
+            self._cond.notify_all()
+        if self._writer.is_alive() and self._writer is not threading.current_thread():
+            self._writer.join()
+        super().close()
+
+    def _run(self) -> None:
+        """Writer thread: swap out the buffer and write it as one batch."""
+        while True:
+            with self._cond:
+                if len(self._buffer) < self.max_batch_size and not (
+                    self._closing or self._flush_requested
+                ):
+                    self._cond.wait(self.flush_interval)
+                batch, self._buffer = self._buffer, []
+                self._flush_requested = False
+                closing = self._closing
+            if batch:
+                self._write_batch(batch)
+            with self._cond:
+                self._written += len(batch)
+                self._cond.notify_all()
+            if closing and not batch:
+                os.close(self._fd)
+                return
+
+    def _write_batch(self, batch: list[bytes]) -> None:
+        size = sum(map(len, batch))
+        try:
+            if self.should_rollover(size):
+                self.do_rollover()
+            for start in range(0, len(batch), WRITEV_MAX_BUFFERS):
+                self._write_all(batch[start : start + WRITEV_MAX_BUFFERS])
+            self._size += size
+        # Not just OSError: the writer thread must outlive any failed batch
+        except Exception:  # noqa: BLE001
+            if logging.raiseExceptions:
+                traceback.print_exc(file=sys.stderr)
+
+    def _write_all(self, buffers: list[bytes]) -> None:
+        """Write the buffers, retrying partial writes."""
+        if hasattr(os, "writev"):
+            written = os.writev(self._fd, buffers)
+            if written == sum(map(len, buffers)):
+                return
+            remaining = memoryview(b"".join(buffers))[written:]
+        else:
+            remaining = memoryview(b"".join(buffers))
+        while remaining:
+            remaining = remaining[os.write(self._fd, remaining) :]
+
+    def should_rollover(self, size: int) -> bool:
+        """True if writing `size` more bytes would exceed `maxBytes`."""
+        return (
+            self.maxBytes > 0
+            and self.backupCount > 0
+            and self._size > 0
+            and self._size + size > self.maxBytes
+        )
+
+    def do_rollover(self) -> None:
+        """Rotate the files (app.log -> app.log.1 -> ...) and reopen."""
+        os.close(self._fd)
+        for i in range(self.backupCount - 1, 0, -1):
+            source = Path(f"{self.baseFilename}.{i}")
+            if source.exists():
+                source.replace(f"{self.baseFilename}.{i + 1}")
+        base = Path(self.baseFilename)
+        if base.exists():
+            base.replace(f"{self.baseFilename}.1")
+        self._fd = self._open()
+        self._size = 0
+
+
+class CompressingFileHandler(BatchingFileHandler):
+    """
+    A `BatchingFileHandler` that rotates by size and/or time, compresses the
+    rotated segments in the background, and keeps them within a disk budget.
+
+    The log file is rotated when a batch would grow it past `maxBytes`, or once
+    `rotate_interval` seconds (aligned to UTC, e.g. 86400 rotates at midnight)
+    have passed.  Rotation only renames the file to a timestamped segment
+    (app.log -> app.log.20250305-043938-123456), so the writer thread never
+    waits on compression: a compressor thread then compresses the segment
+    (app.log.20250305-043938-123456.gz) and deletes the oldest segments until
+    there are at most `backupCount` (0 for no limit), and the log file and its
+    segments take at most `max_total_bytes` (0 for no limit).
+
+    The first handler on a log file also finishes what a previous run left
+    (deletes partial output and compresses raw segments).  Later handlers on
+    the same file, such as the replacement built by a hot reload while the old
+    handler still runs, leave that to it.  The check is per process: don't
+    point handlers in several processes at the same file.
+
+    :param compress: "gzip", "zstd" (needs the `zstandard` package), "auto" for
+                     zstd when it is installed and gzip otherwise, or None to
+                     keep the segments uncompressed.
+
+    Example config (YAML):
+        file:
+          (): lib.logger_extras.CompressingFileHandler
+          filename: log/app.log
+          maxBytes: 10485760
+          backupCount: 20
+          rotate_interval: 86400
+          compress: auto
+          max_total_bytes: 104857600
+    """
+
+    # Open handlers per log file path, and the lock guarding the counts
+    _open_paths: ClassVar[dict[str, int]] = {}
+    _open_paths_lock: ClassVar[threading.Lock] = threading.Lock()
+
+    def __init__(  # noqa: PLR0913
+        self,
+        filename: str,
+        mode: str = "a",
+        maxBytes: int = 0,  # noqa: N803
+        backupCount: int = 0,  # noqa: N803
+        encoding: str = "utf-8",
+        flush_interval: float = 1.0,
+        max_batch_size: int = 512,
+        max_buffered: int = DEFAULT_MAX_BUFFERED,
+        rotate_interval: float = 0,
+        compress: str | None = "auto",
+        compress_level: int | None = None,
+        max_total_bytes: int = 0,
+    ) -> None:
+        self.rotate_interval: float = rotate_interval
+        self.max_total_bytes: int = max_total_bytes
+        self.compress_level: int | None = compress_level
+        self.compressor: str | None = self._resolve_compressor(compress)
+        self._zstandard: Any = (
+            importlib.import_module("zstandard") if self.compressor == "zstd" else None
+        )
+        self._rollover_at: float = float("inf")
+        # Segments waiting to be compressed; None only applies the retention
+        self._jobs: queue.SimpleQueue[object] = queue.SimpleQueue()
+        self._stop_job: object = object()
+        super().__init__(
+            filename,
+            mode=mode,
+            maxBytes=maxBytes,
+            backupCount=backupCount,
+            encoding=encoding,
+            flush_interval=flush_interval,
+            max_batch_size=max_batch_size,
+            max_buffered=max_buffered,
+        )
+        base = Path(self.baseFilename)
+        self._segment_pattern: re.Pattern[str] = re.compile(
+            rf"{re.escape(base.name)}\.\d{{8}}-\d{{6}}-\d{{6}}"
+            rf"(?:{'|'.join(map(re.escape, SEGMENT_COMPRESSORS.values()))})?"
+        )
+        started = os.fstat(self._fd).st_mtime if self._size else time.time()
+        self._rollover_at = self.next_rollover(started)
+        self._compressor_thread: threading.Thread = threading.Thread(
+            target=self._run_compressor,
+            name=f"CompressingFileHandler({filename})",
+            daemon=True,
+        )
+        self._compressor_thread.start()
+        with self._open_paths_lock:
+            first = not self._open_paths.get(self.baseFilename)
+            self._open_paths[self.baseFilename] = (
+                self._open_paths.get(self.baseFilename, 0) + 1
+            )
+        self._registered: bool = True
+        if first:
+            # Finish what a previous run left: partial output and raw segments
+            for partial in base.parent.glob(f"{glob.escape(base.name)}.*.tmp"):
+                if self._segment_pattern.fullmatch(partial.name.removesuffix(".tmp")):
+                    partial.unlink(missing_ok=True)
+            for segment in self.segments():
+                if segment.suffix not in SEGMENT_COMPRESSORS.values():
+                    self._jobs.put(segment)
+        self._jobs.put(None)
+
+    @staticmethod
+    def _resolve_compressor(compress: str | None) -> str | None:
+        if compress != "auto":
+            if compress is not None and compress not in SEGMENT_COMPRESSORS:
+                msg = f"Unsupported log compression: {compress}"
+                raise ValueError(msg)
+            return compress
+        try:
+            importlib.import_module("zstandard")
+        except ImportError:
+            return "gzip"
+        return "zstd"
+
+    def next_rollover(self, now: float) -> float:
+        """The next time-based rollover after `now` (inf when disabled)."""
+        if self.rotate_interval <= 0:
+            return float("inf")
+        return (now // self.rotate_interval + 1) * self.rotate_interval
+
+    @override
+    def should_rollover(self, size: int) -> bool:
+        if self._size <= 0:
+            return False
+        if 0 < self.maxBytes < self._size + size:
+            return True
+        return time.time() >= self._rollover_at
+
+    @override
+    def do_rollover(self) -> None:
+        """Rename the log file to a new segment, and queue it for compression."""
+        os.close(self._fd)
+        now = time.time()
+        timestamp = dt.datetime.fromtimestamp(now, tz=dt.UTC)
+        segment = Path(f"{self.baseFilename}.{timestamp:{SEGMENT_TIMESTAMP_FORMAT}}")
+        base = Path(self.baseFilename)
+        if base.exists():
+            base.replace(segment)
+            self._jobs.put(segment)
+        self._fd = self._open()
+        self._size = 0
+        self._rollover_at = self.next_rollover(now)
+
+    def segments(self) -> list[Path]:
+        """Rotated segments of the log file, oldest first."""
+        base = Path(self.baseFilename)
+        return sorted(
+            path
+            for path in base.parent.iterdir()
+            if self._segment_pattern.fullmatch(path.name)
+        )
+
+    @override
+    def close(self) -> None:
+        super().close()
+        self._jobs.put(self._stop_job)
+        if self._compressor_thread.is_alive():
+            self._compressor_thread.join()
+        with self._open_paths_lock:
+            if self._registered:
+                self._registered = False
+                self._open_paths[self.baseFilename] -= 1
+                if not self._open_paths[self.baseFilename]:
+                    del self._open_paths[self.baseFilename]
+
+    def _run_compressor(self) -> None:
+        """Compressor thread: compress queued segments, then apply the retention."""
+        while (job := self._jobs.get()) is not self._stop_job:
+            try:
+                if isinstance(job, Path) and self.compressor is not None:
+                    self.compress_segment(job)
+                self.apply_retention()
+            except OSError:
+                if logging.raiseExceptions:
+                    traceback.print_exc(file=sys.stderr)
+
+    def compress_segment(self, segment: Path) -> Path | None:
+        """
+        Compress a segment next to it, then delete the original.  The output is
+        written to a temporary file first, so a partial file is never mistaken
+        for a finished segment.  Returns None if the retention already deleted
+        the segment.
+        """
+        if not segment.exists():
+            return None
+        target = segment.with_name(
+            segment.name + SEGMENT_COMPRESSORS[self.compressor or "gzip"]
+        )
+        partial = target.with_name(target.name + ".tmp")
+        with segment.open("rb") as source, partial.open("wb") as output:
+            if self._zstandard is not None:
+                level = 3 if self.compress_level is None else self.compress_level
+                self._zstandard.ZstdCompressor(level=level).copy_stream(source, output)
+            else:
+                level = 9 if self.compress_level is None else self.compress_level
+                with gzip.GzipFile(
+                    segment.name, mode="wb", compresslevel=level, fileobj=output
+                ) as compressed:
+                    shutil.copyfileobj(source, compressed)
+        partial.replace(target)
+        segment.unlink()
+        return target
+
+    def apply_retention(self) -> None:
+        """Delete the oldest segments beyond `backupCount` or `max_total_bytes`."""
+        segments = self.segments()
+        if self.backupCount > 0:
+            while len(segments) > self.backupCount:
+                segments.pop(0).unlink(missing_ok=True)
+        if self.max_total_bytes <= 0:
+            return
+        sizes = [path.stat().st_size for path in segments]
+        total = self._size + sum(sizes)
+        while segments and total > self.max_total_bytes:
+            total -= sizes.pop(0)
+            segments.pop(0).unlink(missing_ok=True)
+
+
+class BoundedLogQueue(queue.Queue[Any]):
+    """
+    A bounded queue for `QueueHandler`/`QueueListener` with an overflow policy
+    and counters for enqueued/dropped records and the queue's high-water mark.
+
+    Policies (applied when the queue is full):
+        - block:        wait up to `block_timeout` seconds for room, then drop
+                        the new record.  Note this blocks the logging thread.
+        - drop_oldest:  evict the oldest record to make room.
+        - drop_newest:  drop the new record.
+        - sample:       records at or above `keep_level` evict the oldest record;
+                        lower-level records are dropped.  Once the queue is
+                        `sample_watermark` full, only one in `sample_every`
+                        lower-level records is enqueued.
+
+    Non-record items (e.g. the `QueueListener` sentinel) are never dropped.
+
+    Example config (YAML):
+        queue:
+          class: logging.handlers.QueueHandler
+          queue:
+            (): lib.logger_extras.BoundedLogQueue
+            maxsize: 10000
+            policy: drop_oldest
+    """
+
+    def __init__(  # noqa: PLR0913
+        self,
+        maxsize: int = 10000,
+        policy: str = "drop_oldest",
+        block_timeout: float = 0.1,
+        keep_level: str | int = logging.WARNING,
+        sample_every: int = 10,
+        sample_watermark: float = 0.5,
+    ) -> None:
+        if policy not in QUEUE_OVERFLOW_POLICIES:
+            msg = f"Unsupported queue overflow policy: {policy}"
+            raise ValueError(msg)
+        super().__init__(maxsize=maxsize)
+        self.policy: str = policy
+        self.block_timeout: float = block_timeout
+        self.keep_level: int = level_number(keep_level)
+        self.sample_every: int = max(sample_every, 1)
+        self.sample_threshold: int = int(maxsize * sample_watermark)
+        self.enqueued: int = 0
+        self.dropped: int = 0
+        self.dropped_by_level: dict[str, int] = {}
+        self.high_water_mark: int = 0
+        self._sampled: int = 0
+
+    @override
+    def put_nowait(self, item: Any) -> None:
+        """Enqueue an item, applying the overflow policy if the queue is full."""
+        if not isinstance(item, logging.LogRecord):
+            self._force_put(item)
+            return
+        if self.policy == "block":
+            try:
+                self.put(item, timeout=self.block_timeout)
+            except queue.Full:
+                self._count_drop(item)
+            return
+        with self.mutex:
+            if self.policy == "sample" and item.levelno < self.keep_level:
+                self._put_sampled(item)
+            elif not 0 < self.maxsize <= self._qsize():
+                self._put_locked(item)
+            elif self.policy == "drop_newest":
+                self._count_drop(item)
+            elif self._evict_oldest_record():
+                # drop_oldest, or a high-level record under the sample policy
+                self._put_locked(item)
+            else:
+                self._count_drop(item)
+
+    @override
+    def put(
+        self,
+        item: Any,
+        block: bool = True,
+        timeout: float | None = None,
+    ) -> None:
+        super().put(item, block=block, timeout=timeout)
+        with self.mutex:
+            self.enqueued += 1
+            self.high_water_mark = max(self.high_water_mark, self._qsize())
+
+    def _put_sampled(self, item: logging.LogRecord) -> None:
+        """Sample policy for records below `keep_level` (mutex held)."""
+        size = self._qsize()
+        if 0 < self.maxsize <= size:
+            self._count_drop(item)
+            return
+        if size >= self.sample_threshold:
+            self._sampled += 1
+            if self._sampled % self.sample_every:
+                self._count_drop(item)
+                return
+        self._put_locked(item)
+
+    def _put_locked(self, item: Any) -> None:  # noqa: ANN401
+        """Enqueue an item and notify a waiting consumer (mutex held)."""
+        self._put(item)
+        self.unfinished_tasks += 1
+        self.enqueued += 1
+        self.high_water_mark = max(self.high_water_mark, self._qsize())
+        self.not_empty.notify()
+
+    def _force_put(self, item: Any) -> None:  # noqa: ANN401
+        """Enqueue an item even if the queue is full."""
+        with self.mutex:
+            self._put(item)
+            self.unfinished_tasks += 1
+            self.not_empty.notify()
+
+    def _evict_oldest_record(self) -> bool:
+        """
+        Drop the oldest queued record (mutex held), skipping other items such
+        as the `QueueListener` sentinel.  False if there is no record to drop.
+        """
+        for index, queued in enumerate(self.queue):
+            if isinstance(queued, logging.LogRecord):
+                del self.queue[index]
+                self.unfinished_tasks -= 1
+                self._count_drop(queued)
+                return True
+        return False
+
+    def _count_drop(self, item: Any) -> None:  # noqa: ANN401
+        if isinstance(item, logging.LogRecord):
+            self.dropped += 1
+            self.dropped_by_level[item.levelname] = (
+                self.dropped_by_level.get(item.levelname, 0) + 1
+            )
+
+    def stats(self) -> dict[str, Any]:
+        """A snapshot of the queue's counters."""
+        with self.mutex:
+            return {
+                "size": self._qsize(),
+                "maxsize": self.maxsize,
+                "policy": self.policy,
+                "enqueued": self.enqueued,
+                "dropped": self.dropped,
+                "dropped_by_level": dict(self.dropped_by_level),
+                "high_water_mark": self.high_water_mark,
             }
+
+
+class LogSpool:
+    """
+    A bounded FIFO of byte strings in a memory-mapped file, for batches that
+    could not be shipped.  Entries survive a restart when `path` is given; with
+    no path the spool is an anonymous (memory-only) mapping.
+
+    Layout: a header with the head and tail offsets, then length-prefixed
+    entries.  Appending compacts the unread entries to the start of the file
+    when it reaches the end, and drops the oldest entries if they still don't
+    fit (counted in `dropped`).
+    """
+
+    HEADER: ClassVar[struct.Struct] = struct.Struct("<QQ")
+    LENGTH: ClassVar[struct.Struct] = struct.Struct("<I")
+
+    def __init__(self, path: str | None = None, size: int = 64 * 1024 * 1024) -> None:
+        self.path: str | None = path
+        self.size: int = size
+        self.dropped: int = 0
+        self._file: BinaryIO | None = None
+        if path is None:
+            self._map: mmap.mmap = mmap.mmap(-1, size)
+        else:
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+            self._file = Path(path).open("a+b")  # noqa: SIM115
+            if os.fstat(self._file.fileno()).st_size != size:
+                self._file.truncate(size)
+            self._map = mmap.mmap(self._file.fileno(), size)
+        self._head, self._tail = self.HEADER.unpack_from(self._map, 0)
+        if not self.HEADER.size <= self._head <= self._tail <= size:
+            self._head = self._tail = self.HEADER.size  # new or damaged spool
+            self._write_header()
+
+    def __len__(self) -> int:
+        """Bytes of spooled entries (including their length prefixes)."""
+        return self._tail - self._head
+
+    def append(self, data: bytes) -> None:
+        """Add an entry, making room by dropping the oldest entries."""
+        needed = self.LENGTH.size + len(data)
+        if needed > self.size - self.HEADER.size:
+            self.dropped += 1
+            return
+        if self._tail + needed > self.size:
+            self._compact()
+        while self._tail + needed > self.size:
+            self.pop()
+            self.dropped += 1
+            self._compact()
+        self.LENGTH.pack_into(self._map, self._tail, len(data))
+        start = self._tail + self.LENGTH.size
+        self._map[start : start + len(data)] = data
+        self._tail = start + len(data)
+        self._write_header()
+        self._map.flush()
+
+    def peek(self) -> bytes | None:
+        """The oldest entry, or None if the spool is empty."""
+        if self._head == self._tail:
+            return None
+        (length,) = self.LENGTH.unpack_from(self._map, self._head)
+        start = self._head + self.LENGTH.size
+        return self._map[start : start + length]
+
+    def pop(self) -> None:
+        """Remove the oldest entry."""
+        if self._head == self._tail:
+            return
+        (length,) = self.LENGTH.unpack_from(self._map, self._head)
+        self._head += self.LENGTH.size + length
+        if self._head == self._tail:
+            self._head = self._tail = self.HEADER.size
+        self._write_header()
+
+    def close(self) -> None:
+        self._map.flush()
+        self._map.close()
+        if self._file is not None:
+            self._file.close()
+
+    def _compact(self) -> None:
+        """Move the unread entries to the start of the data area."""
+        if self._head == self.HEADER.size:
+            return
+        length = self._tail - self._head
+        self._map.move(self.HEADER.size, self._head, length)
+        self._head, self._tail = self.HEADER.size, self.HEADER.size + length
+        self._write_header()
+
+    def _write_header(self) -> None:
+        self.HEADER.pack_into(self._map, 0, self._head, self._tail)
+
+
+class BatchRejectedError(Exception):
+    """The log collector refused a batch for good (a 4xx response)."""
+
+
+class LogShippingHandler(logging.Handler):
+    """
+    Ship records to a log collector in batches, from a background thread.
+
+    `emit` only encodes the record and appends it to a buffer.  The sender
+    thread wakes up every `flush_interval` seconds, or as soon as
+    `max_batch_size` records are buffered, and ships the batch over one
+    persistent connection:
+        - http(s)://host:port/path: a POST of newline-delimited records (JSON
+          lines with a `JSONFormatter`), gzipped with `compress`
+        - tcp://host:port: RFC 5424 syslog messages with octet-counting framing
+
+    When a batch can't be shipped, it is written to a `LogSpool` (memory-mapped
+    at `spool_path`, so it survives restarts) and retried with exponential
+    backoff, from `retry_initial` up to `retry_max` seconds.  Spooled batches
+    are shipped first, oldest first, once the collector is back.  The spool
+    holds up to `spool_size` bytes; beyond that the oldest batches are dropped.
+    A batch the collector rejects with a 4xx status (other than 408 and 429)
+    would be rejected again, so it is dropped and counted instead.
+
+    Example config (YAML):
+        ship:
+          (): lib.logger_extras.LogShippingHandler
+          url: http://collector:9880/logs
+          formatter: json
+          spool_path: log/ship.spool
+    """
+
+    def __init__(  # noqa: PLR0913
+        self,
+        url: str,
+        flush_interval: float = 1.0,
+        max_batch_size: int = 500,
+        timeout: float = 5.0,
+        compress: bool = True,  # noqa: FBT001, FBT002
+        headers: dict[str, str] | None = None,
+        retry_initial: float = 1.0,
+        retry_max: float = 60.0,
+        spool_path: str | None = None,
+        spool_size: int = 64 * 1024 * 1024,
+        facility: str = "user",
+        app_name: str = "discord-bot",
+    ) -> None:
+        super().__init__()
+        parsed = urllib.parse.urlsplit(url)
+        if parsed.scheme not in SHIPPING_SCHEMES or not parsed.hostname:
+            msg = f"Unsupported log shipping URL: {url}"
+            raise ValueError(msg)
+        self.url: str = url
+        self.scheme: str = parsed.scheme
+        self.host: str = parsed.hostname
+        self.port: int = parsed.port or SHIPPING_SCHEMES[parsed.scheme]
+        self.path: str = parsed.path or "/"
+        if parsed.query:
+            self.path += f"?{parsed.query}"
+        self.flush_interval: float = flush_interval
+        self.max_batch_size: int = max_batch_size
+        self.timeout: float = timeout
+        self.compress: bool = compress
+        self.headers: dict[str, str] = {
+            "Content-Type": "application/x-ndjson",
+            **({"Content-Encoding": "gzip"} if compress else {}),
+            **(headers or {}),
+        }
+        self.retry_initial: float = retry_initial
+        self.retry_max: float = retry_max
+        self.facility: int = logging.handlers.SysLogHandler.facility_names[facility]
+        self.syslog_prefix: str = f"{socket.gethostname()} {app_name}"
+        self.spool: LogSpool = LogSpool(spool_path, spool_size)
+
+        self.shipped: int = 0
+        self.failures: int = 0
+        self.spooled: int = 0
+        self.rejected: int = 0
+        self._retry_delay: float = 0.0
+        self._retry_at: float = 0.0
+        self._connection: http.client.HTTPConnection | socket.socket | None = None
+        self._buffer: list[bytes] = []
+        self._enqueued: int = 0
+        self._written: int = 0
+        self._closing: bool = False
+        self._flush_requested: bool = False
+        self._cond: threading.Condition = threading.Condition()
+        self._sender: threading.Thread = threading.Thread(
+            target=self._run, name=f"LogShippingHandler({url})", daemon=True
         )
+        self._sender.start()
 
-        return message
+    def encode_record(self, record: logging.LogRecord) -> bytes:
+        """Return the bytes to ship for a record (a line, or a syslog frame)."""
+        formatter = self.formatter
+        if isinstance(formatter, JSONFormatter):
+            line = formatter.format_bytes(record)
+        else:
+            line = (self.format(record) + "\n").encode()
+        if self.scheme != "tcp":
+            return line
+        severity = SYSLOG_SEVERITIES.get(record.levelname, SYSLOG_DEBUG)
+        timestamp = dt.datetime.fromtimestamp(record.created, tz=dt.UTC).isoformat()
+        message = (
+            f"<{self.facility * 8 + severity}>1 {timestamp} {self.syslog_prefix} "
+            f"{record.process} {record.name} - "
+        ).encode() + line.rstrip(b"\n")
+        return b"%d %s" % (len(message), message)
+
+    @override
+    def emit(self, record: logging.LogRecord) -> None:
+        try:
+            data = self.encode_record(record)
+        except RecursionError:
+            raise
+        except Exception:  # noqa: BLE001
+            self.handleError(record)
+            return
+        with self._cond:
+            self._buffer.append(data)
+            self._enqueued += 1
+            if len(self._buffer) >= self.max_batch_size:
+                self._cond.notify_all()
+
+    @override
+    def flush(self) -> None:
+        """Block until every record emitted so far has been shipped or spooled."""
+        with self._cond:
+            target = self._enqueued
+            self._flush_requested = True
+            self._cond.notify_all()
+            while self._written < target and self._sender.is_alive():
+                self._cond.wait(self.flush_interval)
+
+    @override
+    def close(self) -> None:
+        with self._cond:
+            self._closing = True
+            self._cond.notify_all()
+        if self._sender.is_alive() and self._sender is not threading.current_thread():
+            self._sender.join()
+        super().close()
+
+    def stats(self) -> dict[str, Any]:
+        """A snapshot of the handler's counters."""
+        return {
+            "url": self.url,
+            "shipped_batches": self.shipped,
+            "failures": self.failures,
+            "spooled_batches": self.spooled,
+            "rejected_batches": self.rejected,
+            "dropped_batches": self.spool.dropped,
+            "spool_bytes": len(self.spool),
+            "retry_delay": self._retry_delay,
+        }
+
+    def _run(self) -> None:
+        """Sender thread: ship the buffered batch, then the spool's backlog."""
+        while True:
+            with self._cond:
+                if len(self._buffer) < self.max_batch_size and not (
+                    self._closing or self._flush_requested
+                ):
+                    self._cond.wait(self.flush_interval)
+                batch, self._buffer = self._buffer, []
+                self._flush_requested = False
+                closing = self._closing
+            try:
+                self._ship_spool()
+                if batch:
+                    payload = b"".join(batch)
+                    # Keep the order: with a backlog, the batch waits behind it
+                    if len(self.spool) or not self._ship(payload):
+                        self.spool.append(payload)
+                        self.spooled += 1
+            except Exception as e:  # noqa: BLE001
+                # A dead sender would leave flush() and close() waiting forever
+                self._report(f"Log shipping to {self.url} failed ({e!r})")
+            with self._cond:
+                self._written += len(batch)
+                self._cond.notify_all()
+            if closing and not batch:
+                self._disconnect()
+                self.spool.close()
+                return
+
+    def _ship_spool(self) -> None:
+        while (payload := self.spool.peek()) is not None and self._ship(payload):
+            self.spool.pop()
+
+    def _ship(self, payload: bytes) -> bool:
+        """
+        Send one batch; False (and back off) if the collector is unavailable,
+        True once it has taken or rejected the batch.
+        """
+        if time.monotonic() < self._retry_at:
+            return False
+        try:
+            if self.scheme == "tcp":
+                self._send_syslog(payload)
+            else:
+                self._send_http(payload)
+        except BatchRejectedError as e:
+            self.rejected += 1
+            metrics.LOG_SHIPPING_REJECTED.inc()
+            self._report(f"Log shipping to {self.url} dropped a batch ({e})")
+            self._retry_delay = 0.0
+            return True
+        except (OSError, http.client.HTTPException) as e:
+            self._disconnect()
+            self.failures += 1
+            metrics.LOG_SHIPPING_FAILURES.inc()
+            self._retry_delay = min(
+                self.retry_max, max(self.retry_initial, self._retry_delay * 2)
+            )
+            self._retry_at = time.monotonic() + self._retry_delay
+            self._report(
+                f"Log shipping to {self.url} failed ({e!r}); "
+                f"retrying in {self._retry_delay:.1f}s"
+            )
+            return False
+        self.shipped += 1
+        self._retry_delay = 0.0
+        return True
+
+    def _report(self, message: str) -> None:
+        # Not logged: the record could come back to this handler
+        if logging.raiseExceptions:
+            print(message, file=sys.stderr)  # noqa: T201
+
+    def _send_http(self, payload: bytes) -> None:
+        connection = self._connection
+        if not isinstance(connection, http.client.HTTPConnection):
+            connection_class = (
+                http.client.HTTPSConnection
+                if self.scheme == "https"
+                else http.client.HTTPConnection
+            )
+            connection = self._connection = connection_class(
+                self.host, self.port, timeout=self.timeout
+            )
+        body = gzip.compress(payload, compresslevel=6) if self.compress else payload
+        connection.request("POST", self.path, body=body, headers=self.headers)
+        response = connection.getresponse()
+        response.read()
+        if response.status < http.HTTPStatus.MULTIPLE_CHOICES:
+            return
+        msg = f"Collector responded {response.status} {response.reason}"
+        if (
+            http.HTTPStatus.BAD_REQUEST
+            <= response.status
+            < http.HTTPStatus.INTERNAL_SERVER_ERROR
+            and response.status not in SHIPPING_RETRY_STATUSES
+        ):
+            raise BatchRejectedError(msg)
+        raise ConnectionError(msg)
+
+    def _send_syslog(self, payload: bytes) -> None:
+        connection = self._connection
+        if not isinstance(connection, socket.socket):
+            connection = self._connection = socket.create_connection(
+                (self.host, self.port), timeout=self.timeout
+            )
+        connection.sendall(payload)
+
+    def _disconnect(self) -> None:
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
@@ -1,49 +1,186 @@
 """Logging library - configure logging from a yaml config file"""
 
+import asyncio
 import atexit
+import copy
+import json
 import logging
 import logging.config
 import logging.handlers
+import os
+import queue
+import stat
+import threading
+import time
 from logging import Logger
 from pathlib import Path
+from typing import Any
 
-import yaml
+from lib import config_parser, metrics
+from lib.logger_extras import BoundedLogQueue, HandlerMetricsFilter
+from lib.utils import lazy_import
 
-from lib import config_parser
-from lib.logger_extras import custom_log_record_factory
+# Only parsed when the config cache misses
+yaml = lazy_import("yaml")
 
-# change this to DEBUG if debugging logger initialization
-logging.basicConfig(level=logging.INFO)
 logger: Logger = logging.getLogger(__name__)
 
+# Bump when the layout of the config cache file changes
+CONFIG_CACHE_VERSION = 1
+
+# Handler settings that can be applied to a running handler without rebuilding it
+IN_PLACE_HANDLER_KEYS = frozenset({"formatter", "level"})
+# Top-level sections that can be reloaded selectively; any other difference
+# triggers a full reconfiguration
+RELOADABLE_SECTIONS = frozenset({"formatters", "handlers", "loggers", "root"})
+ROOT_LOGGER_NAME = "root"
+
+
+class LoggingState:
+    """
+    Book-keeping for the active logging configuration, used for hot reloads.
+    """
+
+    def __init__(self) -> None:
+        self.file_path: str | None = None
+        self.mtime: float | None = None
+        self.compiled: config_parser.CompiledConfig | None = None
+        # Resolved config as it was applied (before dictConfig mutated it)
+        self.applied: dict[str, Any] | None = None
+        # Running queue listeners keyed by handler name
+        self.listeners: dict[str, logging.handlers.QueueListener] = {}
+        self.lock: threading.RLock = threading.RLock()
+        self.atexit_registered: bool = False
+
+
+_state = LoggingState()
+
+
+def read_config_cache(
+    cache_path: str, file_path: str, mtime: float
+) -> dict[str, Any] | None:
+    """
+    Return the resolved config from the cache file, if it was written for this
+    version of the YAML file and every environment variable it references
+    still has the same value.
+
+    The config names callables for dictConfig to call, so the cache is as
+    trusted as the YAML file: it is ignored unless it belongs to this user and
+    no one else can write to it.
+    """
+    try:
+        with Path.open(Path(cache_path), encoding="utf-8") as cache_file:
+            file_stat = os.fstat(cache_file.fileno())
+            if file_stat.st_uid != os.getuid() or file_stat.st_mode & (
+                stat.S_IWGRP | stat.S_IWOTH
+            ):
+                logger.warning(
+                    "Ignoring logging config cache %s: writable by other users",
+                    cache_path,
+                )
+                return None
+            cache = json.load(cache_file)
+    except (OSError, ValueError):
+        return None
+    if not (
+        isinstance(cache, dict)
+        and cache.get("version") == CONFIG_CACHE_VERSION
+        and cache.get("file_path") == str(Path(file_path).resolve())
+        and cache.get("mtime") == mtime
+        and isinstance(env := cache.get("env"), dict)
+        and all(os.environ.get(name) == value for name, value in env.items())
+        and isinstance(config := cache.get("config"), dict)
+    ):
+        return None
+    return config
+
+
+def write_config_cache(
+    cache_path: str,
+    file_path: str,
+    mtime: float,
+    compiled: config_parser.CompiledConfig,
+    config: dict[str, Any],
+) -> None:
+    """Save a resolved config, keyed by the YAML file's mtime and env values."""
+    cache = {
+        "version": CONFIG_CACHE_VERSION,
+        "file_path": str(Path(file_path).resolve()),
+        "mtime": mtime,
+        "env": {name: os.environ.get(name) for name in sorted(compiled.env_vars)},
+        "config": config,
+    }
+    path = Path(cache_path)
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    try:
+        tmp_path.write_text(json.dumps(cache), encoding="utf-8")
+        tmp_path.chmod(0o600)
+        tmp_path.replace(path)
+    except (OSError, TypeError, ValueError) as e:
+        logger.debug("Not caching logging configuration: %s", e)
+
+
+def load_logger_config(file_path: str) -> dict[str, Any]:
+    """
+    Read and resolve a logging YAML file.
+    The compiled config is reused until the file's mtime changes, so repeated
+    loads only re-resolve values whose environment variables changed.
+
+    If LOG_CONFIG_CACHE names a file, the resolved config is saved there, and
+    a later process whose YAML file and environment are unchanged loads it
+    without importing or parsing YAML.
+    """
+    yaml_path = Path(file_path)
+    mtime = yaml_path.stat().st_mtime
+    cache_path = os.getenv("LOG_CONFIG_CACHE")
+    if (
+        _state.compiled is None
+        or _state.file_path != file_path
+        or _state.mtime != mtime
+    ):
+        if (
+            cache_path
+            and _state.compiled is None
+            and (cached := read_config_cache(cache_path, file_path, mtime))
+        ):
+            logger.debug("Loaded logging configuration from %s", cache_path)
+            _state.file_path = file_path
+            _state.mtime = mtime
+            return cached
+        with Path.open(yaml_path, encoding="utf-8") as yaml_file:
+            yaml_config = yaml.safe_load(yaml_file)
+        logger.debug("Read YAML config: %s", yaml_config)
+        _state.compiled = config_parser.compile_config(yaml_config)
+        _state.file_path = file_path
+        _state.mtime = mtime
+    yaml_config_resolved = _state.compiled.resolve()
+    logger.debug("Resolved YAML config: %s", yaml_config_resolved)
+    if cache_path:
+        write_config_cache(
+            cache_path, file_path, mtime, _state.compiled, yaml_config_resolved
+        )
+    return yaml_config_resolved
+
 
 def configure_logger(file_path: str = "conf/logger.yaml") -> None:
     """Set up logging using a YAML file"""
+    # Bootstrap logging for the messages below; dictConfig replaces it.
+    # Change this to DEBUG if debugging logger initialization
+    logging.basicConfig(level=logging.INFO)
     logger.info("Loading logging configuration from YAML file...")
 
-    # Set the global log record factory to use CustomLogRecord
-    logging.setLogRecordFactory(custom_log_record_factory)
-
     success: bool = False
     try:
-        yaml_path = Path(file_path)
-        with Path.open(yaml_path, encoding="utf-8") as yaml_file:
-            try:
-                yaml_config = yaml.safe_load(yaml_file)
-                logger.debug("Read YAML config: %s", yaml_config)
-                yaml_config_resolved = config_parser.resolve_values(yaml_config)
-                logger.debug("Resolved YAML config: %s", yaml_config_resolved)
-                logging.config.dictConfig(yaml_config_resolved)
-                logger.info("Logging configuration loaded from YAML file.")
-                logger.debug("Logging configuration: %s", yaml_config_resolved)
-
-                start_queue_listeners()
-
-                success = True
-            except yaml.YAMLError:
-                logger.exception("Error parsing YAML file.")
-            except (ValueError, TypeError, KeyError, AttributeError):
-                logger.exception("Error in logging configuration.")
+        with _state.lock:
+            yaml_config_resolved = load_logger_config(file_path)
+            apply_full_config(yaml_config_resolved)
+            logger.info("Logging configuration loaded from YAML file.")
+            logger.debug("Logging configuration: %s", yaml_config_resolved)
+        success = True
+    except yaml.YAMLError:
+        logger.exception("Error parsing YAML file.")
+    except (ValueError, TypeError, KeyError, AttributeError):
+        logger.exception("Error in logging configuration.")
     except (FileNotFoundError, PermissionError, IsADirectoryError, OSError):
         logger.exception("Error reading logging configuration file.")
     if not success:
@@ -52,6 +189,34 @@ def configure_logger(file_path: str = "conf/logger.yaml") -> None:
         logger.info("Default logging configuration applied.")
 
 
+def clear_logger_filters(name: str) -> None:
+    """Remove every filter of a logger (by its config name), before re-adding."""
+    target = logging.getLogger(None if name == ROOT_LOGGER_NAME else name)
+    for log_filter in target.filters[:]:
+        target.removeFilter(log_filter)
+
+
+def apply_full_config(config: dict[str, Any]) -> None:
+    """
+    Apply a resolved config with `dictConfig`, replacing every handler.
+    Running queue listeners are drained first so no queued records are lost.
+    """
+    stop_queue_listeners()
+    applied = copy.deepcopy(config)  # dictConfig mutates its input
+    # Loggers configured now or by the previous config; dictConfig would add
+    # the configured filters next to the ones they already have
+    names = {ROOT_LOGGER_NAME, *config.get("loggers", {})}
+    if _state.applied is not None:
+        names.update(_state.applied.get("loggers", {}))
+    for name in names:
+        clear_logger_filters(name)
+    logging.config.dictConfig(config)
+    _state.applied = applied
+    instrument_handlers()
+    set_queue_levels()
+    start_queue_listeners()
+
+
 def get_all_handlers() -> set[logging.Handler]:
     """
     Retrieve all handlers from all loggers, including the root logger.
@@ -108,9 +273,389 @@ def start_queue_listeners() -> None:
             logger.info("Found queue handler: %s", handler.name)
             listener = getattr(handler, "listener", None)
             if listener:
+                if _state.listeners.get(handler.name) is listener:
+                    continue  # Already running
                 logger.info("Starting listener for handler: %s", handler.name)
                 listener.start()
-                # Ensure the listener's stop method is called on script exit
-                atexit.register(listener.stop)
+                _state.listeners[handler.name] = listener
             else:
                 logger.warning("No listener found for handler: %s", handler.name)
+
+    # Ensure the listeners are drained on script exit
+    if _state.listeners and not _state.atexit_registered:
+        atexit.register(stop_queue_listeners)
+        _state.atexit_registered = True
+
+
+def stop_queue_listener(name: str) -> None:
+    """
+    Stop a single queue listener.  `QueueListener.stop` processes every record
+    still on the queue before the thread exits, so nothing is dropped.
+    """
+    listener = _state.listeners.pop(name, None)
+    if listener:
+        logger.debug("Draining listener for handler: %s", name)
+        listener.stop()
+
+
+def stop_queue_listeners() -> None:
+    """Drain and stop all running queue listeners."""
+    for name in list(_state.listeners):
+        stop_queue_listener(name)
+
+
+def drain_queue_listeners(timeout: float) -> bool:
+    """
+    Wait until every running listener has handled the records queued so far,
+    and flush its handlers, leaving the listeners running (so records logged
+    afterwards, e.g. during shutdown, are still written).  Returns False if
+    `timeout` expired first.
+    """
+    deadline = time.monotonic() + timeout
+    for name, listener in list(_state.listeners.items()):
+        listener_queue = listener.queue
+        if isinstance(listener_queue, queue.Queue):
+            with listener_queue.all_tasks_done:
+                while listener_queue.unfinished_tasks:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        logger.warning("Timed out draining log queue %s", name)
+                        return False
+                    listener_queue.all_tasks_done.wait(remaining)
+        for handler in listener.handlers:
+            handler.flush()
+    return True
+
+
+def get_queue_stats() -> dict[str, dict[str, Any]]:
+    """
+    Report the depth of every queue handler's queue, plus the overflow counters
+    for queues that are a `BoundedLogQueue`.
+    """
+    stats: dict[str, dict[str, Any]] = {}
+    for name in sorted(logging.getHandlerNames()):
+        handler = logging.getHandlerByName(name)
+        if not isinstance(handler, logging.handlers.QueueHandler):
+            continue
+        handler_queue = handler.queue
+        if isinstance(handler_queue, BoundedLogQueue):
+            stats[name] = handler_queue.stats()
+        else:
+            stats[name] = {"size": handler_queue.qsize()}
+    return stats
+
+
+def instrument_handlers() -> None:
+    """
+    Count records per handler and time each handler's formatter for /metrics.
+    Already-instrumented handlers and formatters are left alone, so this is
+    safe to call after every (re)configuration.
+    """
+    handler_configs: dict[str, Any] = (_state.applied or {}).get("handlers") or {}
+    for name in logging.getHandlerNames():
+        handler = logging.getHandlerByName(name)
+        if handler is None:
+            continue
+        if not any(isinstance(f, HandlerMetricsFilter) for f in handler.filters):
+            handler.addFilter(HandlerMetricsFilter(name))
+
+        formatter = handler.formatter
+        if formatter is None or "format" in vars(formatter):
+            continue  # no formatter, or already wrapped
+        labels = (
+            (handler_configs.get(name) or {}).get("formatter")
+            or type(formatter).__name__,
+        )
+        formatter.format = metrics.timed(
+            formatter.format, metrics.LOG_FORMAT_SECONDS, labels
+        )
+        if callable(format_bytes := getattr(formatter, "format_bytes", None)):
+            formatter.format_bytes = metrics.timed(
+                format_bytes, metrics.LOG_FORMAT_SECONDS, labels
+            )
+
+
+def set_queue_levels() -> None:
+    """
+    Give each queue handler without a configured level the lowest level of its
+    target handlers, so records that none of them would handle are dropped
+    before they are enqueued, rather than by the listener thread.
+    """
+    handler_configs: dict[str, Any] = (_state.applied or {}).get("handlers") or {}
+    for name, config in handler_configs.items():
+        handler = logging.getHandlerByName(name)
+        if (
+            not isinstance(handler, logging.handlers.QueueHandler)
+            or "level" in (config or {})
+            or (listener := handler.listener) is None
+            or not listener.respect_handler_level
+        ):
+            continue
+        handler.setLevel(
+            min((target.level for target in listener.handlers), default=logging.NOTSET)
+        )
+
+
+class LoggingConfigDiff:
+    """
+    The difference between two resolved logging configs.
+
+    - rebuild_handlers: handlers that must be recreated (including queue handlers
+      whose target handlers are recreated)
+    - update_handlers:  handlers whose level/formatter can be updated in place
+    - formatters:       formatters whose definition changed
+    - loggers:          loggers (including "root") that must be reconfigured
+    - removed_handlers: handlers that no longer exist in the new config
+    - full:             True if the change requires a full reconfiguration
+    """
+
+    def __init__(self, old: dict[str, Any], new: dict[str, Any]) -> None:
+        self.full: bool = any(
+            old.get(key) != new.get(key)
+            for key in (old.keys() | new.keys()) - RELOADABLE_SECTIONS
+        )
+
+        old_formatters: dict[str, Any] = old.get("formatters") or {}
+        new_formatters: dict[str, Any] = new.get("formatters") or {}
+        self.formatters: set[str] = {
+            name
+            for name, config in new_formatters.items()
+            if old_formatters.get(name) != config
+        }
+
+        old_handlers: dict[str, Any] = old.get("handlers") or {}
+        new_handlers: dict[str, Any] = new.get("handlers") or {}
+        self.removed_handlers: set[str] = old_handlers.keys() - new_handlers.keys()
+        self.rebuild_handlers: set[str] = set()
+        self.update_handlers: set[str] = set()
+        for name, config in new_handlers.items():
+            old_config = old_handlers.get(name)
+            if old_config is None:
+                self.rebuild_handlers.add(name)
+                continue
+            changed_keys = {
+                key
+                for key in old_config.keys() | config.keys()
+                if old_config.get(key) != config.get(key)
+            }
+            if changed_keys - IN_PLACE_HANDLER_KEYS:
+                self.rebuild_handlers.add(name)
+            elif changed_keys or config.get("formatter") in self.formatters:
+                self.update_handlers.add(name)
+
+        # Queue handlers must be rebuilt when any of their targets are rebuilt
+        pending = True
+        while pending:
+            pending = False
+            for name, config in new_handlers.items():
+                targets = set(config.get("handlers") or ())
+                if name not in self.rebuild_handlers and targets & (
+                    self.rebuild_handlers | self.removed_handlers
+                ):
+                    self.rebuild_handlers.add(name)
+                    pending = True
+        self.update_handlers -= self.rebuild_handlers
+
+        old_loggers: dict[str, Any] = dict(old.get("loggers") or {})
+        new_loggers: dict[str, Any] = dict(new.get("loggers") or {})
+        old_loggers[ROOT_LOGGER_NAME] = old.get("root")
+        new_loggers[ROOT_LOGGER_NAME] = new.get("root")
+        replaced = self.rebuild_handlers | self.removed_handlers
+        self.loggers: set[str] = {
+            name
+            for name in old_loggers.keys() | new_loggers.keys()
+            if old_loggers.get(name) != new_loggers.get(name)
+            or replaced & set((new_loggers.get(name) or {}).get("handlers") or ())
+        }
+
+    def is_empty(self) -> bool:
+        return not (
+            self.full
+            or self.formatters
+            or self.rebuild_handlers
+            or self.update_handlers
+            or self.removed_handlers
+            or self.loggers
+        )
+
+    def as_dict(self) -> dict[str, Any]:
+        return {
+            "full": self.full,
+            "formatters": sorted(self.formatters),
+            "handlers_rebuilt": sorted(self.rebuild_handlers),
+            "handlers_updated": sorted(self.update_handlers),
+            "handlers_removed": sorted(self.removed_handlers),
+            "loggers": sorted(self.loggers),
+        }
+
+
+def _reuse_running_handlers(
+    handlers: dict[str, Any], diff: LoggingConfigDiff
+) -> dict[str, logging.Handler]:
+    """
+    Substitute running handler objects for the handlers that are not rebuilt.
+    Returns the running handlers that are about to be replaced or removed.
+    """
+    old_handlers: dict[str, logging.Handler] = {}
+    for name in list(handlers):
+        existing = logging.getHandlerByName(name)
+        if existing is None:
+            diff.rebuild_handlers.add(name)
+        elif name in diff.rebuild_handlers:
+            old_handlers[name] = existing
+        else:
+            handlers[name] = existing
+    for name in diff.removed_handlers:
+        if (existing := logging.getHandlerByName(name)) is not None:
+            old_handlers[name] = existing
+    return old_handlers
+
+
+def _rebuild_handlers(
+    configurator: logging.config.DictConfigurator,
+    diff: LoggingConfigDiff,
+) -> tuple[dict[str, logging.Handler], dict[str, logging.Handler]]:
+    """
+    Build the handlers named in `diff` and update the in-place ones.
+    Returns the replaced (old) handlers and the new handlers by name.
+    """
+    formatters = configurator.config.get("formatters", {})
+    handlers = configurator.config.get("handlers", {})
+    handler_configs: dict[str, dict[str, Any]] = {
+        name: dict(config) for name, config in handlers.items()
+    }
+    old_handlers = _reuse_running_handlers(handlers, diff)
+
+    # Build the filters the new handlers and reconfigured loggers refer to by name
+    filters = configurator.config.get("filters", {})
+    for name in list(filters):
+        filters[name] = configurator.configure_filter(filters[name])
+
+    # Formatters are cheap and stateless - build the ones the changed handlers use
+    for name in {
+        handler_configs[handler_name].get("formatter")
+        for handler_name in diff.rebuild_handlers | diff.update_handlers
+    }:
+        if name is not None:
+            formatters[name] = configurator.configure_formatter(formatters[name])
+
+    # Build new handlers (targets before the queue handlers that reference them)
+    new_handlers: dict[str, logging.Handler] = {}
+    for name in sorted(
+        diff.rebuild_handlers, key=lambda name: "handlers" in handler_configs[name]
+    ):
+        try:
+            new_handlers[name] = configurator.configure_handler(handlers[name])
+        except Exception as e:
+            msg = f"Unable to configure handler {name!r}"
+            raise ValueError(msg) from e
+        handlers[name] = new_handlers[name]
+
+    # Update level/formatter of handlers in place
+    for name in diff.update_handlers:
+        handler = handlers[name]
+        if (formatter_name := handler_configs[name].get("formatter")) is not None:
+            handler.setFormatter(formatters[formatter_name])
+        handler.setLevel(handler_configs[name].get("level", logging.NOTSET))
+
+    return old_handlers, new_handlers
+
+
+def _reconfigure_loggers(
+    configurator: logging.config.DictConfigurator, names: set[str]
+) -> None:
+    """Re-apply the config of the named loggers, swapping in the new handlers."""
+    loggers = configurator.config.get("loggers", {})
+    for name in names:
+        # dictConfig adds the configured filters without removing the old ones
+        clear_logger_filters(name)
+        if name == ROOT_LOGGER_NAME:
+            if (root_config := configurator.config.get("root")) is not None:
+                configurator.configure_root(root_config)
+        elif name in loggers:
+            configurator.configure_logger(name, loggers[name])
+        else:
+            # Logger was removed from the config - return it to the defaults
+            removed_logger = logging.getLogger(name)
+            for handler in removed_logger.handlers[:]:
+                removed_logger.removeHandler(handler)
+            removed_logger.setLevel(logging.NOTSET)
+            removed_logger.propagate = True
+
+
+def apply_config_diff(config: dict[str, Any], diff: LoggingConfigDiff) -> None:
+    """
+    Apply only the parts of `config` named in `diff` to the running logging setup.
+
+    New handlers are built and swapped onto their loggers first.  The replaced
+    queue listeners are then drained into their (old) target handlers, and only
+    after that are the old handlers closed.
+    """
+    applied = copy.deepcopy(config)
+    configurator = logging.config.DictConfigurator(config)
+    old_handlers, new_handlers = _rebuild_handlers(configurator, diff)
+    _reconfigure_loggers(configurator, diff.loggers)
+
+    # Drain the replaced listeners, then close the handlers they fed
+    for name in old_handlers:
+        stop_queue_listener(name)
+    for handler in old_handlers.values():
+        handler.close()  # also unregisters the handler name
+
+    for name, handler in new_handlers.items():
+        handler.name = name
+    _state.applied = applied
+    instrument_handlers()
+    set_queue_levels()
+    start_queue_listeners()
+
+
+def reload_logger(file_path: str | None = None) -> dict[str, Any]:
+    """
+    Reload the logging config and apply only what changed since the last load.
+    Returns a summary of what was rebuilt.
+    """
+    with _state.lock:
+        file_path = file_path or _state.file_path or "conf/logger.yaml"
+        new_config = load_logger_config(file_path)
+        if _state.applied is None:
+            apply_full_config(new_config)
+            return {"full": True}
+
+        diff = LoggingConfigDiff(_state.applied, new_config)
+        if diff.is_empty():
+            logger.info("Logging configuration unchanged.")
+        elif diff.full:
+            logger.info("Logging configuration changed - reconfiguring all handlers")
+            apply_full_config(new_config)
+        else:
+            apply_config_diff(new_config, diff)
+            logger.info("Logging configuration reloaded: %s", diff.as_dict())
+        return diff.as_dict()
+
+
+def logger_config_modified() -> bool:
+    """Return True if the loaded logging YAML file changed on disk."""
+    if _state.file_path is None:
+        return False
+    try:
+        return Path(_state.file_path).stat().st_mtime != _state.mtime
+    except OSError:
+        return False
+
+
+async def watch_logger_config(interval: float = 5.0) -> None:
+    """
+    Poll the loaded logging YAML file and hot-reload it when it changes.
+    """
+    logger.info("Watching logging configuration every %ss", interval)
+    while True:
+        await asyncio.sleep(interval)
+        if not logger_config_modified():
+            continue
+        try:
+            await asyncio.to_thread(reload_logger)
+        except (yaml.YAMLError, ValueError, TypeError, KeyError, AttributeError):
+            logger.exception("Error reloading logging configuration.")
+        except OSError:
+            logger.exception("Error reading logging configuration file.")
@@ -0,0 +1,237 @@
+"""
+Event-loop tuning and lag measurement.
+
+A `LoopLagMonitor` sleeps for a fixed interval and measures how much later
+than requested the loop woke it up.  That delay is the time the loop spent
+running other callbacks, so it shows when a handler or a blocking call is
+starving everything else on the loop (probes, heartbeats, the API).
+
+A `LoopWatchdog` watches a loop from its own thread.  When a callback holds
+the loop for longer than the slow-callback threshold, the watchdog logs the
+loop thread's stack while the stall is still happening, and counts the stall
+by the coroutine of the task that was running.
+
+Monitors and watchdogs register themselves by loop name ("main" for the bot's
+loop, "api" for the API server's own loop when it runs on a thread, "worker<N>"
+for a shard worker process's loop), and only assign plain values, so the API
+can read any loop's stats from any thread.
+
+Environment variables (all opt-in):
+- LOOP_UVLOOP: run the event loops on uvloop, when it is installed
+- LOOP_DEBUG: enable asyncio's debug mode
+- LOOP_SLOW_CALLBACK_MS: start the watchdog with this threshold, and use it
+  as asyncio's debug-mode slow-callback duration
+"""
+
+import asyncio
+import importlib
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from collections.abc import Callable
+from typing import Any
+
+from lib import metrics
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+# Seconds between lag samples
+LAG_SAMPLE_INTERVAL = 0.5
+# Number of recent samples kept for the recent maximum
+LAG_RECENT_SAMPLES = 120
+
+MONITORS: dict[str, "LoopLagMonitor"] = {}
+WATCHDOGS: dict[str, "LoopWatchdog"] = {}
+
+
+class LoopLagMonitor:
+    """
+    Samples how late the loop it runs on wakes up a sleeping task.
+
+    :param name:     the loop's name, as reported by the API and metrics
+    :param interval: seconds between samples
+    """
+
+    def __init__(self, name: str, interval: float = LAG_SAMPLE_INTERVAL) -> None:
+        self.name: str = name
+        self.interval: float = interval
+        self.lag: float = 0.0
+        self.max_lag: float = 0.0
+        self.samples: int = 0
+        self._recent: deque[float] = deque(maxlen=LAG_RECENT_SAMPLES)
+
+    async def run(self) -> None:
+        """Sample the running loop's lag until cancelled."""
+        # time.monotonic rather than loop.time(), which uvloop rounds to ms
+        monotonic = time.monotonic
+        while True:
+            wake_at = monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            self.record(max(0.0, monotonic() - wake_at))
+
+    def record(self, lag: float) -> None:
+        self.lag = lag
+        self.max_lag = max(self.max_lag, lag)
+        self.samples += 1
+        self._recent.append(lag)
+        metrics.LOOP_LAG_SECONDS.observe(lag, (self.name,))
+
+    def stats(self) -> dict[str, Any]:
+        """Latest, recent maximum and all-time maximum lag, in seconds."""
+        recent = list(self._recent)
+        return {
+            "lag": self.lag,
+            "recent_max_lag": max(recent, default=0.0),
+            "max_lag": self.max_lag,
+            "samples": self.samples,
+            "interval": self.interval,
+        }
+
+
+class LoopWatchdog(threading.Thread):
+    """
+    Detects callbacks that hold a loop for longer than `threshold` seconds.
+
+    Every half threshold the watchdog schedules a no-op beat on the loop.  If
+    a beat is still pending after `threshold`, whatever the loop is running is
+    stalling it: the watchdog logs the loop thread's current stack and counts
+    the stall by the running task's coroutine.  The beat logs the stall's
+    total duration once the loop gets to it.
+
+    Create the watchdog on the loop's thread, with the loop running.
+    """
+
+    def __init__(self, name: str, threshold: float) -> None:
+        super().__init__(name=f"loop-watchdog-{name}", daemon=True)
+        self.loop_name: str = name
+        self.threshold: float = threshold
+        self.loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+        self.loop_thread_id: int = threading.get_ident()
+        self.slow_callbacks: dict[str, int] = {}
+        # When the pending beat was sent; only the loop clears it
+        self._beat_sent: float | None = None
+        # Send time of the beat whose stall was reported; only the watchdog sets it
+        self._stalled_beat: float | None = None
+        self._stopped: threading.Event = threading.Event()
+
+    def run(self) -> None:
+        while not self._stopped.wait(self.threshold / 2):
+            sent = self._beat_sent
+            if sent is None:
+                self._beat_sent = time.monotonic()
+                try:
+                    self.loop.call_soon_threadsafe(self._beat)
+                except RuntimeError:
+                    return  # The loop was closed
+            elif sent != self._stalled_beat:
+                stalled = time.monotonic() - sent
+                if stalled > self.threshold:
+                    self._stalled_beat = sent
+                    self.report_stall(stalled)
+
+    def _beat(self) -> None:
+        """Runs on the loop once it gets through the callbacks ahead of it."""
+        sent = self._beat_sent
+        self._beat_sent = None
+        if sent is not None and sent == self._stalled_beat:
+            logger.warning(
+                "Event loop %r was stalled for %.0f ms",
+                self.loop_name,
+                (time.monotonic() - sent) * 1000,
+            )
+
+    def report_stall(self, stalled: float) -> None:
+        coroutine = running_coroutine(self.loop)
+        self.slow_callbacks[coroutine] = self.slow_callbacks.get(coroutine, 0) + 1
+        metrics.LOOP_SLOW_CALLBACKS.inc(labels=(self.loop_name, coroutine))
+        frame = sys._current_frames().get(self.loop_thread_id)  # noqa: SLF001
+        stack = "".join(traceback.format_stack(frame)) if frame else "(unavailable)\n"
+        logger.warning(
+            "Event loop %r stalled for over %.0f ms in %s; loop thread stack:\n%s",
+            self.loop_name,
+            stalled * 1000,
+            coroutine,
+            stack.rstrip(),
+        )
+
+    def stop(self) -> None:
+        self._stopped.set()
+
+
+def running_coroutine(loop: asyncio.AbstractEventLoop) -> str:
+    """Qualified name of the coroutine of the task `loop` is running."""
+    task = asyncio.current_task(loop)
+    if task is None:
+        return "<callback>"
+    coro = task.get_coro()
+    return getattr(coro, "__qualname__", type(coro).__qualname__)
+
+
+def loop_factory() -> Callable[[], asyncio.AbstractEventLoop] | None:
+    """
+    uvloop's loop factory for `asyncio.run` when LOOP_UVLOOP is set and uvloop
+    is installed, otherwise None (the default asyncio loop).
+    """
+    if not os.getenv("LOOP_UVLOOP"):
+        return None
+    try:
+        uvloop = importlib.import_module("uvloop")
+    except ImportError:
+        logger.warning("LOOP_UVLOOP is set but uvloop is not installed")
+        return None
+    return uvloop.new_event_loop
+
+
+def slow_callback_threshold() -> float:
+    """LOOP_SLOW_CALLBACK_MS in seconds; 0 when the watchdog is disabled."""
+    return max(0.0, float(os.getenv("LOOP_SLOW_CALLBACK_MS", "0")) / 1000)
+
+
+def tune_loop(name: str) -> LoopWatchdog | None:
+    """
+    Apply the debug settings to the running loop and start its watchdog, if
+    LOOP_SLOW_CALLBACK_MS is set.
+    """
+    loop = asyncio.get_running_loop()
+    threshold = slow_callback_threshold()
+    if os.getenv("LOOP_DEBUG"):
+        loop.set_debug(True)
+    if threshold > 0:
+        loop.slow_callback_duration = threshold
+    logger.info(
+        "Event loop %r: %s.%s, debug %s, slow callback threshold %s",
+        name,
+        type(loop).__module__,
+        type(loop).__qualname__,
+        "on" if loop.get_debug() else "off",
+        f"{threshold * 1000:.0f} ms" if threshold > 0 else "off",
+    )
+    if threshold <= 0:
+        return None
+    watchdog = LoopWatchdog(name, threshold)
+    WATCHDOGS[name] = watchdog
+    watchdog.start()
+    return watchdog
+
+
+def start_lag_monitor(name: str) -> asyncio.Task[None]:
+    """Register a lag monitor for the running loop and start sampling."""
+    monitor = LoopLagMonitor(name)
+    MONITORS[name] = monitor
+    return asyncio.create_task(monitor.run(), name=f"loop-lag-{name}")
+
+
+def get_lag_stats() -> dict[str, dict[str, Any]]:
+    """Lag statistics and slow callbacks for every monitored loop."""
+    stats = {}
+    for name, monitor in sorted(MONITORS.items()):
+        watchdog = WATCHDOGS.get(name)
+        stats[name] = {
+            **monitor.stats(),
+            "slow_callbacks": dict(watchdog.slow_callbacks) if watchdog else {},
+        }
+    return stats
@@ -0,0 +1,399 @@
+"""
+Low-overhead metrics with a Prometheus text exposition renderer.
+
+Counters and histograms keep one shard of values per thread, so recording a
+value never takes a lock (the event loop, the uvicorn server and the logging
+listener threads each write to their own shard).  Shards are only summed when
+`/metrics` is scraped.  Gauges are either set directly or computed by a
+callback at scrape time.
+"""
+
+import abc
+import bisect
+import functools
+import math
+import threading
+import time
+from collections.abc import Callable, Iterable
+from typing import ClassVar, override
+
+LabelValues = tuple[str, ...]
+
+# Default latency buckets, in seconds
+DEFAULT_BUCKETS: tuple[float, ...] = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def format_value(value: float) -> str:
+    """Format a sample value the way the exposition format expects."""
+    if math.isnan(value):
+        return "NaN"
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+def escape_label_value(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_labels(names: Iterable[str], values: Iterable[str]) -> str:
+    """Format a label set, e.g. `{route="/status",method="GET"}`."""
+    pairs = ",".join(
+        f'{name}="{escape_label_value(value)}"'
+        for name, value in zip(names, values, strict=True)
+    )
+    return f"{{{pairs}}}" if pairs else ""
+
+
+def timed[**P, R](
+    func: Callable[P, R], histogram: "Histogram", labels: LabelValues = ()
+) -> Callable[P, R]:
+    """Wrap a function so each call's duration is observed in `histogram`."""
+    perf_counter = time.perf_counter
+
+    @functools.wraps(func)
+    def wrapper(*args: P.args, **kwargs: P.kwargs) -> R:
+        start = perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            histogram.observe(perf_counter() - start, labels)
+
+    return wrapper
+
+
+class ThreadShards[T]:
+    """
+    Per-thread storage for metric values.  Each thread lazily creates its own
+    shard; the lock is only taken the first time a thread records a value.
+    """
+
+    def __init__(self, factory: Callable[[], T]) -> None:
+        self._factory: Callable[[], T] = factory
+        self._local: threading.local = threading.local()
+        self._shards: list[T] = []
+        self._lock: threading.Lock = threading.Lock()
+
+    def get(self) -> T:
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._factory()
+            self._local.shard = shard
+            with self._lock:
+                self._shards.append(shard)
+            return shard
+
+    def all(self) -> list[T]:
+        with self._lock:
+            return list(self._shards)
+
+
+class Metric(abc.ABC):
+    """Base class for metrics; subclasses implement `samples`."""
+
+    type_name: ClassVar[str] = "untyped"
+
+    def __init__(
+        self, name: str, documentation: str, labelnames: LabelValues = ()
+    ) -> None:
+        self.name: str = name
+        self.documentation: str = documentation
+        self.labelnames: LabelValues = labelnames
+
+    @abc.abstractmethod
+    def samples(self) -> Iterable[tuple[str, str, float]]:
+        """Yield (sample name, formatted labels, value) tuples."""
+
+    def render(self) -> str:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type_name}",
+        ]
+        lines.extend(
+            f"{name}{labels} {format_value(value)}"
+            for name, labels, value in self.samples()
+        )
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    """A monotonically increasing counter."""
+
+    type_name: ClassVar[str] = "counter"
+
+    def __init__(
+        self, name: str, documentation: str, labelnames: LabelValues = ()
+    ) -> None:
+        super().__init__(name, documentation, labelnames)
+        self._shards: ThreadShards[dict[LabelValues, float]] = ThreadShards(dict)
+
+    def inc(self, amount: float = 1.0, labels: LabelValues = ()) -> None:
+        shard = self._shards.get()
+        shard[labels] = shard.get(labels, 0.0) + amount
+
+    def values(self) -> dict[LabelValues, float]:
+        totals: dict[LabelValues, float] = {}
+        for shard in self._shards.all():
+            for labels, value in list(shard.items()):
+                totals[labels] = totals.get(labels, 0.0) + value
+        return totals
+
+    @override
+    def samples(self) -> Iterable[tuple[str, str, float]]:
+        for labels, value in sorted(self.values().items()):
+            yield self.name, format_labels(self.labelnames, labels), value
+
+
+class Gauge(Metric):
+    """A value that can go up and down, optionally computed at scrape time."""
+
+    type_name: ClassVar[str] = "gauge"
+
+    def __init__(
+        self, name: str, documentation: str, labelnames: LabelValues = ()
+    ) -> None:
+        super().__init__(name, documentation, labelnames)
+        self._values: dict[LabelValues, float] = {}
+        self._callback: Callable[[], dict[LabelValues, float]] | None = None
+
+    def set(self, value: float, labels: LabelValues = ()) -> None:
+        self._values[labels] = value
+
+    def set_callback(self, callback: Callable[[], dict[LabelValues, float]]) -> None:
+        """Compute the gauge's values with `callback` whenever it is scraped."""
+        self._callback = callback
+
+    def values(self) -> dict[LabelValues, float]:
+        if self._callback is not None:
+            return self._callback()
+        return dict(self._values)
+
+    @override
+    def samples(self) -> Iterable[tuple[str, str, float]]:
+        for labels, value in sorted(self.values().items()):
+            yield self.name, format_labels(self.labelnames, labels), value
+
+
+class Histogram(Metric):
+    """A histogram with fixed buckets."""
+
+    type_name: ClassVar[str] = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: LabelValues = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.buckets: tuple[float, ...] = tuple(sorted(buckets))
+        # Per label set: [count per bucket..., count in +Inf, sum]
+        self._shards: ThreadShards[dict[LabelValues, list[float]]] = ThreadShards(dict)
+
+    def observe(self, value: float, labels: LabelValues = ()) -> None:
+        shard = self._shards.get()
+        counts = shard.get(labels)
+        if counts is None:
+            counts = shard[labels] = [0.0] * (len(self.buckets) + 2)
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def values(self) -> dict[LabelValues, list[float]]:
+        totals: dict[LabelValues, list[float]] = {}
+        for shard in self._shards.all():
+            for labels, counts in list(shard.items()):
+                total = totals.setdefault(labels, [0.0] * len(counts))
+                for i, count in enumerate(counts):
+                    total[i] += count
+        return totals
+
+    @override
+    def samples(self) -> Iterable[tuple[str, str, float]]:
+        bucket_labels = (*self.labelnames, "le")
+        for labels, counts in sorted(self.values().items()):
+            cumulative = 0.0
+            for bound, count in zip(
+                (*self.buckets, math.inf), counts[:-1], strict=True
+            ):
+                cumulative += count
+                yield (
+                    f"{self.name}_bucket",
+                    format_labels(bucket_labels, (*labels, format_value(bound))),
+                    cumulative,
+                )
+            formatted = format_labels(self.labelnames, labels)
+            yield f"{self.name}_sum", formatted, counts[-1]
+            yield f"{self.name}_count", formatted, cumulative
+
+
+class MetricsRegistry:
+    """A collection of metrics rendered together."""
+
+    def __init__(self) -> None:
+        self._metrics: dict[str, Metric] = {}
+
+    def register[M: Metric](self, metric: M) -> M:
+        if metric.name in self._metrics:
+            msg = f"Duplicate metric name: {metric.name}"
+            raise ValueError(msg)
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        """Render all metrics in the Prometheus text exposition format."""
+        return "\n".join(metric.render() for metric in self._metrics.values()) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+# Bot
+GATEWAY_LATENCY = REGISTRY.register(
+    Gauge("discord_gateway_latency_seconds", "Discord gateway heartbeat latency")
+)
+EVENTS_RECEIVED = REGISTRY.register(
+    Counter(
+        "discord_events_received_total",
+        "Events dispatched by the Discord client, by event type",
+        ("event",),
+    )
+)
+ON_MESSAGE_SECONDS = REGISTRY.register(
+    Histogram("discord_on_message_seconds", "Time spent handling on_message")
+)
+MESSAGES_SENT = REGISTRY.register(
+    Counter("discord_messages_sent_total", "Messages sent by the bot")
+)
+SHARD_LATENCY = REGISTRY.register(
+    Gauge(
+        "discord_shard_latency_seconds",
+        "Gateway heartbeat latency, by shard (sharded mode)",
+        ("shard",),
+    )
+)
+OUTBOUND_QUEUE_DEPTH = REGISTRY.register(
+    Gauge("discord_outbound_queue_depth", "Messages waiting in the outbound queues")
+)
+OUTBOUND_COALESCED = REGISTRY.register(
+    Counter(
+        "discord_outbound_coalesced_total",
+        "Outbound messages merged into another message",
+    )
+)
+OUTBOUND_DROPPED = REGISTRY.register(
+    Counter(
+        "discord_outbound_dropped_total",
+        "Outbound messages dropped because a channel queue was full",
+    )
+)
+OUTBOUND_RATE_LIMITED = REGISTRY.register(
+    Counter("discord_outbound_rate_limited_total", "Sends that hit a 429 response")
+)
+PIPELINE_QUEUE_DEPTH = REGISTRY.register(
+    Gauge(
+        "discord_pipeline_queue_depth",
+        "Messages waiting in the message pipeline's lanes",
+    )
+)
+PIPELINE_WAIT_SECONDS = REGISTRY.register(
+    Histogram(
+        "discord_pipeline_wait_seconds",
+        "Time messages waited in the message pipeline before being handled",
+    )
+)
+PIPELINE_DROPPED = REGISTRY.register(
+    Counter(
+        "discord_pipeline_dropped_total",
+        "Messages dropped because their message pipeline lane was full",
+    )
+)
+CACHE_ENTRIES = REGISTRY.register(
+    Gauge("bot_cache_entries", "Entries in each of the bot's caches", ("cache",))
+)
+CACHE_BYTES = REGISTRY.register(
+    Gauge("bot_cache_bytes", "Estimated size of each of the bot's caches", ("cache",))
+)
+
+# Process
+RESIDENT_MEMORY = REGISTRY.register(
+    Gauge("process_resident_memory_bytes", "Resident memory size in bytes")
+)
+
+# Event loops
+LOOP_LAG_SECONDS = REGISTRY.register(
+    Histogram(
+        "event_loop_lag_seconds",
+        "How late the event loop woke a sleeping task, by loop",
+        ("loop",),
+        buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0),
+    )
+)
+LOOP_SLOW_CALLBACKS = REGISTRY.register(
+    Counter(
+        "event_loop_slow_callbacks_total",
+        "Callbacks that held the event loop past the slow-callback threshold, "
+        "by loop and running coroutine",
+        ("loop", "coroutine"),
+    )
+)
+
+# API
+REQUEST_SECONDS = REGISTRY.register(
+    Histogram(
+        "http_request_duration_seconds",
+        "API request latency, by route",
+        ("method", "route"),
+    )
+)
+
+# Logging
+LOG_QUEUE_DEPTH = REGISTRY.register(
+    Gauge("log_queue_depth", "Records waiting in each logging queue", ("queue",))
+)
+LOG_RECORDS = REGISTRY.register(
+    Counter("log_records_total", "Records handled, by handler", ("handler",))
+)
+LOG_SHIPPING_FAILURES = REGISTRY.register(
+    Counter(
+        "log_shipping_failures_total",
+        "Failed attempts to ship a batch of records to the log collector",
+    )
+)
+LOG_SHIPPING_REJECTED = REGISTRY.register(
+    Counter(
+        "log_shipping_rejected_total",
+        "Batches of records the log collector rejected, which are dropped",
+    )
+)
+LOG_RECORDS_SUPPRESSED = REGISTRY.register(
+    Counter(
+        "log_records_suppressed_total",
+        "Records dropped by rate-limit and sampling filters, by logger",
+        ("logger",),
+    )
+)
+LOG_FORMAT_SECONDS = REGISTRY.register(
+    Histogram(
+        "log_format_seconds",
+        "Time spent formatting records, by formatter",
+        ("formatter",),
+        buckets=(0.000005, 0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.001),
+    )
+)
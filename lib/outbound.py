@@ -0,0 +1,271 @@
+"""
+Outbound message dispatcher for DiscordBot.
+
+Handlers hand replies to `OutboundDispatcher.send` instead of awaiting
+`channel.send` inline.  Each channel gets its own queue, drained by a worker
+task that only exists while the channel has pending messages:
+
+- Sends are paced per channel with a token bucket modelled on Discord's
+  per-channel message route limit, so bursts don't turn into 429s.
+- Messages queued while a channel waits for its bucket are coalesced into a
+  single message (identical replies collapse into one).
+- A global semaphore bounds the number of sends in flight.
+- A 429 that discord.py gives up on (`discord.RateLimited`) pauses the
+  channel's bucket and the batch is retried.  discord.py only gives up when
+  the client is created with `max_ratelimit_timeout` (DiscordBot doesn't set
+  it); otherwise it waits out 429s itself and `send` just takes longer.
+
+A message that fails to send, or is still queued when its channel's worker
+is cancelled, resolves its future to None.
+"""
+
+import asyncio
+import logging
+from collections import deque
+from typing import Protocol
+
+import discord
+
+from lib import metrics
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+# Discord's maximum message length
+MAX_MESSAGE_LENGTH = 2000
+# Idle rate-limit buckets are pruned once more than this many are tracked
+MAX_IDLE_BUCKETS = 1024
+
+
+class Messageable(Protocol):
+    """The parts of a Discord channel the dispatcher needs."""
+
+    @property
+    def id(self) -> int: ...
+
+    async def send(self, content: str) -> discord.Message | None: ...
+
+
+class RateLimitBucket:
+    """
+    Token bucket for one rate-limit route: `limit` sends per `per` seconds.
+    """
+
+    __slots__ = ("_blocked_until", "_tokens", "_updated", "limit", "per")
+
+    def __init__(self, limit: int, per: float) -> None:
+        self.limit: int = limit
+        self.per: float = per
+        self._tokens: float = float(limit)
+        self._updated: float = 0.0
+        self._blocked_until: float = 0.0
+
+    def delay(self, now: float) -> float:
+        """Seconds to wait before a token is available (0 if one is now)."""
+        if self._updated:
+            refill = (now - self._updated) * self.limit / self.per
+            self._tokens = min(float(self.limit), self._tokens + refill)
+        self._updated = now
+        if now < self._blocked_until:
+            return self._blocked_until - now
+        if self._tokens >= 1:
+            return 0.0
+        return (1 - self._tokens) * self.per / self.limit
+
+    async def acquire(self) -> None:
+        loop = asyncio.get_running_loop()
+        # The wait is recomputed after sleeping, as a 429 may have paused the bucket
+        while (wait := self.delay(loop.time())) > 0:  # noqa: ASYNC110
+            await asyncio.sleep(wait)
+        self._tokens -= 1
+
+    def idle(self, now: float) -> bool:
+        """True once the bucket has fully refilled (it can be discarded)."""
+        return now >= max(self._updated + self.per, self._blocked_until)
+
+    def pause(self, retry_after: float) -> None:
+        """Block the bucket after a 429 response."""
+        loop = asyncio.get_running_loop()
+        self._blocked_until = loop.time() + retry_after
+        self._tokens = 0.0
+
+
+class OutboundMessage:
+    __slots__ = ("coalesce", "content", "future")
+
+    def __init__(
+        self,
+        content: str,
+        future: asyncio.Future[discord.Message | None],
+        *,
+        coalesce: bool,
+    ) -> None:
+        self.content: str = content
+        self.future: asyncio.Future[discord.Message | None] = future
+        self.coalesce: bool = coalesce
+
+
+class ChannelQueue:
+    __slots__ = ("bucket", "channel", "pending", "worker")
+
+    def __init__(self, channel: Messageable, bucket: RateLimitBucket) -> None:
+        self.channel: Messageable = channel
+        self.bucket: RateLimitBucket = bucket
+        self.pending: deque[OutboundMessage] = deque()
+        self.worker: asyncio.Task[None] | None = None
+
+
+class OutboundDispatcher:
+    """
+    Per-channel outbound send queues with rate-limit pacing, coalescing and
+    bounded concurrency.
+
+    :param max_concurrency:       maximum sends in flight across all channels
+    :param max_queue_per_channel: pending messages per channel before new ones
+                                  are dropped
+    :param rate_limit:            sends allowed per `rate_limit_per` seconds for
+                                  a channel
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = 8,
+        max_queue_per_channel: int = 100,
+        rate_limit: int = 5,
+        rate_limit_per: float = 5.0,
+    ) -> None:
+        self.max_queue_per_channel: int = max_queue_per_channel
+        self.rate_limit: int = rate_limit
+        self.rate_limit_per: float = rate_limit_per
+        self.pending: int = 0
+        self._semaphore: asyncio.Semaphore = asyncio.Semaphore(max_concurrency)
+        self._channels: dict[int, ChannelQueue] = {}
+        self._buckets: dict[int, RateLimitBucket] = {}
+
+    def send(
+        self, channel: Messageable, content: str, *, coalesce: bool = True
+    ) -> asyncio.Future[discord.Message | None]:
+        """
+        Queue a message for `channel` without waiting for it to be sent.
+
+        The returned future resolves to the sent message, or None if the
+        message was dropped or failed to send.  Messages with `coalesce=True`
+        may be merged with other pending messages for the same channel.
+        """
+        loop = asyncio.get_running_loop()
+        future: asyncio.Future[discord.Message | None] = loop.create_future()
+        channel_queue = self._channels.get(channel.id)
+        if channel_queue is None:
+            bucket = self._buckets.get(channel.id)
+            if bucket is None:
+                if len(self._buckets) > MAX_IDLE_BUCKETS:
+                    self._prune_buckets(loop.time())
+                bucket = self._buckets[channel.id] = RateLimitBucket(
+                    self.rate_limit, self.rate_limit_per
+                )
+            channel_queue = self._channels[channel.id] = ChannelQueue(channel, bucket)
+
+        if len(channel_queue.pending) >= self.max_queue_per_channel:
+            metrics.OUTBOUND_DROPPED.inc()
+            future.set_result(None)
+            return future
+
+        channel_queue.pending.append(
+            OutboundMessage(content, future, coalesce=coalesce)
+        )
+        self._update_pending(1)
+        if channel_queue.worker is None:
+            channel_queue.worker = loop.create_task(self._drain(channel_queue))
+        return future
+
+    async def drain(self) -> None:
+        """
+        Wait for every queued message to be sent.  Wrap in `asyncio.timeout`
+        to bound the wait; cancelling it leaves the workers running.
+        """
+        workers = [q.worker for q in self._channels.values() if q.worker is not None]
+        if workers:
+            await asyncio.wait(workers)
+
+    def _prune_buckets(self, now: float) -> None:
+        """Forget buckets of idle channels; they would start full anyway."""
+        for channel_id, bucket in list(self._buckets.items()):
+            if channel_id not in self._channels and bucket.idle(now):
+                del self._buckets[channel_id]
+
+    def _update_pending(self, delta: int) -> None:
+        self.pending += delta
+        metrics.OUTBOUND_QUEUE_DEPTH.set(self.pending)
+
+    def _take_batch(self, channel_queue: ChannelQueue) -> list[OutboundMessage]:
+        """
+        Pop the next message, plus any following coalescable messages that fit
+        in one Discord message.
+        """
+        pending = channel_queue.pending
+        batch = [pending.popleft()]
+        if not batch[0].coalesce:
+            return batch
+        contents = {batch[0].content}
+        length = len(batch[0].content)
+        while pending and pending[0].coalesce:
+            content = pending[0].content
+            if content not in contents:
+                if length + 1 + len(content) > MAX_MESSAGE_LENGTH:
+                    break
+                contents.add(content)
+                length += 1 + len(content)
+            batch.append(pending.popleft())
+        if len(batch) > 1:
+            metrics.OUTBOUND_COALESCED.inc(len(batch) - 1)
+        return batch
+
+    async def _drain(self, channel_queue: ChannelQueue) -> None:
+        """Worker: send a channel's queued messages in order."""
+        batch: list[OutboundMessage] = []
+        try:
+            while channel_queue.pending:
+                await channel_queue.bucket.acquire()
+                batch = self._take_batch(channel_queue)
+                # dict.fromkeys keeps the first occurrence of each reply, in order
+                content = "\n".join(dict.fromkeys(m.content for m in batch))
+                try:
+                    async with self._semaphore:
+                        sent = await channel_queue.channel.send(content)
+                except discord.RateLimited as e:
+                    logger.warning(
+                        "Rate limited sending to channel %s, retrying in %.2fs",
+                        channel_queue.channel.id,
+                        e.retry_after,
+                    )
+                    metrics.OUTBOUND_RATE_LIMITED.inc()
+                    channel_queue.bucket.pause(e.retry_after)
+                    channel_queue.pending.extendleft(reversed(batch))
+                    batch = []
+                    continue
+                except Exception:
+                    # Not only Discord errors: network errors and timeouts too
+                    logger.exception(
+                        "Failed to send message to channel %s", channel_queue.channel.id
+                    )
+                    sent = None
+                else:
+                    metrics.MESSAGES_SENT.inc()
+                self._resolve(batch, sent)
+                batch = []
+        finally:
+            # Only non-empty if the worker was cancelled: nothing will send them
+            self._resolve([*batch, *channel_queue.pending], None)
+            channel_queue.pending.clear()
+            channel_queue.worker = None
+            del self._channels[channel_queue.channel.id]
+
+    def _resolve(
+        self, batch: list[OutboundMessage], sent: discord.Message | None
+    ) -> None:
+        """Resolve the futures of messages that left the queue."""
+        if not batch:
+            return
+        self._update_pending(-len(batch))
+        for message in batch:
+            if not message.future.done():
+                message.future.set_result(sent)
@@ -0,0 +1,231 @@
+"""
+Concurrent message processing for DiscordBot.
+
+discord.py starts a task for every event it dispatches, with no limit, so a
+burst of messages becomes as many live coroutines.  `MessagePipeline` instead
+queues messages into a fixed number of lanes, each drained by one worker task.
+A message's lane is chosen from its channel ID, so messages of one channel
+are handled (and replied to) in the order they arrived, while different
+channels are handled concurrently.
+
+Handlers doing CPU-heavy work can run it off the event loop with
+`MessagePipeline.offload`, on a thread or process pool.
+
+Environment variables:
+- PIPELINE_WORKERS: number of lanes (and worker tasks)
+- PIPELINE_QUEUE_SIZE: messages waiting across all lanes before new ones are
+  dropped
+- PIPELINE_EXECUTOR: `thread` or `process`, the pool `offload` runs work on
+- PIPELINE_EXECUTOR_WORKERS: size of that pool (default: the pool's own)
+"""
+
+import asyncio
+import concurrent.futures
+import logging
+import os
+import time
+from collections import deque
+from collections.abc import Awaitable, Callable, Iterable
+from typing import Any
+
+import discord
+
+from lib import metrics
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+DEFAULT_PIPELINE_WORKERS = 8
+DEFAULT_PIPELINE_QUEUE_SIZE = 10_000
+PIPELINE_EXECUTORS = ("thread", "process")
+# 2**64 / golden ratio, to spread channel IDs over the lanes
+FIBONACCI_MULTIPLIER = 0x9E37_79B9_7F4A_7C15
+# Recent wait and handling times kept for the percentiles
+LATENCY_SAMPLES = 1024
+LATENCY_PERCENTILES: dict[str, float] = {"p50": 0.5, "p95": 0.95, "p99": 0.99}
+
+MessageHandler = Callable[[discord.Message], Awaitable[None]]
+
+
+def percentiles(samples: Iterable[float]) -> dict[str, float]:
+    """The `LATENCY_PERCENTILES` of some samples (0 when there are none)."""
+    ordered = sorted(samples)
+    if not ordered:
+        return dict.fromkeys(LATENCY_PERCENTILES, 0.0)
+    last = len(ordered) - 1
+    return {
+        name: ordered[min(last, int(fraction * len(ordered)))]
+        for name, fraction in LATENCY_PERCENTILES.items()
+    }
+
+
+class MessagePipeline:
+    """
+    A bounded queue of messages, split into per-channel ordered lanes, and
+    the workers handling them.
+
+    :param handler:    coroutine function called with each message
+    :param workers:    number of lanes, each drained by one worker task
+    :param queue_size: messages waiting across all lanes; each lane holds
+                       `queue_size / workers`
+    :param executor:   `thread` or `process`, the pool used by `offload`
+    :param executor_workers: size of that pool (None for the pool's default)
+    """
+
+    def __init__(
+        self,
+        handler: MessageHandler,
+        workers: int = DEFAULT_PIPELINE_WORKERS,
+        queue_size: int = DEFAULT_PIPELINE_QUEUE_SIZE,
+        executor: str = "thread",
+        executor_workers: int | None = None,
+    ) -> None:
+        if workers < 1:
+            msg = f"workers must be at least 1, not {workers}"
+            raise ValueError(msg)
+        if executor not in PIPELINE_EXECUTORS:
+            msg = f"executor must be one of {PIPELINE_EXECUTORS}, not {executor!r}"
+            raise ValueError(msg)
+        self.handler: MessageHandler = handler
+        self.workers: int = workers
+        self.queue_size: int = queue_size
+        self.executor: str = executor
+        self.executor_workers: int | None = executor_workers
+        self.processed: int = 0
+        self.dropped: int = 0
+        self.errors: int = 0
+        self.high_water_mark: int = 0
+        self._lane_size: int = max(1, queue_size // workers)
+        # Each entry is (message, time it was queued)
+        self._lanes: list[asyncio.Queue[tuple[discord.Message, float]]] = []
+        self._tasks: list[asyncio.Task[None]] = []
+        self._pool: concurrent.futures.Executor | None = None
+        self._wait_times: deque[float] = deque(maxlen=LATENCY_SAMPLES)
+        self._handle_times: deque[float] = deque(maxlen=LATENCY_SAMPLES)
+
+    @classmethod
+    def from_env(cls, handler: MessageHandler) -> "MessagePipeline":
+        workers = os.getenv("PIPELINE_WORKERS", str(DEFAULT_PIPELINE_WORKERS))
+        queue_size = os.getenv("PIPELINE_QUEUE_SIZE", str(DEFAULT_PIPELINE_QUEUE_SIZE))
+        executor_workers = os.getenv("PIPELINE_EXECUTOR_WORKERS")
+        return cls(
+            handler,
+            workers=int(workers),
+            queue_size=int(queue_size),
+            executor=os.getenv("PIPELINE_EXECUTOR", "thread").strip().lower(),
+            executor_workers=int(executor_workers) if executor_workers else None,
+        )
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    @property
+    def depth(self) -> int:
+        """Messages waiting in all lanes."""
+        return sum(lane.qsize() for lane in self._lanes)
+
+    def start(self) -> None:
+        """Create the lanes and their workers (on the running event loop)."""
+        if self.running:
+            return
+        self._lanes = [asyncio.Queue(self._lane_size) for _ in range(self.workers)]
+        self._tasks = [
+            asyncio.create_task(self._work(lane), name=f"message-pipeline-{index}")
+            for index, lane in enumerate(self._lanes)
+        ]
+
+    def lane(self, channel_id: int) -> asyncio.Queue[tuple[discord.Message, float]]:
+        """
+        The lane for a channel.  The ID is mixed (Fibonacci hashing) first, as
+        a snowflake's low bits are a per-process increment, mostly the same.
+        """
+        mixed = (channel_id * FIBONACCI_MULTIPLIER) & 0xFFFF_FFFF_FFFF_FFFF
+        return self._lanes[(mixed >> 32) % self.workers]
+
+    def submit(self, message: discord.Message) -> bool:
+        """
+        Queue a message without waiting.  Returns False (and drops the message)
+        if its lane is full.
+        """
+        try:
+            self.lane(message.channel.id).put_nowait((message, time.perf_counter()))
+        except asyncio.QueueFull:
+            self.dropped += 1
+            metrics.PIPELINE_DROPPED.inc()
+            return False
+        self._queued()
+        return True
+
+    async def put(self, message: discord.Message) -> None:
+        """Queue a message, waiting for room in its lane."""
+        await self.lane(message.channel.id).put((message, time.perf_counter()))
+        self._queued()
+
+    def _queued(self) -> None:
+        self.high_water_mark = max(self.high_water_mark, self.depth)
+
+    async def _work(self, lane: asyncio.Queue[tuple[discord.Message, float]]) -> None:
+        while True:
+            message, queued_at = await lane.get()
+            start = time.perf_counter()
+            try:
+                await self.handler(message)
+            except Exception:
+                self.errors += 1
+                logger.exception("Error handling message %s", message.id)
+            finally:
+                end = time.perf_counter()
+                self.processed += 1
+                self._wait_times.append(start - queued_at)
+                self._handle_times.append(end - start)
+                metrics.PIPELINE_WAIT_SECONDS.observe(start - queued_at)
+                lane.task_done()
+
+    async def offload[R](self, func: Callable[..., R], *args: Any) -> R:  # noqa: ANN401
+        """
+        Run a blocking or CPU-heavy function on the pipeline's executor.  With
+        the process pool, `func` and its arguments must be picklable (e.g. a
+        module-level function taking the message's content, not the message).
+        """
+        if self._pool is None:
+            if self.executor == "process":
+                self._pool = concurrent.futures.ProcessPoolExecutor(
+                    self.executor_workers
+                )
+            else:
+                self._pool = concurrent.futures.ThreadPoolExecutor(
+                    self.executor_workers, thread_name_prefix="pipeline"
+                )
+        return await asyncio.get_running_loop().run_in_executor(self._pool, func, *args)
+
+    async def join(self) -> None:
+        """
+        Wait for every queued message to be handled.  Wrap in `asyncio.timeout`
+        to bound the wait.
+        """
+        await asyncio.gather(*(lane.join() for lane in self._lanes))
+
+    async def stop(self) -> None:
+        """Stop the workers, dropping queued messages, and shut the pool down."""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def stats(self) -> dict[str, Any]:
+        """Queue depth, counters and latency percentiles (in seconds)."""
+        return {
+            "workers": self.workers,
+            "queue_size": self._lane_size * self.workers,
+            "depth": self.depth,
+            "lanes": [lane.qsize() for lane in self._lanes],
+            "high_water_mark": self.high_water_mark,
+            "processed": self.processed,
+            "dropped": self.dropped,
+            "errors": self.errors,
+            "wait": percentiles(self._wait_times),
+            "handle": percentiles(self._handle_times),
+        }
@@ -0,0 +1,82 @@
+"""
+Gateway session resume across restarts.
+
+Normally the bot IDENTIFYs when it connects, and Discord sends READY and then
+a GUILD_CREATE for every guild before the bot is ready.  With GATEWAY_RESUME
+set, DiscordBot saves its gateway session (session ID, last sequence number
+and resume URL) in the state store when it shuts down, and disconnects
+without ending the session.  The next start RESUMEs that session instead:
+Discord replays the events missed in between, then sends RESUMED.
+
+Discord only keeps a disconnected session for a short while, so sessions
+older than GATEWAY_RESUME_MAX_AGE seconds aren't tried.  If Discord refuses
+the session anyway, the bot IDENTIFYs as usual.  A saved session is deleted as
+soon as it is loaded, so it is tried once: a run that crashes doesn't save
+one, and the next start IDENTIFYs.
+
+A resumed session gets no READY or GUILD_CREATE, so discord.py's guild,
+channel and member caches start empty (events still arrive, with partial
+channels), until the bot next IDENTIFYs.
+
+Environment variables:
+- GATEWAY_RESUME: save the gateway session on shutdown and resume it on start
+- GATEWAY_RESUME_MAX_AGE: seconds after which a saved session isn't tried
+"""
+
+import logging
+import time
+from typing import NamedTuple
+
+from lib.store import StateStore
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+SESSION_NAMESPACE = "gateway"
+SESSION_KEY = "session"
+DEFAULT_RESUME_MAX_AGE = 60.0
+
+
+class GatewaySession(NamedTuple):
+    """What the gateway needs to RESUME a session."""
+
+    session_id: str
+    sequence: int
+    resume_url: str
+    # Wall-clock time the session was saved (the next run is another process)
+    saved_at: float
+
+    @property
+    def age(self) -> float:
+        return time.time() - self.saved_at
+
+
+def save_session(
+    store: StateStore, session_id: str, sequence: int, resume_url: str
+) -> None:
+    """Save a session for the next start to resume."""
+    session = GatewaySession(session_id, sequence, resume_url, time.time())
+    store.set(SESSION_NAMESPACE, SESSION_KEY, session._asdict())
+
+
+async def load_session(store: StateStore, max_age: float) -> GatewaySession | None:
+    """
+    The session saved by the last run, if it is recent enough to resume.  It
+    is deleted from the store either way.
+    """
+    saved = await store.get(SESSION_NAMESPACE, SESSION_KEY)
+    if saved is None:
+        return None
+    store.delete(SESSION_NAMESPACE, SESSION_KEY)
+    try:
+        session = GatewaySession(**saved)
+    except TypeError:
+        logger.warning("Ignoring an invalid saved gateway session: %r", saved)
+        return None
+    if session.age > max_age:
+        logger.info(
+            "Saved gateway session is %.0fs old (max %.0fs), identifying",
+            session.age,
+            max_age,
+        )
+        return None
+    return session
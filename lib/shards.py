@@ -0,0 +1,425 @@
+"""
+Sharded, multi-process bot runner.
+
+In sharded mode `main.py` runs a `ShardSupervisor` instead of a single
+`DiscordBot`.  The supervisor splits the shards into contiguous ranges and
+starts one worker process per range; each worker runs a
+`ShardedDiscordBot` (discord.py's `AutoShardedClient`) for its shards on its
+own event loop, so the bot can use more than one core.
+
+Workers report each shard's state to the supervisor over a multiprocessing
+queue.  The supervisor aggregates the reports for the API (`/shards`,
+`/healthcheck`, `/ready` and `/status`) and restarts a worker whose process exits,
+with exponential backoff, without touching the other workers.
+
+Setting `SHARD_FAKE_GATEWAY` runs `FakeGateway` workers instead of
+connecting to Discord, to exercise the supervisor and API locally.
+"""
+
+import asyncio
+import contextlib
+import logging
+import multiprocessing
+import os
+import queue
+import random
+import signal
+import sys
+import time
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, NamedTuple
+
+import discord
+from dotenv import load_dotenv
+
+from lib.bot import DiscordBot
+from lib.intents import cache_options, resolve_intents, resolve_max_messages
+from lib.logger_setup import configure_logger
+from lib.loops import loop_factory, tune_loop
+from lib.startup import STARTUP
+from lib.status import StatusSnapshot
+from lib.store import STORE_CLOSE_TIMEOUT, StateStore
+
+if TYPE_CHECKING:
+    from multiprocessing.context import SpawnProcess
+    from multiprocessing.queues import Queue
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+# Seconds between shard state reports from a worker
+REPORT_INTERVAL = 5.0
+# A shard is unhealthy if its worker hasn't reported for this long
+REPORT_STALE_AFTER = 3 * REPORT_INTERVAL
+# Seconds between supervisor checks of the worker processes
+MONITOR_INTERVAL = 0.5
+# Worker restart backoff: doubles per consecutive crash, up to the maximum
+RESTART_BACKOFF_INITIAL = 1.0
+RESTART_BACKOFF_MAX = 60.0
+# A worker that ran this long before exiting resets its backoff
+RESTART_STABLE_AFTER = 60.0
+# Log file env vars of conf/logger.yaml, with their defaults, that each worker
+# gives its own name
+WORKER_LOG_FILES: dict[str, str] = {"LOG_FILE": "app.log", "LOG_API_FILE": "api.log"}
+# Seconds to wait for workers to exit on shutdown before killing them: longer
+# than a worker's bot takes to drain (PIPELINE_DRAIN_TIMEOUT and
+# OUTBOUND_DRAIN_TIMEOUT) and then close its gateway connection
+STOP_TIMEOUT = 15.0
+
+
+class ShardReport(NamedTuple):
+    """One shard's state, as reported by its worker."""
+
+    shard_id: int
+    worker: int
+    pid: int
+    is_ready: bool
+    latency: float | None
+    user: str
+    reported_at: float
+
+
+def split_shards(shard_count: int, processes: int) -> list[list[int]]:
+    """Split shard ids into `processes` contiguous, near-equal ranges."""
+    if shard_count < 1 or processes < 1:
+        msg = "Shard and process counts must be at least 1"
+        raise ValueError(msg)
+    processes = min(processes, shard_count)
+    base, extra = divmod(shard_count, processes)
+    ranges = []
+    start = 0
+    for index in range(processes):
+        size = base + (1 if index < extra else 0)
+        ranges.append(list(range(start, start + size)))
+        start += size
+    return ranges
+
+
+class ShardedDiscordBot(DiscordBot, discord.AutoShardedClient):
+    """DiscordBot running several shards over one client."""
+
+    def __init__(self, *args: Any, **kwargs: Any) -> None:  # noqa: ANN401
+        super().__init__(*args, **kwargs)
+        self.ready_shards: set[int] = set()
+
+    async def on_shard_ready(self, shard_id: int) -> None:
+        logger.info("Shard %d is ready", shard_id)
+        self.ready_shards.add(shard_id)
+
+    async def on_shard_resumed(self, shard_id: int) -> None:
+        self.ready_shards.add(shard_id)
+
+    async def on_shard_disconnect(self, shard_id: int) -> None:
+        logger.warning("Shard %d disconnected", shard_id)
+        self.ready_shards.discard(shard_id)
+
+    def shard_reports(self, worker: int) -> list[ShardReport]:
+        now = time.time()
+        latencies = dict(self.latencies)
+        user = str(self.user) if self.user else "Unknown"
+        return [
+            ShardReport(
+                shard_id=shard_id,
+                worker=worker,
+                pid=os.getpid(),
+                is_ready=shard_id in self.ready_shards,
+                latency=latencies.get(shard_id),
+                user=user,
+                reported_at=now,
+            )
+            for shard_id in self.shard_ids or ()
+        ]
+
+
+class FakeGateway:
+    """
+    Stand-in for a worker's gateway connections.  Shards become ready after a
+    short connect delay and report a jittery latency.  `crash_after` makes the
+    worker process exit abruptly, to exercise the supervisor's restarts.
+    """
+
+    def __init__(self, shard_ids: list[int], crash_after: float | None = None) -> None:
+        self.shard_ids: list[int] = shard_ids
+        self.crash_after: float | None = crash_after
+        self.started: float = time.monotonic()
+        self._stopped: asyncio.Event = asyncio.Event()
+
+    async def run(self) -> None:
+        timeout = self.crash_after
+        try:
+            async with asyncio.timeout(timeout):
+                await self._stopped.wait()
+        except TimeoutError:
+            logger.error("Fake gateway crashing after %.1fs", timeout)  # noqa: TRY400
+            os._exit(1)
+
+    async def close(self) -> None:
+        self._stopped.set()
+
+    def shard_reports(self, worker: int) -> list[ShardReport]:
+        now = time.time()
+        ready = time.monotonic() - self.started > 1
+        return [
+            ShardReport(
+                shard_id=shard_id,
+                worker=worker,
+                pid=os.getpid(),
+                is_ready=ready,
+                latency=random.uniform(0.03, 0.06) if ready else None,  # noqa: S311
+                user="FakeBot#0000",
+                reported_at=now,
+            )
+            for shard_id in self.shard_ids
+        ]
+
+
+async def report_shards(
+    source: ShardedDiscordBot | FakeGateway,
+    worker: int,
+    reports: "Queue[ShardReport]",
+) -> None:
+    """Periodically send the worker's shard states to the supervisor."""
+    while True:
+        for report in source.shard_reports(worker):
+            reports.put(report)
+        await asyncio.sleep(REPORT_INTERVAL)
+
+
+async def worker_main(
+    worker: int,
+    shard_ids: list[int],
+    shard_count: int,
+    reports: "Queue[ShardReport]",
+) -> None:
+    """Run one worker's shards until the process is told to stop."""
+    STARTUP.mark("import")
+    load_dotenv(override=True)
+    # Each worker writes its own log files, the API's included (its server
+    # logs, e.g. uvicorn.error, reach file_api); rotating one file from
+    # several processes would lose records
+    for name, default in WORKER_LOG_FILES.items():
+        log_file = Path(os.getenv(name, default))
+        os.environ[name] = f"{log_file.stem}-worker{worker}{log_file.suffix}"
+    # ...and so caches its own resolved logging config
+    if cache_file := os.getenv("LOG_CONFIG_CACHE"):
+        os.environ["LOG_CONFIG_CACHE"] = f"{cache_file}.worker{worker}"
+    configure_logger()
+    STARTUP.mark("config")
+    logger.info("Worker %d starting shards %s of %d", worker, shard_ids, shard_count)
+
+    source: ShardedDiscordBot | FakeGateway
+    store: StateStore | None = None
+    if os.getenv("SHARD_FAKE_GATEWAY"):
+        crash_after = os.getenv("SHARD_FAKE_CRASH_AFTER")
+        source = FakeGateway(shard_ids, float(crash_after) if crash_after else None)
+        run = source.run()
+    else:
+        if not (bot_token := os.getenv("BOT_TOKEN")):
+            logger.error("BOT_TOKEN is not set")
+            sys.exit(1)
+        intents = resolve_intents(ShardedDiscordBot)
+        # Workers share the database; a guild's state is only used by its shard
+        store = StateStore.from_env()
+        source = ShardedDiscordBot(
+            intents=intents,
+            store=store,
+            shard_ids=shard_ids,
+            shard_count=shard_count,
+            **cache_options(intents, resolve_max_messages(ShardedDiscordBot)),
+        )
+        run = source.start(bot_token)
+
+    loop = asyncio.get_running_loop()
+    loop.add_signal_handler(signal.SIGTERM, lambda: loop.create_task(source.close()))
+    watchdog = tune_loop(f"worker{worker}")
+    report_task = asyncio.create_task(report_shards(source, worker, reports))
+    try:
+        await run
+    finally:
+        report_task.cancel()
+        if watchdog:
+            watchdog.stop()
+        if store is not None:
+            await asyncio.to_thread(store.close, STORE_CLOSE_TIMEOUT)
+
+
+def run_worker(
+    worker: int,
+    shard_ids: list[int],
+    shard_count: int,
+    reports: "Queue[ShardReport]",
+) -> None:
+    """Worker process entry point."""
+    # Ctrl-C reaches the whole process group; the supervisor handles it
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    asyncio.run(
+        worker_main(worker, shard_ids, shard_count, reports),
+        loop_factory=loop_factory(),
+    )
+
+
+class WorkerHandle:
+    """A worker process and its restart bookkeeping."""
+
+    __slots__ = ("crashes", "index", "process", "restart_at", "shard_ids", "started")
+
+    def __init__(self, index: int, shard_ids: list[int]) -> None:
+        self.index: int = index
+        self.shard_ids: list[int] = shard_ids
+        self.process: SpawnProcess | None = None
+        self.started: float = 0.0
+        self.crashes: int = 0
+        self.restart_at: float | None = None
+
+
+class ShardSupervisor:
+    """
+    Starts a worker process per shard range, restarts workers that exit, and
+    aggregates their shard reports.
+
+    :param shard_count: total number of shards
+    :param processes:   number of worker processes to spread them over
+    """
+
+    def __init__(self, shard_count: int, processes: int) -> None:
+        self.shard_count: int = shard_count
+        self._context: multiprocessing.context.SpawnContext = (
+            multiprocessing.get_context("spawn")
+        )
+        self.reports: Queue[ShardReport] = self._context.Queue()
+        self.workers: list[WorkerHandle] = [
+            WorkerHandle(index, shard_ids)
+            for index, shard_ids in enumerate(split_shards(shard_count, processes))
+        ]
+        self.shards: dict[int, ShardReport] = {}
+        self.status_snapshot: StatusSnapshot = StatusSnapshot()
+        # Per-shard health as of the last monitor tick, for readers on other
+        # threads (the API may run on its own thread)
+        self.shard_snapshot: list[dict[str, Any]] = []
+        self._stopping: bool = False
+
+    def start_worker(self, worker: WorkerHandle) -> None:
+        process = self._context.Process(
+            target=run_worker,
+            args=(worker.index, worker.shard_ids, self.shard_count, self.reports),
+            name=f"shard-worker-{worker.index}",
+        )
+        process.start()
+        worker.process = process
+        worker.started = time.monotonic()
+        worker.restart_at = None
+        logger.info(
+            "Started worker %d (pid %s) for shards %s",
+            worker.index,
+            process.pid,
+            worker.shard_ids,
+        )
+
+    async def run(self) -> None:
+        """Start the workers and supervise them until cancelled."""
+        for worker in self.workers:
+            self.start_worker(worker)
+        try:
+            while True:
+                self.collect_reports()
+                self.check_workers()
+                self.update_snapshot()
+                await asyncio.sleep(MONITOR_INTERVAL)
+        finally:
+            await asyncio.to_thread(self.stop)
+
+    def collect_reports(self) -> None:
+        with contextlib.suppress(queue.Empty):
+            while True:
+                report = self.reports.get_nowait()
+                self.shards[report.shard_id] = report
+
+    def check_workers(self) -> None:
+        """Schedule restarts for exited workers and start those that are due."""
+        now = time.monotonic()
+        for worker in self.workers:
+            process = worker.process
+            if process is None or self._stopping:
+                continue
+            if worker.restart_at is not None:
+                if now >= worker.restart_at:
+                    self.start_worker(worker)
+                continue
+            if process.is_alive():
+                continue
+            if now - worker.started >= RESTART_STABLE_AFTER:
+                worker.crashes = 0
+            delay = min(
+                RESTART_BACKOFF_INITIAL * 2**worker.crashes, RESTART_BACKOFF_MAX
+            )
+            worker.crashes += 1
+            worker.restart_at = now + delay
+            for shard_id in worker.shard_ids:
+                self.shards.pop(shard_id, None)
+            logger.error(
+                "Worker %d (shards %s) exited with code %s, restarting in %.1fs",
+                worker.index,
+                worker.shard_ids,
+                process.exitcode,
+                delay,
+            )
+
+    def shard_status(self) -> list[dict[str, Any]]:
+        """Per-shard health for the API."""
+        now = time.time()
+        status = []
+        for worker in self.workers:
+            alive = worker.process is not None and worker.process.is_alive()
+            for shard_id in worker.shard_ids:
+                report = self.shards.get(shard_id)
+                fresh = (
+                    report is not None
+                    and now - report.reported_at <= REPORT_STALE_AFTER
+                )
+                status.append(
+                    {
+                        "shard_id": shard_id,
+                        "worker": worker.index,
+                        "pid": worker.process.pid if alive and worker.process else None,
+                        "alive": alive,
+                        "restarts": worker.crashes,
+                        "is_ready": bool(
+                            alive and fresh and report and report.is_ready
+                        ),
+                        "latency": report.latency if report else None,
+                        "last_report_age": now - report.reported_at if report else None,
+                    }
+                )
+        return status
+
+    def update_snapshot(self) -> None:
+        """
+        Aggregate the shards into the probe and /status snapshot.  The
+        supervisor is ready while every shard is, and live once any shard has
+        been: it restarts crashed workers itself, so one crashed shard
+        mustn't get the pod restarted.
+        """
+        shards = self.shard_status()
+        self.shard_snapshot = shards
+        latencies = [s["latency"] for s in shards if s["latency"] is not None]
+        user = next(iter(self.shards.values())).user if self.shards else None
+        self.status_snapshot.update(
+            is_ready=all(s["is_ready"] for s in shards),
+            is_live=any(s["is_ready"] for s in shards),
+            user=user,
+            latency=max(latencies) if latencies else None,
+        )
+
+    def stop(self) -> None:
+        """Ask every worker to exit, killing any that don't in time."""
+        self._stopping = True
+        processes = [w.process for w in self.workers if w.process is not None]
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+        deadline = time.monotonic() + STOP_TIMEOUT
+        for process in processes:
+            process.join(max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                logger.warning("Killing worker pid %s", process.pid)
+                process.kill()
+                process.join()
@@ -0,0 +1,89 @@
+"""
+Startup phase timing.
+
+`STARTUP` times from when the process started (so the "import" phase covers
+interpreter startup and every import before `main.py` marks it), `main.py`
+marks the end of each phase, and the bot finishes the report once it is
+connected and ready.  The report is a single log line whose phase durations
+are also attached as structured fields (`startup_<phase>_ms`), so the JSON log
+handlers emit them as separate keys.
+"""
+
+import logging
+import os
+import time
+from pathlib import Path
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+# Index of the start time (field 22) among the fields after the command name
+PROC_STAT_STARTTIME = 19
+
+
+def process_start_time() -> float:
+    """
+    The `time.perf_counter()` value when this process started, from /proc;
+    now where /proc isn't available.
+    """
+    now = time.perf_counter()
+    try:
+        stat = Path("/proc/self/stat").read_text(encoding="ascii")
+        uptime = float(Path("/proc/uptime").read_text(encoding="ascii").split()[0])
+        # The command name is parenthesized and may contain spaces
+        start_ticks = int(stat.rpartition(")")[2].split()[PROC_STAT_STARTTIME])
+        ticks_per_second = os.sysconf("SC_CLK_TCK")
+    except (AttributeError, OSError, ValueError, IndexError):
+        return now
+    return now - max(0.0, uptime - start_ticks / ticks_per_second)
+
+
+class StartupTimer:
+    """Wall-clock time spent in each consecutive startup phase."""
+
+    def __init__(self) -> None:
+        self.started: float = process_start_time()
+        self._last_mark: float = self.started
+        self.phases: dict[str, float] = {}
+        self.reported: bool = False
+
+    def mark(self, phase: str) -> None:
+        """End `phase`, which began when the previous phase ended."""
+        now = time.perf_counter()
+        self.phases[phase] = now - self._last_mark
+        self._last_mark = now
+
+    @property
+    def total(self) -> float:
+        return self._last_mark - self.started
+
+    def fields(self) -> dict[str, float]:
+        """Phase durations in milliseconds, as structured log fields."""
+        fields = {
+            f"startup_{phase}_ms": round(seconds * 1000, 1)
+            for phase, seconds in self.phases.items()
+        }
+        fields["startup_total_ms"] = round(self.total * 1000, 1)
+        return fields
+
+    def finish(self, phase: str) -> None:
+        """End the last phase and report; later calls (e.g. on reconnect) no-op."""
+        if self.reported:
+            return
+        self.mark(phase)
+        self.report()
+
+    def report(self) -> None:
+        """Log the phase durations."""
+        self.reported = True
+        logger.info(
+            "Startup took %.0f ms (%s)",
+            self.total * 1000,
+            ", ".join(
+                f"{phase} {seconds * 1000:.0f} ms"
+                for phase, seconds in self.phases.items()
+            ),
+            extra=self.fields(),
+        )
+
+
+STARTUP = StartupTimer()
@@ -0,0 +1,178 @@
+"""
+Pre-encoded /healthcheck, /ready and /status responses.
+
+The bot pushes its state into a `StatusSnapshot` when it changes (ready,
+disconnected, resumed, new heartbeat latency, shutting down), and the snapshot
+encodes the response bodies right then.  The probe endpoints just return the
+cached bytes, so a probe costs no model validation, serialization or client
+calls.
+
+/healthcheck is the liveness probe: it passes once the bot has first been
+ready, and keeps passing while the gateway reconnects (a Discord outage is no
+reason to restart the pod).  /ready is the readiness probe: it fails while the
+gateway is disconnected and once the bot is shutting down.
+"""
+
+import json
+import math
+from typing import NamedTuple
+
+JSON_MEDIA_TYPE = "application/json"
+
+HTTP_OK = 200
+HTTP_SERVICE_UNAVAILABLE = 503
+
+
+def encode_json(content: object) -> bytes:
+    """Encode a body the same way FastAPI's JSONResponse does."""
+    return json.dumps(
+        content, ensure_ascii=False, allow_nan=False, separators=(",", ":")
+    ).encode()
+
+
+HEALTHCHECK_LIVE: tuple[int, bytes] = (
+    HTTP_OK,
+    encode_json({"status": "ok", "message": "Bot is running"}),
+)
+HEALTHCHECK_READY: tuple[int, bytes] = (
+    HTTP_OK,
+    encode_json({"status": "ok", "message": "Bot is running and ready"}),
+)
+HEALTHCHECK_NOT_READY: tuple[int, bytes] = (
+    HTTP_SERVICE_UNAVAILABLE,
+    encode_json({"status": "not_ready", "message": "Bot is not ready"}),
+)
+HEALTHCHECK_SHUTTING_DOWN: tuple[int, bytes] = (
+    HTTP_SERVICE_UNAVAILABLE,
+    encode_json({"status": "shutting_down", "message": "Bot is shutting down"}),
+)
+
+
+class Snapshot(NamedTuple):
+    """Bot state plus its encoded responses, swapped in as one object."""
+
+    is_ready: bool
+    # Has been ready at least once (stays true across reconnects)
+    is_live: bool
+    user: str
+    latency: float | None
+    shutting_down: bool
+    time_to_ready: float | None
+    resumed: bool
+    healthcheck: tuple[int, bytes]
+    readiness: tuple[int, bytes]
+    status: bytes
+
+
+def build_snapshot(  # noqa: PLR0913
+    *,
+    is_ready: bool,
+    user: str,
+    latency: float | None,
+    is_live: bool = False,
+    shutting_down: bool = False,
+    time_to_ready: float | None = None,
+    resumed: bool = False,
+) -> Snapshot:
+    is_live = is_live or is_ready
+    if shutting_down:
+        # Not ready for good, whatever the gateway does meanwhile
+        is_ready = False
+        readiness = HEALTHCHECK_SHUTTING_DOWN
+    else:
+        readiness = HEALTHCHECK_READY if is_ready else HEALTHCHECK_NOT_READY
+    return Snapshot(
+        is_ready=is_ready,
+        is_live=is_live,
+        user=user,
+        latency=latency,
+        shutting_down=shutting_down,
+        time_to_ready=time_to_ready,
+        resumed=resumed,
+        healthcheck=HEALTHCHECK_LIVE if is_live else HEALTHCHECK_NOT_READY,
+        readiness=readiness,
+        status=encode_json(
+            {
+                "latency": latency,
+                "is_ready": is_ready,
+                "user": user,
+                "time_to_ready": time_to_ready,
+                "resumed": resumed,
+            }
+        ),
+    )
+
+
+class StatusSnapshot:
+    """
+    The bot's current state and pre-encoded probe responses.
+
+    Updates replace the whole `Snapshot` in a single assignment, so readers on
+    another thread or event loop always see a consistent set of bodies.
+    """
+
+    def __init__(self) -> None:
+        self.current: Snapshot = build_snapshot(
+            is_ready=False, user="Unknown", latency=None
+        )
+
+    def update(  # noqa: PLR0913
+        self,
+        *,
+        is_ready: bool | None = None,
+        is_live: bool | None = None,
+        user: str | None = None,
+        latency: float | None = None,
+        shutting_down: bool | None = None,
+        time_to_ready: float | None = None,
+        resumed: bool | None = None,
+    ) -> None:
+        """
+        Apply any changed fields and re-encode the responses.  Once shutting
+        down, the bot is reported as not ready.  Once ready (or reported live,
+        for a supervisor whose readiness is all its shards'), it is live for good.
+        """
+        current = self.current
+        if latency is not None and not math.isfinite(latency):
+            # No heartbeat yet; JSON has no representation for inf/nan
+            latency = None
+        new = (
+            current.is_ready if is_ready is None else is_ready,
+            current.is_live or bool(is_live),
+            current.user if user is None else user,
+            current.latency if latency is None else latency,
+            current.shutting_down if shutting_down is None else shutting_down,
+            current.time_to_ready if time_to_ready is None else time_to_ready,
+            current.resumed if resumed is None else resumed,
+        )
+        if new == (
+            current.is_ready,
+            current.is_live,
+            current.user,
+            current.latency,
+            current.shutting_down,
+            current.time_to_ready,
+            current.resumed,
+        ):
+            return
+        self.current = build_snapshot(
+            is_ready=new[0],
+            is_live=new[1],
+            user=new[2],
+            latency=new[3],
+            shutting_down=new[4],
+            time_to_ready=new[5],
+            resumed=new[6],
+        )
+
+    def healthcheck(self) -> tuple[int, bytes]:
+        """(status code, body) for /healthcheck (liveness)."""
+        return self.current.healthcheck
+
+    def readiness(self) -> tuple[int, bytes]:
+        """(status code, body) for /ready."""
+        return self.current.readiness
+
+    def status(self) -> bytes:
+        """Body for /status."""
+        return self.current.status
@@ -0,0 +1,335 @@
+"""
+Persistent key-value state for DiscordBot, in SQLite.
+
+Writes never touch the disk on the event loop: `StateStore.set` updates the
+in-memory cache and a write-behind buffer, where later writes to a key
+replace earlier ones that haven't been written yet.  A writer thread flushes
+the buffer every `flush_interval` seconds (or once `max_batch_size` keys are
+pending) in a single transaction.  Reads are served from the cache, or from
+the database on a worker thread (the database is in WAL mode, so reads don't
+wait for the writer).
+
+Values are anything `json` can serialize.  Values returned by `get` are
+shared with the cache: don't modify them, `set` a new value instead.
+
+Environment variables:
+- DATA_DIR: directory of the database file (`state.db`)
+- STORE_FLUSH_INTERVAL: seconds between flushes of the write-behind buffer
+- STORE_CACHE_ENTRIES: values kept in the read cache
+"""
+
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any
+
+from lib.cache import ENTRY_OVERHEAD, LRUCache
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+# Relative to the working directory, like the default LOG_DIR (the image sets
+# DATA_DIR=/app/data)
+DEFAULT_DATA_DIR = "data"
+STORE_FILENAME = "state.db"
+DEFAULT_FLUSH_INTERVAL = 1.0
+DEFAULT_MAX_BATCH_SIZE = 1000
+DEFAULT_CACHE_ENTRIES = 10_000
+# Seconds to wait for pending writes when the bot shuts down
+STORE_CLOSE_TIMEOUT = 10.0
+# Seconds to wait for SQLite's lock before failing a transaction
+BUSY_TIMEOUT = 5.0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS state (
+    namespace TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    updated REAL NOT NULL,
+    PRIMARY KEY (namespace, key)
+) WITHOUT ROWID
+"""
+UPSERT = (
+    "INSERT INTO state (namespace, key, value, updated) VALUES (?, ?, ?, ?) "
+    "ON CONFLICT (namespace, key) DO UPDATE "
+    "SET value = excluded.value, updated = excluded.updated"
+)
+DELETE = "DELETE FROM state WHERE namespace = ? AND key = ?"
+SELECT = "SELECT value FROM state WHERE namespace = ? AND key = ?"
+SELECT_NAMESPACE = "SELECT key, value FROM state WHERE namespace = ?"
+
+StoreKey = tuple[str, str]
+# Stands for a deleted key in the write-behind buffer (None is a valid value)
+DELETED: str = "\x00deleted"
+
+
+class StoredValue:
+    """A cached value (or the knowledge that the key has none)."""
+
+    __slots__ = ("found", "nbytes", "value")
+
+    def __init__(self, value: Any, encoded: str | None) -> None:  # noqa: ANN401
+        self.value: Any = value
+        self.found: bool = encoded is not None
+        self.nbytes: int = ENTRY_OVERHEAD + (len(encoded) if encoded else 0)
+
+
+def connect(path: str) -> sqlite3.Connection:
+    """Open the database in WAL mode, with autocommit off for explicit batches."""
+    connection = sqlite3.connect(
+        path, timeout=BUSY_TIMEOUT, check_same_thread=False, isolation_level=None
+    )
+    connection.execute("PRAGMA journal_mode=WAL")
+    # Safe with WAL: a power loss can lose the last commits, not corrupt the file
+    connection.execute("PRAGMA synchronous=NORMAL")
+    return connection
+
+
+class StateStore:
+    """
+    SQLite-backed key-value store with write-behind batching and a read cache.
+
+    Keys are (namespace, key) pairs, e.g. ("guild_settings", "1234").  `set`,
+    `delete` and `get_cached` are for the bot's event loop; `flush` and
+    `close` block, so call them with `asyncio.to_thread` from the loop.
+
+    :param path:           database file (created with its directory)
+    :param flush_interval: seconds between flushes of pending writes
+    :param max_batch_size: pending keys that trigger a flush right away
+    :param cache_entries:  values kept in the read cache
+    """
+
+    def __init__(
+        self,
+        path: str,
+        flush_interval: float = DEFAULT_FLUSH_INTERVAL,
+        max_batch_size: int = DEFAULT_MAX_BATCH_SIZE,
+        cache_entries: int = DEFAULT_CACHE_ENTRIES,
+    ) -> None:
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.path: str = path
+        self.flush_interval: float = flush_interval
+        self.max_batch_size: int = max_batch_size
+        self.cache: LRUCache[StoreKey, StoredValue] = LRUCache(
+            "store", max_entries=cache_entries, ttl=0
+        )
+        self.writes: int = 0
+        self.coalesced: int = 0
+        self.written: int = 0
+        self.batches: int = 0
+        self.errors: int = 0
+
+        self._writer_connection: sqlite3.Connection = connect(path)
+        self._writer_connection.execute(SCHEMA)
+        self._reader_connection: sqlite3.Connection = connect(path)
+        self._reader_lock: threading.Lock = threading.Lock()
+        # Encoded values (or DELETED) waiting to be written, and being written
+        self._pending: dict[StoreKey, str] = {}
+        self._inflight: dict[StoreKey, str] = {}
+        self._enqueued: int = 0
+        self._flushed: int = 0
+        self._closing: bool = False
+        self._flush_requested: bool = False
+        self._cond: threading.Condition = threading.Condition()
+        self._writer: threading.Thread = threading.Thread(
+            target=self._run, name=f"StateStore({path})", daemon=True
+        )
+        self._writer.start()
+
+    @classmethod
+    def from_env(cls) -> "StateStore":
+        data_dir = os.getenv("DATA_DIR", DEFAULT_DATA_DIR)
+        flush_interval = os.getenv("STORE_FLUSH_INTERVAL", str(DEFAULT_FLUSH_INTERVAL))
+        cache_entries = os.getenv("STORE_CACHE_ENTRIES", str(DEFAULT_CACHE_ENTRIES))
+        return cls(
+            str(Path(data_dir, STORE_FILENAME)),
+            flush_interval=float(flush_interval),
+            cache_entries=int(cache_entries),
+        )
+
+    def set(self, namespace: str, key: str, value: Any) -> None:  # noqa: ANN401
+        """
+        Store a value.  It is readable right away and written to disk with the
+        next batch.  Raises TypeError if the value can't be serialized.
+        """
+        encoded = json.dumps(value, separators=(",", ":"))
+        self._enqueue((namespace, key), encoded)
+        self.cache.put((namespace, key), StoredValue(value, encoded))
+
+    def delete(self, namespace: str, key: str) -> None:
+        """Remove a key (with the next batch)."""
+        self._enqueue((namespace, key), DELETED)
+        self.cache.put((namespace, key), StoredValue(None, None))
+
+    def _enqueue(self, store_key: StoreKey, encoded: str) -> None:
+        with self._cond:
+            if self._closing:
+                msg = "The state store is closed"
+                raise RuntimeError(msg)
+            if store_key in self._pending:
+                self.coalesced += 1
+            self._pending[store_key] = encoded
+            self._enqueued += 1
+            self.writes += 1
+            if len(self._pending) >= self.max_batch_size:
+                self._cond.notify_all()
+
+    def get_cached(self, namespace: str, key: str, default: Any = None) -> Any:  # noqa: ANN401
+        """The value if it is cached, else `default` (even if it is stored)."""
+        stored = self.cache.get((namespace, key))
+        if stored is None or not stored.found:
+            return default
+        return stored.value
+
+    async def get(self, namespace: str, key: str, default: Any = None) -> Any:  # noqa: ANN401
+        """The value of a key, read through the cache, or `default`."""
+        store_key = (namespace, key)
+        stored = self.cache.get(store_key)
+        if stored is None:
+            encoded = self._unwritten(store_key)
+            if encoded is None:
+                encoded = await asyncio.to_thread(self._read, store_key)
+            elif encoded == DELETED:
+                encoded = None
+            # A `set` while the read ran wins over what was read
+            stored = self.cache.peek(store_key)
+            if stored is None:
+                value = json.loads(encoded) if encoded is not None else None
+                stored = StoredValue(value, encoded)
+                self.cache.put(store_key, stored)
+        return stored.value if stored.found else default
+
+    async def items(self, namespace: str) -> dict[str, Any]:
+        """Every key and value of a namespace, including unwritten changes."""
+        rows = await asyncio.to_thread(self._read_namespace, namespace)
+        with self._cond:
+            unwritten = {**self._inflight, **self._pending}
+        for (row_namespace, key), encoded in unwritten.items():
+            if row_namespace == namespace:
+                rows[key] = encoded
+        return {
+            key: json.loads(encoded)
+            for key, encoded in rows.items()
+            if encoded != DELETED
+        }
+
+    def _unwritten(self, store_key: StoreKey) -> str | None:
+        """A key's value that is pending or being written, if any."""
+        with self._cond:
+            encoded = self._pending.get(store_key)
+            return self._inflight.get(store_key) if encoded is None else encoded
+
+    def _read(self, store_key: StoreKey) -> str | None:
+        with self._reader_lock:
+            row = self._reader_connection.execute(SELECT, store_key).fetchone()
+        return row[0] if row is not None else None
+
+    def _read_namespace(self, namespace: str) -> dict[str, str]:
+        with self._reader_lock:
+            return dict(self._reader_connection.execute(SELECT_NAMESPACE, (namespace,)))
+
+    def flush(self, timeout: float | None = None) -> bool:
+        """
+        Block until every write made so far is on disk.  Returns False if
+        `timeout` expired first.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            target = self._enqueued
+            self._flush_requested = True
+            self._cond.notify_all()
+            while self._flushed < target and self._writer.is_alive():
+                wait = self.flush_interval
+                if deadline is not None:
+                    wait = min(wait, deadline - time.monotonic())
+                    if wait <= 0:
+                        return False
+                self._cond.wait(wait)
+            return self._flushed >= target
+
+    def close(self, timeout: float | None = None) -> bool:
+        """
+        Write the pending changes and close the database.  Returns False if
+        `timeout` expired first (the writer keeps going in the background).
+        """
+        with self._cond:
+            self._closing = True
+            self._cond.notify_all()
+        self._writer.join(timeout)
+        if self._writer.is_alive():
+            return False
+        with self._reader_lock:
+            self._reader_connection.close()
+        return True
+
+    def _run(self) -> None:
+        """Writer thread: swap out the pending writes and commit them as one batch."""
+        while True:
+            with self._cond:
+                if len(self._pending) < self.max_batch_size and not (
+                    self._closing or self._flush_requested
+                ):
+                    self._cond.wait(self.flush_interval)
+                self._inflight, self._pending = self._pending, {}
+                enqueued = self._enqueued
+                self._flush_requested = False
+                closing = self._closing
+            batch = self._inflight
+            if batch and not self._write_batch(batch):
+                with self._cond:
+                    # Retry, unless the keys have been written to since
+                    self._pending = {**batch, **self._pending}
+                    self._inflight = {}
+                if not closing:
+                    time.sleep(self.flush_interval)
+                    continue
+                logger.error("Lost %d state store writes on close", len(batch))
+            with self._cond:
+                self._inflight = {}
+                self._flushed = enqueued
+                self._cond.notify_all()
+            if closing:
+                self._writer_connection.close()
+                return
+
+    def _write_batch(self, batch: dict[StoreKey, str]) -> bool:
+        now = time.time()
+        upserts = [
+            (namespace, key, encoded, now)
+            for (namespace, key), encoded in batch.items()
+            if encoded != DELETED
+        ]
+        deletes = [
+            store_key for store_key, encoded in batch.items() if encoded == DELETED
+        ]
+        connection = self._writer_connection
+        try:
+            connection.execute("BEGIN IMMEDIATE")
+            connection.executemany(UPSERT, upserts)
+            connection.executemany(DELETE, deletes)
+            connection.execute("COMMIT")
+        except sqlite3.Error:
+            self.errors += 1
+            logger.exception("Error writing %d keys to the state store", len(batch))
+            if connection.in_transaction:
+                connection.execute("ROLLBACK")
+            return False
+        self.written += len(batch)
+        self.batches += 1
+        return True
+
+    def stats(self) -> dict[str, Any]:
+        """Write counters and the read cache's stats."""
+        return {
+            "pending": len(self._pending),
+            "writes": self.writes,
+            "coalesced": self.coalesced,
+            "written": self.written,
+            "batches": self.batches,
+            "errors": self.errors,
+            "cache": self.cache.stats(),
+        }
@@ -1,12 +1,19 @@
+import importlib.util
 import logging
+import os
+import resource
 import sys
 from logging import Logger
+from pathlib import Path
+from types import ModuleType
 
 PORT_MIN = 0
 PORT_MAX = 65535
 
 logger: Logger = logging.getLogger(__name__)
 
+STATM_PATH = Path("/proc/self/statm")
+
 
 # Define an inner function for validating the API_PORT
 def ensure_valid_port(port: int) -> int:
@@ -27,3 +34,35 @@ def validate_port(port: int) -> int:
     except ValueError:
         logger.exception("Targeted port is not valid: %s", port)
         sys.exit(1)
+
+
+def resident_memory_bytes() -> int:
+    """
+    Current resident set size of this process.  Falls back to the peak RSS
+    where /proc isn't available.
+    """
+    try:
+        resident_pages = int(STATM_PATH.read_text().split()[1])
+    except (OSError, IndexError, ValueError):
+        # ru_maxrss is in KiB on Linux (bytes on macOS, close enough here)
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return resident_pages * os.sysconf("SC_PAGE_SIZE")
+
+
+def lazy_import(name: str) -> ModuleType:
+    """
+    Return a module that is only executed on its first attribute access, for
+    dependencies that only some code paths need.
+    """
+    if (module := sys.modules.get(name)) is not None:
+        return module
+    spec = importlib.util.find_spec(name)
+    if spec is None or spec.loader is None:
+        msg = f"No module named {name!r}"
+        raise ModuleNotFoundError(msg, name=name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
@@ -1,35 +1,150 @@
 """Driver for the garage-discordbot project"""
 
 import asyncio
+import contextlib
 import logging.handlers
 import os
 import sys
 from logging import Logger
+from typing import TYPE_CHECKING
 
-import discord
-from discord import Intents
 from dotenv import load_dotenv
 
-from lib.api import start_fastapi_server
-from lib.bot import DiscordBot
-from lib.logger_setup import configure_logger
+import lib
+from lib.loops import loop_factory, start_lag_monitor, tune_loop
+from lib.startup import STARTUP
 from lib.utils import validate_port
 
+# The bot, API and shard modules pull in discord, fastapi and pydantic; they
+# are imported through `lib` on first use, after logging is configured (which
+# imports uvicorn for the access log formatter)
+if TYPE_CHECKING:
+    from lib.api import ApiServerTask, ApiServerThread
+    from lib.lifecycle import ShutdownCoordinator
+    from lib.store import StateStore
+
 logger: Logger = logging.getLogger(__name__)
 
+API_MODES = ("loop", "thread")
+# Seconds each shutdown phase may take.  Together (6 + 10 + 5 + 6 + 4 = 31s)
+# they fit in the 40s terminationGracePeriodSeconds of kubernetes/discordbot.yaml.
+SHUTDOWN_API_TIMEOUT = 6.0
+SHUTDOWN_HANDLERS_TIMEOUT = 10.0
+SHUTDOWN_GATEWAY_TIMEOUT = 5.0
+SHUTDOWN_STORE_TIMEOUT = 5.0
+SHUTDOWN_LOGS_TIMEOUT = 3.0
 
-async def main() -> None:
-    """Main driver function"""
-    # Load .env contents into system ENV
-    # !! Vars defined in .env will override any default env var values !!
-    load_dotenv(override=True)
 
-    # Set up logging
-    configure_logger()
+def resolve_api_mode() -> str:
+    """
+    Whether the API server shares the bot's event loop ("loop") or runs on its
+    own thread and loop ("thread")
+    """
+    mode = os.getenv("API_MODE", "loop").strip().lower()
+    if mode not in API_MODES:
+        logger.error("API_MODE must be one of %s, not %r", API_MODES, mode)
+        sys.exit(1)
+    return mode
 
-    # Validate the port number
-    api_port = validate_port(int(os.getenv("API_PORT", "8080")))
 
+def start_api(api_mode: str, api_port: int) -> "ApiServerTask | ApiServerThread":
+    """
+    Run the FastAPI server on this loop, or on its own thread so probes are
+    answered even while the bot's loop is busy
+    """
+    logger.info("Starting FastAPI server (%s mode)...", api_mode)
+    api = (
+        lib.api.ApiServerThread(api_port)
+        if api_mode == "thread"
+        else lib.api.ApiServerTask(api_port)
+    )
+    api.start()
+    return api
+
+
+async def stop_api(api: "ApiServerTask | ApiServerThread") -> None:
+    """
+    Stop the FastAPI server, on whichever loop it runs, letting in-flight
+    requests finish
+    """
+    if isinstance(api, lib.api.ApiServerThread):
+        await asyncio.to_thread(api.stop)
+    else:
+        await api.stop()
+    logger.info("FastAPI server stopped.")
+
+
+async def close_store(store: "StateStore") -> None:
+    """Write the state changes that are still buffered"""
+    if not await asyncio.to_thread(store.close, SHUTDOWN_STORE_TIMEOUT):
+        logger.warning(
+            "Timed out writing %d state store changes", store.stats()["pending"]
+        )
+
+
+def add_log_phase(shutdown: "ShutdownCoordinator") -> None:
+    """Wait for queued log records to be written, last"""
+    shutdown.add_phase(
+        "logs",
+        lambda: asyncio.to_thread(
+            lib.logger_setup.drain_queue_listeners, SHUTDOWN_LOGS_TIMEOUT
+        ),
+        SHUTDOWN_LOGS_TIMEOUT + 1,
+    )
+
+
+async def run_sharded(
+    shard_count: int, processes: int, api_port: int, api_mode: str
+) -> None:
+    """Run the bot as a supervisor of sharded worker processes"""
+    supervisor = lib.shards.ShardSupervisor(shard_count, processes)
+    logger.info(
+        "Starting %d shards across %d worker processes...",
+        shard_count,
+        len(supervisor.workers),
+    )
+    lib.api.attach_supervisor(supervisor)
+    api = start_api(api_mode, api_port)
+    supervisor_task = asyncio.create_task(supervisor.run())
+    # Each worker reports its own connect time
+    STARTUP.finish("setup")
+
+    async def stop_accepting() -> None:
+        supervisor.status_snapshot.update(shutting_down=True)
+        await stop_api(api)
+
+    async def stop_workers() -> None:
+        # The supervisor stops the workers (each drains its own bot) on exit
+        supervisor_task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await supervisor_task
+
+    # Stop the workers cleanly when the container is stopped
+    shutdown = lib.lifecycle.ShutdownCoordinator()
+    shutdown.add_phase("api", stop_accepting, SHUTDOWN_API_TIMEOUT)
+    shutdown.add_phase("workers", stop_workers, lib.shards.STOP_TIMEOUT + 1)
+    add_log_phase(shutdown)
+    shutdown.install_signal_handlers()
+    try:
+        await shutdown.wait(supervisor_task)
+        await shutdown.run()
+    finally:
+        shutdown.remove_signal_handlers()
+
+
+def resolve_resume_max_age() -> float:
+    """
+    Age up to which the last run's gateway session is resumed rather than
+    identifying; 0 unless GATEWAY_RESUME is set
+    """
+    if not os.getenv("GATEWAY_RESUME"):
+        return 0.0
+    default = str(lib.resume.DEFAULT_RESUME_MAX_AGE)
+    return float(os.getenv("GATEWAY_RESUME_MAX_AGE", default))
+
+
+async def run_bot(api_port: int, api_mode: str) -> None:
+    """Run the bot and the API in this process until shut down"""
     # Retrieve bot token
     logger.info("Retrieving bot token...")
     if not (bot_token := os.getenv("BOT_TOKEN")):
@@ -38,30 +153,96 @@ async def main() -> None:
 
     # Initialize the bot
     logger.info("Initializing bot...")
-    intents: Intents = discord.Intents.all()
-    bot: DiscordBot = DiscordBot(intents=intents)
+    bot_class = lib.bot.DiscordBot
+    intents = lib.intents.resolve_intents(bot_class)
+    max_messages = lib.intents.resolve_max_messages(bot_class)
+    store = lib.store.StateStore.from_env()
+    bot = bot_class(
+        intents=intents,
+        store=store,
+        resume_max_age=resolve_resume_max_age(),
+        **lib.intents.cache_options(intents, max_messages),
+    )
+
+    lib.api.attach_bot(bot)
+    api = start_api(api_mode, api_port)
+    # The bot ends the "connect" phase and reports once it is ready
+    STARTUP.mark("setup")
+
+    async def stop_accepting() -> None:
+        # Fail the readiness probe first, then stop taking requests
+        bot.status_snapshot.update(shutting_down=True)
+        await stop_api(api)
 
-    # Create a task for the FastAPI server
-    logger.info("Starting FastAPI server...")
-    api_task = asyncio.create_task(start_fastapi_server(bot=bot, port=api_port))
+    # On SIGTERM/SIGINT (or if the bot stops by itself), drain in order
+    shutdown = lib.lifecycle.ShutdownCoordinator()
+    shutdown.add_phase("api", stop_accepting, SHUTDOWN_API_TIMEOUT)
+    # Handle the queued messages and send their replies
+    shutdown.add_phase("handlers", bot.drain, SHUTDOWN_HANDLERS_TIMEOUT)
+    # Drained (or given up on) above, so closing only waits on the gateway
+    shutdown.add_phase(
+        "gateway", lambda: bot.close(drain=False), SHUTDOWN_GATEWAY_TIMEOUT
+    )
+    shutdown.add_phase("store", lambda: close_store(store), SHUTDOWN_STORE_TIMEOUT + 1)
+    add_log_phase(shutdown)
+    shutdown.install_signal_handlers()
 
     # Run the Discord bot
     logger.info("Starting Discord bot...")
+    bot_task = asyncio.create_task(bot.start(bot_token))
+    try:
+        await shutdown.wait(bot_task)
+        await shutdown.run()
+        bot_task.cancel()  # if closing the gateway timed out
+        with contextlib.suppress(asyncio.CancelledError):
+            await bot_task  # raises if the bot failed to start
+    finally:
+        shutdown.remove_signal_handlers()
+
+
+async def main() -> None:
+    """Main driver function"""
+    STARTUP.mark("import")
+
+    # Set up logging
+    lib.logger_setup.configure_logger()
+    STARTUP.mark("config")
+
+    # Optionally hot-reload the logging config when the YAML file changes
+    watch_task: asyncio.Task[None] | None = None
+    if (watch_interval := float(os.getenv("LOG_CONFIG_WATCH_INTERVAL", "0"))) > 0:
+        watch_task = asyncio.create_task(
+            lib.logger_setup.watch_logger_config(watch_interval)
+        )
+
+    # Validate the port number
+    api_port = validate_port(int(os.getenv("API_PORT", "8080")))
+    api_mode = resolve_api_mode()
+
+    # Measure how late the main loop runs its callbacks, and catch stalls
+    watchdog = tune_loop("main")
+    lag_task = start_lag_monitor("main")
+
     try:
-        await bot.start(bot_token)
-    except asyncio.CancelledError:
-        logger.info("FastAPI server task cancelled.")
+        # In sharded mode, worker processes run the bot; this process supervises
+        if (shard_count := int(os.getenv("SHARD_COUNT", "0"))) > 0:
+            processes = int(os.getenv("SHARD_PROCESSES", str(os.cpu_count() or 1)))
+            await run_sharded(shard_count, processes, api_port, api_mode)
+        else:
+            await run_bot(api_port, api_mode)
     finally:
-        # Ensure FastAPI server task is finalized when bot stops
-        api_task.cancel()
-        try:
-            await api_task
-        except asyncio.CancelledError:
-            logger.info("FastAPI server task cancelled.")
+        lag_task.cancel()
+        if watchdog:
+            watchdog.stop()
+        if watch_task:
+            watch_task.cancel()
 
 
 if __name__ == "__main__":
+    # Load .env contents into system ENV before the event loop is chosen
+    # !! Vars defined in .env will override any default env var values !!
+    load_dotenv(override=True)
     try:
-        asyncio.run(main())
+        asyncio.run(main(), loop_factory=loop_factory())
     except KeyboardInterrupt:
         logger.info("Shutting down gracefully...")